@@ -0,0 +1,127 @@
+"""Retention and fake-ratio analytics over a guild's invite history.
+
+Relationships are loaded in chunks into columnar NumPy arrays and every
+statistic is computed with whole-array operations, so large guilds cost a
+few array passes rather than a Python loop per member. NumPy is optional
+(pip install .[analytics]); without it RetentionAnalyzer.available is False.
+"""
+import asyncio
+import csv
+import io
+import time
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Days after joining at which retention is measured
+RETENTION_DAYS = (1, 7, 30, 90)
+
+# Reports are rebuilt at least this often even without new relationships,
+# since members keep crossing the retention checkpoints
+CACHE_TTL_SECONDS = 3600
+
+class InviterRetention(NamedTuple):
+    user_id: int
+    joins: int
+    fakes: int
+    fake_ratio: float
+    # Share of genuine invitees still present N days after joining, for each of
+    # RETENTION_DAYS; None where nobody has been in the guild that long yet
+    retention: tuple
+
+class RetentionReport:
+    def __init__(self, guild_id, generated_at, members, inviters):
+        self.guild_id = guild_id
+        self.generated_at = generated_at
+        self.members = members
+        self.inviters = inviters  # [InviterRetention, ...] most joins first
+
+    def ranked(self, days=30, min_members=5):
+        """Inviters with at least min_members measurable invitees, best retention at days first"""
+        index = RETENTION_DAYS.index(days)
+        measured = [inviter for inviter in self.inviters
+                    if inviter.retention[index] is not None and inviter.joins - inviter.fakes >= min_members]
+        return sorted(measured, key=lambda inviter: inviter.retention[index], reverse=True)
+
+    def to_csv(self):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["inviter_id", "joins", "fakes", "fake_ratio"] + [f"retention_{days}d" for days in RETENTION_DAYS])
+        for inviter in self.inviters:
+            writer.writerow([inviter.user_id, inviter.joins, inviter.fakes, f"{inviter.fake_ratio:.4f}"]
+                            + ["" if value is None else f"{value:.4f}" for value in inviter.retention])
+        return output.getvalue()
+
+def compute_retention(guild_id, joined_at, inviter_ids, left_at, is_fake, now):
+    """Build a RetentionReport from parallel relationship columns (left_at -1 = still here)"""
+    inviters, inverse = np.unique(inviter_ids, return_inverse=True)
+    slots = len(inviters)
+    joins = np.bincount(inverse, minlength=slots)
+    fakes = np.bincount(inverse, weights=is_fake, minlength=slots).astype(np.int64)
+
+    genuine = is_fake == 0
+    stayed_for = np.where(left_at < 0, now, left_at) - joined_at
+    curves = []
+    for days in RETENTION_DAYS:
+        horizon = days * 86400
+        # Only members who joined at least `days` ago can count towards the checkpoint
+        eligible = genuine & (joined_at <= now - horizon)
+        retained = eligible & (stayed_for >= horizon)
+        eligible_count = np.bincount(inverse[eligible], minlength=slots)
+        retained_count = np.bincount(inverse[retained], minlength=slots)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curves.append(np.where(eligible_count > 0, retained_count / eligible_count, np.nan))
+    curves = np.column_stack(curves)
+
+    order = np.argsort(-joins, kind='stable')
+    inviters_out = [
+        InviterRetention(
+            int(inviters[i]), int(joins[i]), int(fakes[i]), float(fakes[i] / joins[i]),
+            tuple(None if np.isnan(value) else float(value) for value in curves[i])
+        )
+        for i in order
+    ]
+    return RetentionReport(guild_id, now, len(joined_at), inviters_out)
+
+class RetentionAnalyzer:
+    """Computes RetentionReports and caches one per guild.
+
+    A cached report is reused while the guild's relationship version (row
+    count and latest updated_at, the same high-water mark reconciliation
+    uses) is unchanged and the report is under CACHE_TTL_SECONDS old."""
+
+    def __init__(self, db):
+        self.db = db
+        self._cache = {}  # guild_id -> (version, report)
+
+    @property
+    def available(self):
+        return np is not None
+
+    async def report(self, guild_id):
+        version = await self.db.get_relationship_version(guild_id)
+        cached = self._cache.get(guild_id)
+        if cached and cached[0] == version and time.time() - cached[1].generated_at < CACHE_TTL_SECONDS:
+            return cached[1]
+
+        columns = await self._load(guild_id)
+        report = await asyncio.to_thread(compute_retention, guild_id, *columns, int(time.time()))
+        self._cache[guild_id] = (version, report)
+        return report
+
+    async def _load(self, guild_id):
+        """(joined_at, inviter_id, left_at, is_fake) int64 arrays for the guild"""
+        chunks = []
+        cursor = (-1, 0)
+        while True:
+            rows = await self.db.get_relationship_chunk(guild_id, cursor)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+            cursor = rows[-1][:2]
+        data = np.concatenate(chunks) if chunks else np.empty((0, 5), dtype=np.int64)
+        # Columns: joined_at, id, inviter_id, left_at, is_fake
+        return data[:, 0], data[:, 2], data[:, 3], data[:, 4]
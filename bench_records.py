@@ -0,0 +1,66 @@
+"""Compare per-row dicts with the records.py row types on a large giveaway result set.
+
+    python bench_records.py --rows 200000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from records import Giveaway, columns
+
+def as_dicts(rows):
+    # The shape Database returned before records.py
+    return [{
+        'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
+        'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
+        'ends_at': row[7], 'status': row[8], 'created_at': row[9],
+        'announce_message_id': row[10], 'bonus_role_id': row[11], 'bonus_role_entries': row[12],
+        'entries_per_invite': row[13], 'min_invites': row[14], 'min_account_age_days': row[15],
+        'required_role_id': row[16], 'entry_count': row[17]
+    } for row in rows]
+
+def as_records(rows):
+    return list(map(Giveaway._make, rows))
+
+def measure(build, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(rows)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = build(rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        conn.execute(f"CREATE TABLE giveaways ({columns(Giveaway)})")
+        conn.executemany(
+            f"INSERT INTO giveaways VALUES ({', '.join('?' * len(Giveaway._fields))})",
+            ((i, 1, 2, f"Prize {i}", 10**17 + i, 3, 1, 1893456000, "active",
+              1767225600, None, None, 0, 0.0, None, None, None, i % 500)
+             for i in range(args.rows))
+        )
+        rows = conn.execute(f"SELECT {columns(Giveaway)} FROM giveaways").fetchall()
+        conn.close()
+
+    print(f"{'shape':<8} {'ns/row':>8} {'bytes/row':>10}")
+    for name, build in (("dict", as_dicts), ("record", as_records)):
+        seconds, size = measure(build, rows, args.repeat)
+        print(f"{name:<8} {seconds / len(rows) * 1e9:>8.0f} {size / len(rows):>10.0f}")
+
+if __name__ == "__main__":
+    main()
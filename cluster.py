@@ -0,0 +1,82 @@
+"""Run the bot as several worker processes, each owning a slice of the shards.
+
+Usage: python cluster.py --clusters 2 [--shards 8]
+
+Without --shards the recommended shard count is fetched from Discord. Every
+worker runs main.py as an AutoShardedBot with its own SHARD_IDS and shares the
+SQLite database with the others; crashed workers are restarted.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Discord allows one IDENTIFY per 5 seconds per bucket
+IDENTIFY_DELAY = 5
+RESTART_DELAY = 10
+
+def recommended_shard_count(token):
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (cluster launcher, 1.0)"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["shards"]
+
+def split_shards(shard_count, cluster_count):
+    """Split shard ids into contiguous, evenly sized chunks"""
+    base, extra = divmod(shard_count, cluster_count)
+    chunks, start = [], 0
+    for i in range(cluster_count):
+        size = base + (1 if i < extra else 0)
+        chunks.append(list(range(start, start + size)))
+        start += size
+    return [chunk for chunk in chunks if chunk]
+
+def start_worker(cluster_id, shard_ids, shard_count):
+    env = dict(os.environ)
+    env["CLUSTER_ID"] = str(cluster_id)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = ",".join(str(s) for s in shard_ids)
+    print(f"Starting cluster {cluster_id} with shards {shard_ids}")
+    return subprocess.Popen([sys.executable, "main.py"], env=env)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as multiple shard clusters")
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--shards", type=int, default=None, help="Total shard count (default: Discord's recommendation)")
+    args = parser.parse_args()
+
+    token = os.getenv("DISCORD_TOKEN")
+    if not token:
+        print("ERROR: DISCORD_TOKEN environment variable not set!")
+        sys.exit(1)
+
+    shard_count = args.shards or recommended_shard_count(token)
+    clusters = split_shards(shard_count, max(1, args.clusters))
+    print(f"Running {shard_count} shard(s) across {len(clusters)} cluster(s)")
+
+    workers = {}
+    for cluster_id, shard_ids in enumerate(clusters):
+        workers[cluster_id] = start_worker(cluster_id, shard_ids, shard_count)
+        # Stagger startup so workers don't all IDENTIFY at once
+        time.sleep(IDENTIFY_DELAY * len(shard_ids))
+
+    try:
+        while True:
+            time.sleep(RESTART_DELAY)
+            for cluster_id, process in workers.items():
+                if process.poll() is not None:
+                    print(f"Cluster {cluster_id} exited with code {process.returncode}, restarting")
+                    workers[cluster_id] = start_worker(cluster_id, clusters[cluster_id], shard_count)
+    except KeyboardInterrupt:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,201 @@
+import asyncio
+import hashlib
+from functools import lru_cache
 import sqlite3
-from datetime import datetime, timezone
+import random
 import threading
+import time
+
+from records import (ClaimEntry, DownstreamStats, Giveaway, GiveawaySchedule, GuildSettings, InviteActivity, InviterPeriodStats,
+                     InviteStats, InviteTreeNode, columns, fetch_all, fetch_one)
+from sampling import weighted_sample
+
+# Column default for timestamps: integer seconds since the Unix epoch, UTC
+EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Timestamp columns converted from SQLite's CURRENT_TIMESTAMP text by schema version 1
+TIMESTAMP_COLUMNS = (
+    ("user_invites", "created_at"),
+    ("invite_codes", "created_at"),
+    ("invite_relationships", "joined_at"),
+    ("giveaways", "created_at"),
+    ("giveaway_entries", "entered_at"),
+    ("giveaway_winners", "created_at"),
+    ("giveaway_schedules", "created_at"),
+    ("role_permissions", "created_at"),
+)
+
+# PRAGMA user_version once every migration in create_tables has run
+SCHEMA_VERSION = 4
+
+# Rows converted per transaction, so the migration never holds the write lock for long
+MIGRATION_BATCH_SIZE = 5000
+
+# Inviters applied per transaction by sync_historical_invites
+SYNC_CHUNK_SIZE = 500
+
+# Inviters recomputed per transaction by reconcile_invite_counters
+RECONCILE_BATCH_SIZE = 500
+
+# user_invites counters and the baseline column holding the part of each
+# that has no invite_relationships rows behind it (pre-tracking history, manual edits)
+COUNTER_BASELINES = {
+    'total_invites': 'historical_total',
+    'left_invites': 'historical_left',
+    'fake_invites': 'historical_fake',
+}
+
+# Relationship rows returned per get_relationship_chunk call
+RELATIONSHIP_CHUNK_SIZE = 50000
+
+# Rows returned per get_export_chunk call
+EXPORT_CHUNK_SIZE = 5000
+
+# Per-guild exports: table -> (columns, FROM clause, guild column, positions of
+# the keyset columns). Each keyset matches an index led by the guild column,
+# so every chunk is a short range scan with no sort
+EXPORT_TABLES = {
+    'user_invites': (
+        ('user_id', 'guild_id', 'total_invites', 'left_invites', 'fake_invites', 'bonus_invites', 'claimed_invites',
+         'historical_total', 'historical_left', 'historical_fake', 'created_at'),
+        'user_invites', 'guild_id', (0,),
+    ),
+    'invite_relationships': (
+        ('id', 'guild_id', 'inviter_id', 'invited_user_id', 'joined_at', 'left_at', 'is_fake', 'updated_at'),
+        'invite_relationships', 'guild_id', (4, 0),
+    ),
+    'giveaways': (
+        ('id', 'guild_id', 'host_id', 'prize', 'message_id', 'channel_id', 'winners', 'ends_at', 'status', 'created_at',
+         'announce_message_id', 'bonus_role_id', 'bonus_role_entries', 'entries_per_invite', 'min_invites',
+         'min_account_age_days', 'required_role_id', 'entry_count'),
+        'giveaways', 'guild_id', (0,),
+    ),
+    'giveaway_entries': (
+        ('g.id AS giveaway_id', 'e.user_id', 'e.entry_no', 'e.entered_at'),
+        'giveaways g JOIN giveaway_entries e ON e.giveaway_id = g.id', 'g.guild_id', (0, 1),
+    ),
+}
+
+def export_header(table):
+    """Column names of an export, without table prefixes or aliases"""
+    return [column.split(' AS ')[-1].split('.')[-1] for column in EXPORT_TABLES[table][0]]
+
+# Width of an invite_rollups bucket; /invitestats ranges are resolved to whole buckets
+ROLLUP_BUCKET_SECONDS = 3600
+
+# user_invites counters callers may write; anything else is rejected before it reaches SQL
+INVITE_COUNTERS = ('total_invites', 'left_invites', 'fake_invites', 'bonus_invites', 'claimed_invites')
+
+def invite_counter_columns(fields):
+    """The INVITE_COUNTERS named in fields, in a fixed order, or ValueError for unknown names"""
+    unknown = set(fields) - set(INVITE_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown user_invites counter(s): {', '.join(sorted(unknown))}")
+    return tuple(counter for counter in INVITE_COUNTERS if counter in fields)
+
+@lru_cache(maxsize=None)
+def _counter_upsert(counters, increment):
+    """One INSERT ... ON CONFLICT DO UPDATE writing counters (a tuple from invite_counter_columns).
+
+    Parameters are user_id, guild_id, a value per counter, then the value
+    again for each counter with a baseline. Manual and imported counts have
+    no invite relationships behind them, so the baseline moves with the
+    counter and reconciliation keeps the change. Returns (sql, positions of
+    the counters with baselines)."""
+    baseline_positions = tuple(i for i, counter in enumerate(counters) if counter in COUNTER_BASELINES)
+    baselines = [COUNTER_BASELINES[counters[i]] for i in baseline_positions]
+    if increment:
+        updates = [f"{COUNTER_BASELINES[k]} = {COUNTER_BASELINES[k]} + excluded.{k}" for k in counters if k in COUNTER_BASELINES]
+        updates += [f"{k} = {k} + excluded.{k}" for k in counters]
+    else:
+        # SET expressions all see the old row, so baselines are moved by new - old
+        updates = [f"{COUNTER_BASELINES[k]} = {COUNTER_BASELINES[k]} + excluded.{k} - {k}" for k in counters if k in COUNTER_BASELINES]
+        updates += [f"{k} = excluded.{k}" for k in counters]
+    insert_columns = ['user_id', 'guild_id', *counters, *baselines]
+    sql = f"""
+        INSERT INTO user_invites ({', '.join(insert_columns)}) VALUES ({', '.join('?' * len(insert_columns))})
+        ON CONFLICT (user_id, guild_id) DO UPDATE SET {', '.join(updates)}
+    """
+    return sql, baseline_positions
+
+def _counter_upsert_params(guild_id, rows, baseline_positions):
+    """Parameters for _counter_upsert from (user_id, value per counter) rows"""
+    return ((row[0], guild_id, *row[1:], *(row[1 + i] for i in baseline_positions)) for row in rows)
+
+def estimated_left_invites(guild_id, user_id, uses):
+    """Estimated historical leavers for invites that predate tracking.
+
+    Typically 15-35% of invited members leave over time. The rate is derived
+    from a hash of the guild and user rather than drawn at random, so a
+    rerun of the sync produces the same figure."""
+    digest = hashlib.sha256(f"{guild_id}:{user_id}".encode()).digest()
+    rate = 0.15 + 0.20 * int.from_bytes(digest[:8], 'big') / 2**64
+    return int(uses * rate)
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statement timings to the connection's query observers"""
+    def execute(self, sql, parameters=()):
+        observers = self.connection.query_observers
+        if not observers:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            for observer in observers:
+                observer(sql, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        observers = self.connection.query_observers
+        if not observers:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            for observer in observers:
+                observer(sql, elapsed)
+
+class _Connection(sqlite3.Connection):
+    query_observers = ()
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
 
 class Database:
     def __init__(self, db_path="bot_database.db"):
         self.db_path = db_path
         # ensure DB created
         self._lock = threading.Lock()
+        # Callbacks of the form observer(sql, seconds), used by the profiler
+        self._query_observers = []
+
+    def _connect(self):
+        # The timeout lets cluster workers in other processes wait for the write lock
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=_Connection)
+        conn.query_observers = self._query_observers
+        return conn
+
+    def add_query_observer(self, observer):
+        self._query_observers.append(observer)
+
+    def remove_query_observer(self, observer):
+        if observer in self._query_observers:
+            self._query_observers.remove(observer)
 
     async def create_tables(self):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("""
+            # WAL lets readers in other cluster processes run alongside a writer
+            c.execute("PRAGMA journal_mode=WAL")
+            # A brand-new database is created at the current schema, so none of
+            # the migrations and backfills below have anything to do
+            if c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0] == 0:
+                c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS user_invites (
                     user_id INTEGER,
                     guild_id INTEGER,
@@ -21,31 +204,31 @@ class Database:
                     fake_invites INTEGER DEFAULT 0,
                     bonus_invites INTEGER DEFAULT 0,
                     claimed_invites INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {EPOCH_NOW},
                     PRIMARY KEY(user_id, guild_id)
                 )
             """)
-            c.execute("""
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS invite_codes (
                     code TEXT,
                     guild_id INTEGER,
                     inviter_id INTEGER,
                     uses INTEGER DEFAULT 0,
                     max_uses INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {EPOCH_NOW},
                     PRIMARY KEY(code, guild_id)
                 )
             """)
-            c.execute("""
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS invite_relationships (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     guild_id INTEGER,
                     inviter_id INTEGER,
                     invited_user_id INTEGER,
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    joined_at INTEGER DEFAULT {EPOCH_NOW}
                 )
             """)
-            c.execute("""
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS giveaways (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     guild_id INTEGER,
@@ -56,15 +239,15 @@ class Database:
                     winners INTEGER,
                     end_time TEXT,
                     status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at INTEGER DEFAULT {EPOCH_NOW}
                 )
             """)
-            c.execute("""
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS giveaway_entries (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     giveaway_id INTEGER,
                     user_id INTEGER,
-                    entered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    entered_at INTEGER DEFAULT {EPOCH_NOW},
                     FOREIGN KEY(giveaway_id) REFERENCES giveaways(id),
                     UNIQUE(giveaway_id, user_id)
                 )
@@ -84,177 +267,912 @@ class Database:
                 # Column already exists
                 pass
 
-            # Create role permissions table
+            # Columns backing GiveawayFinalizer's claim/draw/announce steps
+            for column in ("drawn INTEGER DEFAULT 0", "claimed_at INTEGER", "announce_message_id INTEGER",
+                           "finish_attempts INTEGER DEFAULT 0"):
+                try:
+                    c.execute(f"ALTER TABLE giveaways ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    # Column already exists
+                    pass
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_status ON giveaways(status)")
+            # Serves /glist's keyset pagination over a guild's active giveaways
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_guild_status_created ON giveaways(guild_id, status, created_at, id)")
+            # Guild-ordered walks for exports; the rowid is the implicit last column
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_guild ON giveaways(guild_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_user_invites_guild ON user_invites(guild_id, user_id)")
+
+            # Winners recorded durably by every draw; draw 0 is the original, rerolls count up
+            c.execute(f"""
+                CREATE TABLE IF NOT EXISTS giveaway_winners (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    giveaway_id INTEGER,
+                    user_id INTEGER,
+                    draw INTEGER DEFAULT 0,
+                    created_at INTEGER DEFAULT {EPOCH_NOW},
+                    FOREIGN KEY(giveaway_id) REFERENCES giveaways(id),
+                    UNIQUE(giveaway_id, user_id)
+                )
+            """)
+            try:
+                c.execute("ALTER TABLE giveaway_winners ADD COLUMN draw INTEGER DEFAULT 0")
+            except sqlite3.OperationalError:
+                # Column already exists
+                pass
+
+            # entry_no numbers a giveaway's entries 1, 2, 3... so winners can be
+            # sampled by probing random numbers through an index instead of loading every entry
+            try:
+                c.execute("ALTER TABLE giveaway_entries ADD COLUMN entry_no INTEGER")
+            except sqlite3.OperationalError:
+                # Column already exists
+                pass
+            # Number any entries still without one after their giveaway's highest
+            # number, so a backfill interrupted on an earlier start is finished here
             c.execute("""
+                UPDATE giveaway_entries SET entry_no = r.rn
+                FROM (
+                    SELECT e.id, COALESCE(m.top, 0) + ROW_NUMBER() OVER (PARTITION BY e.giveaway_id ORDER BY e.id) AS rn
+                    FROM giveaway_entries e
+                    LEFT JOIN (SELECT giveaway_id, MAX(entry_no) AS top FROM giveaway_entries GROUP BY giveaway_id) m
+                        ON m.giveaway_id = e.giveaway_id
+                    WHERE e.entry_no IS NULL
+                ) AS r
+                WHERE giveaway_entries.id = r.id
+            """)
+            conn.commit()
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaway_entries_no ON giveaway_entries(giveaway_id, entry_no)")
+
+            # Weighted giveaways: bonus entry rules on the giveaway, the resulting
+            # weight on each entry, and the seed each draw used so it can be reproduced
+            for table, column in (
+                ("giveaways", "bonus_role_id INTEGER"),
+                ("giveaways", "bonus_role_entries INTEGER DEFAULT 0"),
+                ("giveaways", "entries_per_invite REAL DEFAULT 0"),
+                ("giveaway_entries", "weight REAL DEFAULT 1"),
+                ("giveaway_winners", "seed INTEGER"),
+                # Entry requirements, checked on every button click
+                ("giveaways", "min_invites INTEGER"),
+                ("giveaways", "min_account_age_days INTEGER"),
+                ("giveaways", "required_role_id INTEGER"),
+            ):
+                try:
+                    c.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    # Column already exists
+                    pass
+
+            # End time as epoch seconds; replaces the ISO-8601 end_time text column
+            try:
+                c.execute("ALTER TABLE giveaways ADD COLUMN ends_at INTEGER")
+            except sqlite3.OperationalError:
+                # Column already exists
+                pass
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_status_ends_at ON giveaways(status, ends_at)")
+
+            # Entry count kept on the giveaway by enter/leave so reading it is a primary key lookup.
+            # The column and its backfill commit together, so a failed backfill
+            # rolls the column back too and is retried on the next start.
+            conn.commit()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("ALTER TABLE giveaways ADD COLUMN entry_count INTEGER DEFAULT 0")
+                added = True
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+                added = False
+            if added:
+                c.execute("UPDATE giveaways SET entry_count = (SELECT COUNT(*) FROM giveaway_entries WHERE giveaway_id = giveaways.id)")
+            conn.commit()
+
+            # Giveaway templates launched by GiveawayScheduler; cron is NULL for one-off
+            # schedules, next_run is a UTC epoch and NULL once nothing is left to launch
+            c.execute(f"""
+                CREATE TABLE IF NOT EXISTS giveaway_schedules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER,
+                    channel_id INTEGER,
+                    host_id INTEGER,
+                    prize TEXT,
+                    winners INTEGER DEFAULT 1,
+                    duration_seconds INTEGER,
+                    description TEXT,
+                    cron TEXT,
+                    next_run INTEGER,
+                    last_run INTEGER,
+                    created_at INTEGER DEFAULT {EPOCH_NOW}
+                )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_giveaway_schedules_next_run ON giveaway_schedules(next_run)")
+
+            # Create role permissions table
+            c.execute(f"""
                 CREATE TABLE IF NOT EXISTS role_permissions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     guild_id INTEGER,
                     role_id INTEGER,
                     command_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {EPOCH_NOW},
                     UNIQUE(guild_id, role_id, command_name)
                 )
             """)
 
+            # Small key/value store for bot-level state (e.g. command tree hash)
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+            conn.commit()
+
+            if c.execute("PRAGMA user_version").fetchone()[0] < 1:
+                self._migrate_epoch_timestamps(conn)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_relationships_guild_joined ON invite_relationships(guild_id, joined_at)")
+
+            # Facts the invite counters can be rebuilt from: whether each join
+            # counted as fake, when the member left, and when the row last changed
+            for column in ("is_fake INTEGER DEFAULT 0", "left_at INTEGER", "updated_at INTEGER"):
+                try:
+                    c.execute(f"ALTER TABLE invite_relationships ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    # Column already exists
+                    pass
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_relationships_inviter ON invite_relationships(guild_id, inviter_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_relationships_invited ON invite_relationships(guild_id, invited_user_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_relationships_updated ON invite_relationships(updated_at)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_relationships_guild_updated ON invite_relationships(guild_id, updated_at)")
+
+            # Baselines start as whatever the counters hold beyond the recorded
+            # relationships, so existing counters reconcile without changes. The
+            # columns and their backfill commit together: if either is interrupted
+            # neither is kept, and the next start runs both again.
+            c.execute("PRAGMA table_info(user_invites)")
+            if 'historical_total' not in {row[1] for row in c.fetchall()}:
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("ALTER TABLE user_invites ADD COLUMN historical_total INTEGER DEFAULT 0")
+                c.execute("ALTER TABLE user_invites ADD COLUMN historical_left INTEGER DEFAULT 0")
+                c.execute("ALTER TABLE user_invites ADD COLUMN historical_fake INTEGER DEFAULT 0")
+                c.execute("""
+                    UPDATE user_invites SET
+                        historical_total = total_invites - (SELECT COUNT(*) FROM invite_relationships r
+                                                            WHERE r.guild_id = user_invites.guild_id AND r.inviter_id = user_invites.user_id),
+                        historical_left = left_invites,
+                        historical_fake = fake_invites
+                """)
+                conn.commit()
+
+            # Hourly joins/fakes/leaves per inviter, kept up to date by the
+            # join and leave paths so time-range stats never scan relationships
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS invite_rollups (
+                    guild_id INTEGER,
+                    bucket INTEGER,
+                    inviter_id INTEGER,
+                    joins INTEGER DEFAULT 0,
+                    fakes INTEGER DEFAULT 0,
+                    leaves INTEGER DEFAULT 0,
+                    PRIMARY KEY (guild_id, bucket, inviter_id)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            if c.execute("PRAGMA user_version").fetchone()[0] < 2:
+                self._backfill_invite_rollups(conn)
+
+            # Every (ancestor, descendant) pair of the referral tree with its
+            # distance, so subtree sizes and listings are range scans, not walks
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS invite_closure (
+                    guild_id INTEGER,
+                    ancestor_id INTEGER,
+                    descendant_id INTEGER,
+                    depth INTEGER,
+                    active INTEGER DEFAULT 1,
+                    PRIMARY KEY (guild_id, ancestor_id, descendant_id)
+                ) WITHOUT ROWID
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invite_closure_descendant ON invite_closure(guild_id, descendant_id, depth)")
+            conn.commit()
+            if c.execute("PRAGMA user_version").fetchone()[0] < 3:
+                c.execute("SELECT DISTINCT guild_id FROM invite_relationships")
+                for (guild_id,) in c.fetchall():
+                    self._build_invite_closure(conn, guild_id)
+                c.execute("PRAGMA user_version = 3")
+                conn.commit()
+
+            # Every change to claimed_invites, which stays the materialised balance
+            c.execute(f"""
+                CREATE TABLE IF NOT EXISTS claims_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER,
+                    user_id INTEGER,
+                    actor_id INTEGER,
+                    amount INTEGER,
+                    reason TEXT,
+                    balance_after INTEGER,
+                    created_at INTEGER DEFAULT {EPOCH_NOW}
+                )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_claims_ledger_user ON claims_ledger(guild_id, user_id, created_at, id)")
+            conn.commit()
+            if c.execute("PRAGMA user_version").fetchone()[0] < 4:
+                # Balances from before the ledger become opening entries, so every balance is its entries' sum
+                c.execute("""
+                    INSERT INTO claims_ledger (guild_id, user_id, amount, reason, balance_after)
+                    SELECT guild_id, user_id, claimed_invites, 'Opening balance', claimed_invites
+                    FROM user_invites WHERE claimed_invites != 0
+                """)
+                c.execute("PRAGMA user_version = 4")
+                conn.commit()
+            conn.close()
+
+    def _backfill_invite_rollups(self, conn):
+        """Schema version 2: build invite_rollups from the relationship history.
+
+        Runs in one transaction and starts from an empty table, so it can be
+        repeated safely. Leaves are only known for relationships with left_at,
+        i.e. recorded since leave tracking began."""
+        c = conn.cursor()
+        c.execute("DELETE FROM invite_rollups")
+        c.execute(f"""
+            INSERT INTO invite_rollups (guild_id, bucket, inviter_id, joins, fakes)
+            SELECT guild_id, joined_at - joined_at % {ROLLUP_BUCKET_SECONDS}, inviter_id, COUNT(*), SUM(COALESCE(is_fake, 0))
+            FROM invite_relationships
+            WHERE typeof(joined_at) = 'integer'
+            GROUP BY 1, 2, 3
+        """)
+        c.execute(f"""
+            INSERT INTO invite_rollups (guild_id, bucket, inviter_id, leaves)
+            SELECT guild_id, left_at - left_at % {ROLLUP_BUCKET_SECONDS}, inviter_id, COUNT(*)
+            FROM invite_relationships
+            WHERE left_at IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (guild_id, bucket, inviter_id) DO UPDATE SET leaves = leaves + excluded.leaves
+        """)
+        c.execute("PRAGMA user_version = 2")
+        conn.commit()
+        print("Built invite rollups from invite history")
+
+    def _migrate_epoch_timestamps(self, conn):
+        """Schema version 1: store every timestamp as integer epoch seconds.
+
+        Rows are converted in place in rowid-ordered batches, each its own
+        transaction; a batch only touches rows still holding text, so an
+        interrupted run just continues where it stopped. Text that isn't a
+        timestamp becomes NULL, except an unreadable end_time, which ends the
+        giveaway now rather than leaving it without an end. Column defaults of existing tables are then
+        switched from CURRENT_TIMESTAMP using SQLite's documented writable_schema
+        procedure, which is safe for default-only changes. Only the DEFAULT
+        clause is rewritten; the declared TIMESTAMP type, and so the column's
+        NUMERIC affinity, stays as it was and stores the integers unchanged."""
+        c = conn.cursor()
+        def convert(table, target, source, pending, fallback="NULL"):
+            # Paging by rowid means rows that stay pending can't be selected again
+            last_rowid = 0
+            while True:
+                c.execute(f"SELECT rowid FROM {table} WHERE rowid > ? AND {pending} ORDER BY rowid LIMIT ?",
+                          (last_rowid, MIGRATION_BATCH_SIZE))
+                rowids = [r[0] for r in c.fetchall()]
+                if not rowids:
+                    break
+                c.execute(f"""
+                    UPDATE {table} SET {target} = COALESCE(CAST(strftime('%s', {source}) AS INTEGER), {fallback})
+                    WHERE rowid BETWEEN ? AND ? AND {pending}
+                """, (rowids[0], rowids[-1]))
+                conn.commit()
+                last_rowid = rowids[-1]
+
+        for table, column in TIMESTAMP_COLUMNS:
+            convert(table, column, column, f"typeof({column}) = 'text'")
+        convert("giveaways", "ends_at", "end_time", "ends_at IS NULL AND end_time IS NOT NULL", EPOCH_NOW)
+
+        schema_version = c.execute("PRAGMA schema_version").fetchone()[0]
+        c.execute("PRAGMA writable_schema = ON")
+        c.execute("""
+            UPDATE sqlite_master SET sql = replace(sql, 'DEFAULT CURRENT_TIMESTAMP', ?)
+            WHERE type = 'table' AND sql LIKE '%DEFAULT CURRENT_TIMESTAMP%'
+        """, (f"DEFAULT {EPOCH_NOW}",))
+        c.execute(f"PRAGMA schema_version = {schema_version + 1}")
+        c.execute("PRAGMA writable_schema = OFF")
+        c.execute("PRAGMA user_version = 1")
+        conn.commit()
+        print("Migrated timestamps to epoch seconds")
+
+    # Bot state methods
+    async def get_state(self, key):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+            row = c.fetchone()
+            conn.close()
+            return row[0] if row else None
+
+    async def set_state(self, key, value):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
             conn.commit()
             conn.close()
 
     # Invite methods
     async def get_user_invites(self, user_id, guild_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT total_invites, left_invites, fake_invites, bonus_invites, claimed_invites FROM user_invites WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-            row = c.fetchone()
+            c.execute(f"SELECT {columns(InviteStats)} FROM user_invites WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+            stats = fetch_one(c, InviteStats)
             conn.close()
-            if row:
-                total, left, fake, bonus, claimed = row
-                net = total - left - fake + bonus
-                return {'total': total, 'left': left, 'fake': fake, 'bonus': bonus, 'claimed': claimed, 'net': net}
-            return {'total':0,'left':0,'fake':0,'bonus':0,'claimed':0,'net':0}
+            return stats or InviteStats(user_id, 0, 0, 0, 0, 0, 0)
 
-    async def update_user_invites(self, user_id, guild_id, **kwargs):
+    async def update_user_invites(self, user_id, guild_id, increment=False, **kwargs):
+        """Set INVITE_COUNTERS columns for a user in a single upsert, e.g. bonus_invites=5;
+        with increment the values are added instead"""
+        counters = invite_counter_columns(kwargs)
+        upserted = tuple(k for k in counters if k != 'claimed_invites')
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (user_id, guild_id))
-            for k,v in kwargs.items():
-                c.execute(f"UPDATE user_invites SET {k} = ? WHERE user_id = ? AND guild_id = ?", (v, user_id, guild_id))
+            if upserted:
+                sql, baseline_positions = _counter_upsert(upserted, increment)
+                row = (user_id, *(kwargs[k] for k in upserted))
+                c.execute(sql, next(_counter_upsert_params(guild_id, [row], baseline_positions)))
+            if 'claimed_invites' in kwargs:
+                self._apply_claims(c, guild_id, {user_id: kwargs['claimed_invites']}, reason="Adjustment", increment=increment)
             conn.commit()
             conn.close()
 
+    async def update_user_invites_many(self, guild_id, updates, increment=False):
+        """Apply many (user_id, {counter: value}) updates in one transaction.
+
+        Updates naming the same counters share one executemany. Everything is
+        validated before anything is written. Returns the number applied."""
+        groups = {}
+        claims = {}
+        applied = 0
+        for user_id, fields in updates:
+            counters = tuple(k for k in invite_counter_columns(fields) if k != 'claimed_invites')
+            if counters:
+                groups.setdefault(counters, []).append((user_id, *(fields[k] for k in counters)))
+            if 'claimed_invites' in fields:
+                claims[user_id] = claims.get(user_id, 0) + fields['claimed_invites'] if increment else fields['claimed_invites']
+            applied += bool(counters) or 'claimed_invites' in fields
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            for counters, rows in groups.items():
+                sql, baseline_positions = _counter_upsert(counters, increment)
+                c.executemany(sql, _counter_upsert_params(guild_id, rows, baseline_positions))
+            if claims:
+                self._apply_claims(c, guild_id, claims, reason="Adjustment", increment=increment)
+            conn.commit()
+            conn.close()
+        return applied
+
     async def add_invite(self, inviter_id, guild_id, invited_user_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (inviter_id, guild_id))
             c.execute("UPDATE user_invites SET total_invites = total_invites + 1 WHERE user_id = ? AND guild_id = ?", (inviter_id, guild_id))
-            c.execute("INSERT INTO invite_relationships (guild_id, inviter_id, invited_user_id) VALUES (?, ?, ?)", (guild_id, inviter_id, invited_user_id))
+            now = int(time.time())
+            c.execute("INSERT INTO invite_relationships (guild_id, inviter_id, invited_user_id, joined_at, updated_at) VALUES (?, ?, ?, ?, ?)", (guild_id, inviter_id, invited_user_id, now, now))
+            self._bump_invite_rollup(c, guild_id, inviter_id, now, joins=1)
+            self._link_invite_closure(c, guild_id, inviter_id, invited_user_id)
             conn.commit()
             conn.close()
 
     async def add_fake_invite(self, inviter_id, guild_id, invited_user_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (inviter_id, guild_id))
             c.execute("UPDATE user_invites SET total_invites = total_invites + 1, fake_invites = fake_invites + 1 WHERE user_id = ? AND guild_id = ?", (inviter_id, guild_id))
-            c.execute("INSERT INTO invite_relationships (guild_id, inviter_id, invited_user_id) VALUES (?, ?, ?)", (guild_id, inviter_id, invited_user_id))
+            now = int(time.time())
+            c.execute("INSERT INTO invite_relationships (guild_id, inviter_id, invited_user_id, is_fake, joined_at, updated_at) VALUES (?, ?, ?, 1, ?, ?)", (guild_id, inviter_id, invited_user_id, now, now))
+            self._bump_invite_rollup(c, guild_id, inviter_id, now, joins=1, fakes=1)
+            self._link_invite_closure(c, guild_id, inviter_id, invited_user_id)
             conn.commit()
             conn.close()
 
     async def handle_member_leave(self, guild_id, left_user_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             # Get the most recent invite relationship for this user
-            c.execute("SELECT inviter_id FROM invite_relationships WHERE guild_id = ? AND invited_user_id = ? ORDER BY joined_at DESC LIMIT 1", (guild_id, left_user_id))
+            c.execute("SELECT id, inviter_id, left_at FROM invite_relationships WHERE guild_id = ? AND invited_user_id = ? ORDER BY joined_at DESC, id DESC LIMIT 1", (guild_id, left_user_id))
             row = c.fetchone()
-            if row:
-                inviter_id = row[0]
+            # A join that already counted as left isn't counted again
+            if row and row[2] is None:
+                relationship_id, inviter_id = row[0], row[1]
+                now = int(time.time())
+                c.execute("UPDATE invite_relationships SET left_at = ?, updated_at = ? WHERE id = ?", (now, now, relationship_id))
                 c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (inviter_id, guild_id))
                 c.execute("UPDATE user_invites SET left_invites = left_invites + 1 WHERE user_id = ? AND guild_id = ?", (inviter_id, guild_id))
+                self._bump_invite_rollup(c, guild_id, inviter_id, now, leaves=1)
+                # The member stays in the tree so their own invitees still count upstream
+                c.execute("UPDATE invite_closure SET active = 0 WHERE guild_id = ? AND descendant_id = ?", (guild_id, left_user_id))
             conn.commit()
             conn.close()
 
-    async def check_previous_invite_relationship(self, guild_id, inviter_id, invited_user_id):
-        """Check if this user was previously invited by this inviter and left"""
+    def _bump_invite_rollup(self, c, guild_id, inviter_id, moment, joins=0, fakes=0, leaves=0):
+        """Add to the inviter's rollup bucket for moment, inside the caller's transaction"""
+        c.execute("""
+            INSERT INTO invite_rollups (guild_id, bucket, inviter_id, joins, fakes, leaves) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (guild_id, bucket, inviter_id) DO UPDATE SET
+                joins = joins + excluded.joins, fakes = fakes + excluded.fakes, leaves = leaves + excluded.leaves
+        """, (guild_id, moment - moment % ROLLUP_BUCKET_SECONDS, inviter_id, joins, fakes, leaves))
+
+    async def get_top_inviters_between(self, guild_id, since, until, limit=10):
+        """Inviters ranked by net joins over the rollup buckets in [since, until)"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM invite_relationships WHERE guild_id = ? AND inviter_id = ? AND invited_user_id = ?", (guild_id, inviter_id, invited_user_id))
-            count = c.fetchone()[0]
+            c.execute(f"""
+                SELECT {columns(InviterPeriodStats)}
+                FROM invite_rollups
+                WHERE guild_id = ? AND bucket >= ? AND bucket < ?
+                GROUP BY inviter_id
+                ORDER BY net DESC, joins DESC
+                LIMIT ?
+            """, (guild_id, since - since % ROLLUP_BUCKET_SECONDS, until, limit))
+            inviters = fetch_all(c, InviterPeriodStats)
             conn.close()
-            return count > 0  # Returns True if this user was previously invited by this person
+            return inviters
+
+    async def get_invite_activity(self, guild_id, since, until, inviter_id=None):
+        """Joins/fakes/leaves per hour bucket in [since, until), for the guild or one inviter"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query = f"""
+                SELECT {columns(InviteActivity)}
+                FROM invite_rollups
+                WHERE guild_id = ? AND bucket >= ? AND bucket < ?
+            """
+            params = [guild_id, since - since % ROLLUP_BUCKET_SECONDS, until]
+            if inviter_id is not None:
+                query += " AND inviter_id = ?"
+                params.append(inviter_id)
+            c.execute(query + " GROUP BY bucket ORDER BY bucket", params)
+            activity = fetch_all(c, InviteActivity)
+            conn.close()
+            return activity
+
+    def _link_invite_closure(self, c, guild_id, inviter_id, member_id):
+        """Attach member (with everyone below them) under inviter, inside the caller's transaction.
+
+        A rejoining member is first detached from their previous inviter's
+        chain. If the new inviter is the member or one of their own
+        descendants, linking would make a cycle, so the member stays a root."""
+        c.execute("""
+            DELETE FROM invite_closure
+            WHERE guild_id = ?
+              AND ancestor_id IN (SELECT ancestor_id FROM invite_closure WHERE guild_id = ? AND descendant_id = ?)
+              AND (descendant_id = ? OR descendant_id IN (SELECT descendant_id FROM invite_closure WHERE guild_id = ? AND ancestor_id = ?))
+        """, (guild_id, guild_id, member_id, member_id, guild_id, member_id))
+        if inviter_id == member_id:
+            return
+        c.execute("SELECT 1 FROM invite_closure WHERE guild_id = ? AND ancestor_id = ? AND descendant_id = ?", (guild_id, member_id, inviter_id))
+        if c.fetchone():
+            return
+        # Every ancestor of the member-to-be (the inviter and the inviter's
+        # ancestors) paired with the member and each of their descendants
+        c.execute("""
+            INSERT INTO invite_closure (guild_id, ancestor_id, descendant_id, depth, active)
+            SELECT ?, up.ancestor_id, down.descendant_id, up.depth + down.depth + 1, down.active
+            FROM (SELECT ? AS ancestor_id, 0 AS depth
+                  UNION ALL
+                  SELECT ancestor_id, depth FROM invite_closure WHERE guild_id = ? AND descendant_id = ?) AS up
+            CROSS JOIN (SELECT ? AS descendant_id, 0 AS depth, 1 AS active
+                        UNION ALL
+                        SELECT descendant_id, depth, active FROM invite_closure WHERE guild_id = ? AND ancestor_id = ?) AS down
+        """, (guild_id, inviter_id, guild_id, inviter_id, member_id, guild_id, member_id))
+
+    def _build_invite_closure(self, conn, guild_id):
+        """Rebuild a guild's invite_closure from its relationship history in one transaction.
+
+        Joins are replayed in order against an in-memory parent map with the
+        same rules as _link_invite_closure, then every member's ancestor chain
+        is written out; a member counts as active if their latest join has no
+        left_at."""
+        c = conn.cursor()
+        c.execute("""
+            SELECT inviter_id, invited_user_id, left_at FROM invite_relationships
+            WHERE guild_id = ? AND typeof(joined_at) = 'integer'
+            ORDER BY joined_at, id
+        """, (guild_id,))
+        parent = {}
+        active = {}
+        for inviter_id, member_id, left_at in c:
+            ancestor = inviter_id
+            while ancestor is not None and ancestor != member_id:
+                ancestor = parent.get(ancestor)
+            parent[member_id] = None if ancestor == member_id else inviter_id
+            active[member_id] = int(left_at is None)
+
+        def chains():
+            for member_id, is_active in active.items():
+                ancestor, depth = parent[member_id], 1
+                while ancestor is not None:
+                    yield guild_id, ancestor, member_id, depth, is_active
+                    ancestor, depth = parent.get(ancestor), depth + 1
+
+        c.execute("DELETE FROM invite_closure WHERE guild_id = ?", (guild_id,))
+        c.executemany("INSERT INTO invite_closure (guild_id, ancestor_id, descendant_id, depth, active) VALUES (?, ?, ?, ?, ?)", chains())
+        conn.commit()
+        return len(active)
 
-    async def sync_historical_invites(self, guild_id, invite_data):
-        """Sync historical invite data with realistic left tracking"""
-        import random
+    async def rebuild_invite_closure(self, guild_id=None):
+        """Backfill invite_closure for one guild, or every guild with invite history.
+        Returns the number of members placed in the tree."""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
+            if guild_id is None:
+                c.execute("SELECT DISTINCT guild_id FROM invite_relationships")
+                guild_ids = [row[0] for row in c.fetchall()]
+            else:
+                guild_ids = [guild_id]
+            conn.close()
+
+        placed = 0
+        for guild_id in guild_ids:
+            # One guild per lock hold, so joins elsewhere aren't stalled for the whole rebuild
+            with self._lock:
+                conn = self._connect()
+                placed += self._build_invite_closure(conn, guild_id)
+                conn.close()
+        return placed
+
+    async def get_downstream_stats(self, guild_id, user_id):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute(f"SELECT {columns(DownstreamStats)} FROM invite_closure WHERE guild_id = ? AND ancestor_id = ?", (guild_id, user_id))
+            stats = fetch_one(c, DownstreamStats)
+            conn.close()
+            return stats
+
+    async def get_invite_tree(self, guild_id, user_id, max_depth=3, limit=200):
+        """Members below user_id down to max_depth, shallowest first, each with their parent"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute(f"""
+                SELECT {columns(InviteTreeNode)}
+                FROM invite_closure t
+                JOIN invite_closure p ON p.guild_id = t.guild_id AND p.descendant_id = t.descendant_id AND p.depth = 1
+                WHERE t.guild_id = ? AND t.ancestor_id = ? AND t.depth <= ?
+                ORDER BY t.depth, t.descendant_id
+                LIMIT ?
+            """, (guild_id, user_id, max_depth, limit))
+            nodes = fetch_all(c, InviteTreeNode)
+            conn.close()
+            return nodes
+
+    async def get_export_chunk(self, table, guild_id, after=None, limit=EXPORT_CHUNK_SIZE):
+        """Up to limit rows of one EXPORT_TABLES table for a guild after the keyset cursor.
+        Returns (rows, cursor for the next chunk)."""
+        selected, source, guild_column, key_positions = EXPORT_TABLES[table]
+        keys = ', '.join(selected[i].split(' AS ')[0] for i in key_positions)
+        query = f"SELECT {', '.join(selected)} FROM {source} WHERE {guild_column} = ?"
+        params = [guild_id]
+        if after is not None:
+            query += f" AND ({keys}) > ({', '.join('?' * len(after))})"
+            params.extend(after)
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute(query + f" ORDER BY {keys} LIMIT ?", params + [limit])
+            rows = c.fetchall()
+            conn.close()
+        cursor = tuple(rows[-1][i] for i in key_positions) if rows else after
+        return rows, cursor
 
-            synced_count = 0
-            for invite_code, data in invite_data.items():
-                inviter_id = data.get('inviter_id')
-                uses = data.get('uses', 0)
+    async def get_relationship_version(self, guild_id):
+        """(row count, latest updated_at) of a guild's relationships; changes whenever they do"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT COUNT(*), COALESCE(MAX(updated_at), 0) FROM invite_relationships WHERE guild_id = ?", (guild_id,))
+            version = c.fetchone()
+            conn.close()
+            return version
 
-                if inviter_id and uses > 0:
-                    # Initialize user record if doesn't exist
-                    c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (inviter_id, guild_id))
+    async def get_relationship_chunk(self, guild_id, after=(-1, 0), limit=RELATIONSHIP_CHUNK_SIZE):
+        """Plain (joined_at, id, inviter_id, left_at, is_fake) tuples after the (joined_at, id)
+        cursor, for analytics; left_at is -1 for members still in the guild"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            # Walks idx_invite_relationships_guild_joined, which also orders by id within a second
+            c.execute("""
+                SELECT joined_at, id, inviter_id, COALESCE(left_at, -1), COALESCE(is_fake, 0)
+                FROM invite_relationships
+                WHERE guild_id = ? AND (joined_at, id) > (?, ?) AND typeof(joined_at) = 'integer'
+                ORDER BY joined_at, id
+                LIMIT ?
+            """, (guild_id, after[0], after[1], limit))
+            rows = c.fetchall()
+            conn.close()
+            return rows
 
-                    # Get current stats
-                    c.execute("SELECT total_invites, left_invites FROM user_invites WHERE user_id = ? AND guild_id = ?", (inviter_id, guild_id))
-                    row = c.fetchone()
-                    current_total = row[0] or 0
-                    current_left = row[1] or 0
+    async def reconcile_invite_counters(self, full=False):
+        """Recompute user_invites counters from invite_relationships and fix drift.
 
-                    # Only add historical invites if current total is less than historical uses
-                    if uses > current_total:
-                        additional_invites = uses - current_total
+        Expected counters are each baseline plus the inviter's relationship
+        facts (joins, fakes, lefts). Incremental runs only revisit inviters
+        with relationships changed since the stored high-water mark; full runs
+        walk every user_invites row by keyset. Each batch is read, diffed and
+        corrected in one short transaction.
 
-                        # Calculate realistic left count (15-35% of historical invites typically leave over time)
-                        # This simulates natural server churn that would have happened historically
-                        if current_left == 0:  # Only add estimated lefts if none exist yet
-                            left_percentage = random.uniform(0.15, 0.35)  # 15-35% leave rate
-                            estimated_left = int(uses * left_percentage)
+        Returns (inviters checked, list of (guild_id, user_id, old, new))."""
+        hwm = 0 if full else int(await self.get_state('invite_reconcile_hwm') or 0)
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT MAX(updated_at) FROM invite_relationships")
+            new_hwm = c.fetchone()[0]
+            if not full:
+                # >= so rows written later in the same second are picked up next time; rechecking is harmless
+                c.execute("SELECT DISTINCT inviter_id, guild_id FROM invite_relationships WHERE updated_at >= ? AND inviter_id IS NOT NULL", (hwm,))
+                dirty = c.fetchall()
+            conn.close()
 
-                            c.execute("""
-                                UPDATE user_invites 
-                                SET total_invites = total_invites + ?, left_invites = left_invites + ?
-                                WHERE user_id = ? AND guild_id = ?
-                            """, (additional_invites, estimated_left, inviter_id, guild_id))
-                        else:
-                            # Just add the additional invites without modifying existing left count
-                            c.execute("UPDATE user_invites SET total_invites = total_invites + ? WHERE user_id = ? AND guild_id = ?", (additional_invites, inviter_id, guild_id))
+        checked = 0
+        corrections = []
+        if full:
+            last = (-1, -1)
+            while True:
+                keys, drifted = self._reconcile_batch("(user_id, guild_id) > (?, ?) ORDER BY user_id, guild_id LIMIT ?",
+                                                      [*last, RECONCILE_BATCH_SIZE])
+                if not keys:
+                    break
+                checked += len(keys)
+                corrections += drifted
+                last = keys[-1]
+                await asyncio.sleep(0)
+        else:
+            for start in range(0, len(dirty), RECONCILE_BATCH_SIZE):
+                chunk = dirty[start:start + RECONCILE_BATCH_SIZE]
+                placeholders = ','.join(['(?, ?)'] * len(chunk))
+                keys, drifted = self._reconcile_batch(f"(user_id, guild_id) IN (VALUES {placeholders})",
+                                                      [value for pair in chunk for value in pair])
+                checked += len(keys)
+                corrections += drifted
+                await asyncio.sleep(0)
 
-                        synced_count += 1
+        if new_hwm is not None:
+            await self.set_state('invite_reconcile_hwm', str(new_hwm))
+        return checked, corrections
 
+    def _reconcile_batch(self, where, params):
+        """Diff and correct the user_invites rows matching where; returns (keys, corrections)"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute(f"""
+                SELECT u.user_id, u.guild_id, u.total_invites, u.left_invites, u.fake_invites,
+                       u.historical_total + COUNT(r.id),
+                       u.historical_left + COUNT(r.left_at),
+                       u.historical_fake + COALESCE(SUM(r.is_fake), 0)
+                FROM (SELECT * FROM user_invites WHERE {where}) AS u
+                LEFT JOIN invite_relationships r ON r.guild_id = u.guild_id AND r.inviter_id = u.user_id
+                GROUP BY u.user_id, u.guild_id
+                ORDER BY u.user_id, u.guild_id
+            """, params)
+            rows = c.fetchall()
+            drifted = [(row[1], row[0], row[2:5], row[5:8]) for row in rows if row[2:5] != row[5:8]]
+            c.executemany("UPDATE user_invites SET total_invites = ?, left_invites = ?, fake_invites = ? WHERE user_id = ? AND guild_id = ?",
+                          [(*new, user_id, guild_id) for guild_id, user_id, _, new in drifted])
             conn.commit()
             conn.close()
-            return synced_count
+            return [(row[0], row[1]) for row in rows], drifted
+
+    async def check_previous_invite_relationship(self, guild_id, inviter_id, invited_user_id):
+        """Check if this user was previously invited by this inviter and left"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT COUNT(*) FROM invite_relationships WHERE guild_id = ? AND inviter_id = ? AND invited_user_id = ?", (guild_id, inviter_id, invited_user_id))
+            count = c.fetchone()[0]
+            conn.close()
+            return count > 0  # Returns True if this user was previously invited by this person
+
+    async def sync_historical_invites(self, guild_id, inviter_uses, progress=None):
+        """Raise inviters' totals to the uses of their current invite codes.
+
+        inviter_uses maps inviter id to the summed uses of all their invites.
+        Inviters are applied SYNC_CHUNK_SIZE at a time, each chunk in its own
+        short transaction, releasing the lock and yielding to the event loop
+        between chunks so the rest of the bot keeps running during a large
+        sync. Totals only ever grow to the historical figure and estimated
+        lefts are only filled in once, so rerunning the sync changes nothing.
+        progress, if given, is awaited with (inviters done, inviters total)."""
+        inviters = [(user_id, uses) for user_id, uses in inviter_uses.items() if user_id and uses > 0]
+        synced_count = 0
+        for start in range(0, len(inviters), SYNC_CHUNK_SIZE):
+            chunk = inviters[start:start + SYNC_CHUNK_SIZE]
+            with self._lock:
+                conn = self._connect()
+                c = conn.cursor()
+                c.executemany("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)",
+                              [(user_id, guild_id) for user_id, _ in chunk])
+                # SET expressions all see the row's old values, so left is decided against the old total
+                # Historical invites have no relationships, so they go into the baselines too
+                c.executemany("""
+                    UPDATE user_invites
+                    SET historical_left = CASE WHEN left_invites = 0 THEN historical_left + ? ELSE historical_left END,
+                        left_invites = CASE WHEN left_invites = 0 THEN ? ELSE left_invites END,
+                        historical_total = historical_total + ? - total_invites,
+                        total_invites = ?
+                    WHERE user_id = ? AND guild_id = ? AND total_invites < ?
+                """, [(left, left, uses, uses, user_id, guild_id, uses)
+                      for user_id, uses, left in ((u, n, estimated_left_invites(guild_id, u, n)) for u, n in chunk)])
+                synced_count += c.rowcount
+                conn.commit()
+                conn.close()
+            if progress:
+                await progress(start + len(chunk), len(inviters))
+            await asyncio.sleep(0)
+        return synced_count
+
+    async def import_user_invites(self, guild_id, counters, rows, overwrite=False):
+        """Upsert imported counters for a guild in one transaction.
+
+        counters names the INVITE_COUNTERS columns being imported and rows are
+        (user_id, value per counter) tuples. By default values are added to
+        what each user already has; with overwrite they replace it."""
+        if tuple(counters) != invite_counter_columns(counters):
+            raise ValueError("Import columns must be INVITE_COUNTERS in their listed order")
+        upserted = tuple(k for k in counters if k != 'claimed_invites')
+        claims = {}
+        if 'claimed_invites' in counters:
+            position = 1 + counters.index('claimed_invites')
+            for row in rows:
+                claims[row[0]] = row[position] if overwrite else claims.get(row[0], 0) + row[position]
+            rows = [row[:position] + row[position + 1:] for row in rows]
+        with self._lock:
+            conn = self._connect()
+            try:
+                c = conn.cursor()
+                if upserted:
+                    sql, baseline_positions = _counter_upsert(upserted, not overwrite)
+                    c.executemany(sql, _counter_upsert_params(guild_id, rows, baseline_positions))
+                if claims:
+                    self._apply_claims(c, guild_id, claims, reason="Import", increment=not overwrite)
+                conn.commit()
+            except Exception:
+                # Don't leave the write transaction open and the database locked
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        return len(rows)
+
+    async def get_guild_net_invites(self, guild_id):
+        """Net invites for every user in a guild, for in-memory lookups"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT user_id, total_invites - left_invites - fake_invites + bonus_invites FROM user_invites WHERE guild_id = ?", (guild_id,))
+            rows = c.fetchall()
+            conn.close()
+            return dict(rows)
 
     async def get_invite_leaderboard(self, guild_id, limit=10):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("""
-                SELECT user_id, total_invites, left_invites, fake_invites, bonus_invites,
-                       (total_invites - left_invites - fake_invites + bonus_invites) as net_invites
+            c.execute(f"""
+                SELECT {columns(InviteStats)}
                 FROM user_invites
                 WHERE guild_id = ? AND total_invites > 0
-                ORDER BY net_invites DESC
+                ORDER BY net DESC
                 LIMIT ?
             """, (guild_id, limit))
-            rows = c.fetchall()
+            leaderboard = fetch_all(c, InviteStats)
             conn.close()
-            return [{'user_id':r[0],'total':r[1],'left':r[2],'fake':r[3],'bonus':r[4],'net':r[5]} for r in rows]
+            return leaderboard
 
     # Claims management methods
-    async def add_claims(self, user_id, guild_id, amount):
-        """Add claims to a user"""
+    def _apply_claims(self, c, guild_id, changes, actor_id=None, reason=None, increment=True):
+        """Write {user_id: value} claims changes through claims_ledger, inside the caller's transaction.
+
+        With increment each value is a signed amount, otherwise the new
+        balance. The ledger row is written first, against the balance it
+        changes, then claimed_invites is updated to match."""
+        change = "?" if increment else "? - claimed_invites"
+        c.executemany("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)",
+                      [(user_id, guild_id) for user_id in changes])
+        c.executemany(f"""
+            INSERT INTO claims_ledger (guild_id, user_id, actor_id, amount, reason, balance_after)
+            SELECT guild_id, user_id, ?, {change}, ?, claimed_invites + {change}
+            FROM user_invites WHERE user_id = ? AND guild_id = ? AND {change} != 0
+        """, [(actor_id, value, reason, value, user_id, guild_id, value) for user_id, value in changes.items()])
+        c.executemany(f"UPDATE user_invites SET claimed_invites = {'claimed_invites + ?' if increment else '?'} WHERE user_id = ? AND guild_id = ?",
+                      [(value, user_id, guild_id) for user_id, value in changes.items()])
+
+    async def add_claims(self, user_id, guild_id, amount, actor_id=None, reason=None):
+        """Grant claims to a user; returns the new balance"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (user_id, guild_id))
-            c.execute("UPDATE user_invites SET claimed_invites = claimed_invites + ? WHERE user_id = ? AND guild_id = ?", (amount, user_id, guild_id))
+            self._apply_claims(c, guild_id, {user_id: amount}, actor_id, reason)
+            c.execute("SELECT claimed_invites FROM user_invites WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+            balance = c.fetchone()[0]
             conn.commit()
             conn.close()
+            return balance
+
+    async def add_claims_many(self, guild_id, user_ids, amount, actor_id=None, reason=None):
+        """Grant amount claims to each of user_ids in one transaction; returns how many users got them"""
+        changes = dict.fromkeys(user_ids, amount)
+        if not changes:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            try:
+                c = conn.cursor()
+                self._apply_claims(c, guild_id, changes, actor_id, reason)
+                conn.commit()
+            except Exception:
+                # Don't leave the write transaction open and the database locked
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        return len(changes)
 
-    async def remove_claims(self, user_id, guild_id, amount):
-        """Remove claims from a user"""
+    async def remove_claims(self, user_id, guild_id, amount, actor_id=None, reason=None):
+        """Redeem claims from a user; returns the new balance, or None (and changes
+        nothing) if they have fewer than amount"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO user_invites (user_id, guild_id) VALUES (?, ?)", (user_id, guild_id))
-            c.execute("UPDATE user_invites SET claimed_invites = MAX(0, claimed_invites - ?) WHERE user_id = ? AND guild_id = ?", (amount, user_id, guild_id))
+            # The balance check and the debit are one statement, so concurrent redemptions can't both pass
+            c.execute("""
+                UPDATE user_invites SET claimed_invites = claimed_invites - ?
+                WHERE user_id = ? AND guild_id = ? AND claimed_invites >= ?
+            """, (amount, user_id, guild_id, amount))
+            if c.rowcount == 0:
+                conn.rollback()
+                conn.close()
+                return None
+            c.execute("SELECT claimed_invites FROM user_invites WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+            balance = c.fetchone()[0]
+            c.execute("INSERT INTO claims_ledger (guild_id, user_id, actor_id, amount, reason, balance_after) VALUES (?, ?, ?, ?, ?, ?)",
+                      (guild_id, user_id, actor_id, -amount, reason, balance))
             conn.commit()
             conn.close()
+            return balance
+
+    async def get_claim_history_page(self, guild_id, user_id, limit, after=None):
+        """One page of a user's claims_ledger entries, newest first.
+
+        after is the (created_at, id) of the last entry on the previous page."""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query = f"SELECT {columns(ClaimEntry)} FROM claims_ledger WHERE guild_id = ? AND user_id = ?"
+            params = [guild_id, user_id]
+            if after:
+                query += " AND (created_at, id) < (?, ?)"
+                params += list(after)
+            c.execute(query + " ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit])
+            entries = fetch_all(c, ClaimEntry)
+            conn.close()
+            return entries
 
     # Invite codes
     async def upsert_invite_code(self, code, guild_id, inviter_id, uses, max_uses):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("INSERT OR REPLACE INTO invite_codes (code, guild_id, inviter_id, uses, max_uses) VALUES (?, ?, ?, ?, ?)", (code, guild_id, inviter_id, uses, max_uses))
             conn.commit()
@@ -262,7 +1180,7 @@ class Database:
 
     async def get_invite_info(self, code, guild_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("SELECT inviter_id, uses, max_uses FROM invite_codes WHERE code = ? AND guild_id = ?", (code, guild_id))
             row = c.fetchone()
@@ -272,14 +1190,20 @@ class Database:
             return None
 
     # Giveaway methods
-    async def create_giveaway(self, guild_id, host_id, prize, message_id, channel_id, winners, end_time):
+    async def create_giveaway(self, guild_id, host_id, prize, message_id, channel_id, winners, ends_at,
+                              bonus_role_id=None, bonus_role_entries=0, entries_per_invite=0,
+                              min_invites=None, min_account_age_days=None, required_role_id=None):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("""
-                INSERT INTO giveaways (guild_id, host_id, prize, message_id, channel_id, winners, end_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (guild_id, host_id, prize, message_id, channel_id, winners, end_time))
+                INSERT INTO giveaways (guild_id, host_id, prize, message_id, channel_id, winners, ends_at,
+                                       bonus_role_id, bonus_role_entries, entries_per_invite,
+                                       min_invites, min_account_age_days, required_role_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (guild_id, host_id, prize, message_id, channel_id, winners, ends_at,
+                  bonus_role_id, bonus_role_entries, entries_per_invite,
+                  min_invites, min_account_age_days, required_role_id))
             giveaway_id = c.lastrowid
             conn.commit()
             conn.close()
@@ -287,58 +1211,57 @@ class Database:
 
     async def get_giveaway(self, giveaway_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT * FROM giveaways WHERE id = ?", (giveaway_id,))
-            row = c.fetchone()
+            c.execute(f"SELECT {columns(Giveaway)} FROM giveaways WHERE id = ?", (giveaway_id,))
+            giveaway = fetch_one(c, Giveaway)
             conn.close()
-            if row:
-                return {
-                    'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
-                    'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
-                    'end_time': row[7], 'status': row[8], 'created_at': row[9]
-                }
-            return None
+            return giveaway
 
     async def get_giveaway_by_message(self, message_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT * FROM giveaways WHERE message_id = ?", (message_id,))
-            row = c.fetchone()
+            c.execute(f"SELECT {columns(Giveaway)} FROM giveaways WHERE message_id = ?", (message_id,))
+            giveaway = fetch_one(c, Giveaway)
             conn.close()
-            if row:
-                return {
-                    'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
-                    'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
-                    'end_time': row[7], 'status': row[8], 'created_at': row[9]
-                }
-            return None
+            return giveaway
 
-    async def enter_giveaway(self, giveaway_id, user_id):
+    async def enter_giveaway(self, giveaway_id, user_id, weight=1):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             try:
-                c.execute("INSERT INTO giveaway_entries (giveaway_id, user_id) VALUES (?, ?)", (giveaway_id, user_id))
+                # Only accept entries while the giveaway is still active
+                c.execute("""
+                    INSERT INTO giveaway_entries (giveaway_id, user_id, entry_no, weight)
+                    SELECT ?, ?, COALESCE((SELECT MAX(entry_no) FROM giveaway_entries WHERE giveaway_id = ?), 0) + 1, ?
+                    WHERE EXISTS (SELECT 1 FROM giveaways WHERE id = ? AND status = 'active')
+                """, (giveaway_id, user_id, giveaway_id, weight, giveaway_id))
+                entered = c.rowcount > 0
+                if entered:
+                    # Same transaction as the insert, so the counter can't drift
+                    c.execute("UPDATE giveaways SET entry_count = entry_count + 1 WHERE id = ?", (giveaway_id,))
                 conn.commit()
                 conn.close()
-                return True
+                return entered
             except sqlite3.IntegrityError:
                 conn.close()
                 return False  # Already entered
 
     async def leave_giveaway(self, giveaway_id, user_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("DELETE FROM giveaway_entries WHERE giveaway_id = ? AND user_id = ?", (giveaway_id, user_id))
+            if c.rowcount > 0:
+                c.execute("UPDATE giveaways SET entry_count = entry_count - 1 WHERE id = ?", (giveaway_id,))
             conn.commit()
             conn.close()
 
     async def check_giveaway_entry(self, giveaway_id, user_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("SELECT COUNT(*) FROM giveaway_entries WHERE giveaway_id = ? AND user_id = ?", (giveaway_id, user_id))
             count = c.fetchone()[0]
@@ -347,16 +1270,37 @@ class Database:
 
     async def get_giveaway_entries_count(self, giveaway_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM giveaway_entries WHERE giveaway_id = ?", (giveaway_id,))
-            count = c.fetchone()[0]
+            c.execute("SELECT entry_count FROM giveaways WHERE id = ?", (giveaway_id,))
+            result = c.fetchone()
             conn.close()
-            return count
+            return result[0] if result else 0
+
+    async def repair_entry_counts(self, dry_run=False):
+        """Recount every giveaway's entries and fix stored counts that drifted.
+
+        Returns (giveaway_id, stored, actual) for each giveaway that was wrong."""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("""
+                SELECT g.id, g.entry_count, COUNT(e.giveaway_id)
+                FROM giveaways g LEFT JOIN giveaway_entries e ON e.giveaway_id = g.id
+                GROUP BY g.id
+                HAVING g.entry_count IS NOT COUNT(e.giveaway_id)
+            """)
+            drifted = c.fetchall()
+            if not dry_run:
+                c.executemany("UPDATE giveaways SET entry_count = ? WHERE id = ?",
+                              [(actual, giveaway_id) for giveaway_id, _, actual in drifted])
+                conn.commit()
+            conn.close()
+            return drifted
 
     async def get_giveaway_entries(self, giveaway_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("SELECT user_id FROM giveaway_entries WHERE giveaway_id = ?", (giveaway_id,))
             rows = c.fetchall()
@@ -365,59 +1309,324 @@ class Database:
 
     async def get_active_giveaways(self, guild_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT * FROM giveaways WHERE guild_id = ? AND status = 'active' ORDER BY created_at DESC", (guild_id,))
-            rows = c.fetchall()
+            c.execute(f"SELECT {columns(Giveaway)} FROM giveaways WHERE guild_id = ? AND status = 'active' ORDER BY created_at DESC", (guild_id,))
+            giveaways = fetch_all(c, Giveaway)
             conn.close()
-            return [{
-                'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
-                'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
-                'end_time': row[7], 'status': row[8], 'created_at': row[9]
-            } for row in rows]
+            return giveaways
+
+    async def get_active_giveaways_page(self, guild_id, limit, after=None):
+        """One page of active giveaways, newest first, with entry counts.
 
-    async def get_ended_giveaways(self):
+        after is the (created_at, id) of the last giveaway on the previous page."""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            current_time = datetime.now(timezone.utc).isoformat()
-            c.execute("SELECT * FROM giveaways WHERE status = 'active' AND end_time <= ?", (current_time,))
-            rows = c.fetchall()
+            query = f"SELECT {columns(Giveaway)} FROM giveaways WHERE guild_id = ? AND status = 'active'"
+            params = [guild_id]
+            if after:
+                query += " AND (created_at, id) < (?, ?)"
+                params += list(after)
+            c.execute(query + " ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit])
+            giveaways = fetch_all(c, Giveaway)
+            conn.close()
+            return giveaways
+
+    async def get_ended_giveaways(self, shard_count=None, shard_ids=None):
+        """Get ended giveaways, optionally only for guilds on the given shards"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query = f"SELECT {columns(Giveaway)} FROM giveaways WHERE status = 'active' AND ends_at <= ?"
+            params = [int(time.time())]
+            if shard_count and shard_ids is not None:
+                # Same formula Discord uses to assign guilds to shards
+                placeholders = ','.join(['?' for _ in shard_ids])
+                query += f" AND (guild_id >> 22) % ? IN ({placeholders})"
+                params += [shard_count] + list(shard_ids)
+            c.execute(query, params)
+            giveaways = fetch_all(c, Giveaway)
             conn.close()
-            return [{
-                'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
-                'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
-                'end_time': row[7], 'status': row[8], 'created_at': row[9]
-            } for row in rows]
+            return giveaways
 
     async def end_giveaway(self, giveaway_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("UPDATE giveaways SET status = 'ended' WHERE id = ?", (giveaway_id,))
             conn.commit()
             conn.close()
 
+    # Giveaway finalisation (see giveaways.GiveawayFinalizer)
+    async def claim_giveaway(self, giveaway_id):
+        """Move a giveaway from active to ending; only one caller can ever succeed"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("UPDATE giveaways SET status = 'ending', claimed_at = ? WHERE id = ? AND status = 'active'", (int(time.time()), giveaway_id))
+            claimed = c.rowcount == 1
+            conn.commit()
+            conn.close()
+            return claimed
+
+    async def reclaim_stale_giveaway(self, giveaway_id, stale_after):
+        """Take over an ending giveaway whose finaliser has not finished within stale_after seconds.
+
+        Returns how many times it has now been taken over, or 0 if it wasn't."""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            now = int(time.time())
+            c.execute("""
+                UPDATE giveaways SET claimed_at = ?, finish_attempts = COALESCE(finish_attempts, 0) + 1
+                WHERE id = ? AND status = 'ending' AND (claimed_at IS NULL OR claimed_at <= ?)
+            """, (now, giveaway_id, now - stale_after))
+            attempts = 0
+            if c.rowcount == 1:
+                c.execute("SELECT finish_attempts FROM giveaways WHERE id = ?", (giveaway_id,))
+                attempts = c.fetchone()[0]
+            conn.commit()
+            conn.close()
+            return attempts
+
+    async def draw_giveaway_winners(self, giveaway_id, count):
+        """Pick and record winners once; later calls return the recorded winners"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("SELECT drawn FROM giveaways WHERE id = ?", (giveaway_id,))
+            row = c.fetchone()
+            if row and not row[0]:
+                seed = random.getrandbits(63)
+                winners = self._sample_entrants(c, giveaway_id, count, random.Random(seed))
+                print(f"Drew giveaway {giveaway_id} (draw 0) with seed {seed}")
+                c.executemany("INSERT OR IGNORE INTO giveaway_winners (giveaway_id, user_id, draw, seed) VALUES (?, ?, 0, ?)", [(giveaway_id, user_id, seed) for user_id in winners])
+                c.execute("UPDATE giveaways SET drawn = 1 WHERE id = ?", (giveaway_id,))
+            c.execute("SELECT user_id FROM giveaway_winners WHERE giveaway_id = ? AND draw = 0 ORDER BY id", (giveaway_id,))
+            winners = [r[0] for r in c.fetchall()]
+            conn.commit()
+            conn.close()
+            return winners
+
+    async def reroll_giveaway_winners(self, giveaway_id, count):
+        """Draw count new winners from the entrants who have never won this giveaway"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            seed = random.getrandbits(63)
+            winners = self._sample_entrants(c, giveaway_id, count, random.Random(seed))
+            c.execute("SELECT COALESCE(MAX(draw), 0) + 1 FROM giveaway_winners WHERE giveaway_id = ?", (giveaway_id,))
+            draw = c.fetchone()[0]
+            print(f"Drew giveaway {giveaway_id} (draw {draw}) with seed {seed}")
+            c.executemany("INSERT INTO giveaway_winners (giveaway_id, user_id, draw, seed) VALUES (?, ?, ?, ?)", [(giveaway_id, user_id, draw, seed) for user_id in winners])
+            conn.commit()
+            conn.close()
+            return winners
+
+    async def get_giveaway_winner_ids(self, giveaway_id, all_draws=False):
+        """Winners of a giveaway's latest draw, the ones last announced, in draw order.
+
+        With all_draws, everyone ever recorded as winning it, including
+        winners of earlier draws that were rerolled."""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            if all_draws:
+                c.execute("SELECT user_id FROM giveaway_winners WHERE giveaway_id = ? ORDER BY id", (giveaway_id,))
+            else:
+                c.execute("""
+                    SELECT user_id FROM giveaway_winners
+                    WHERE giveaway_id = ? AND draw = (SELECT MAX(draw) FROM giveaway_winners WHERE giveaway_id = ?)
+                    ORDER BY id
+                """, (giveaway_id, giveaway_id))
+            winners = [r[0] for r in c.fetchall()]
+            conn.close()
+            return winners
+
+    def _sample_entrants(self, c, giveaway_id, count, rng):
+        """Pick up to count entrants who are not already recorded winners.
+
+        Uniform giveaways probe random entry numbers through the
+        (giveaway_id, entry_no) index, so the cost depends on count rather
+        than on the number of entries. Numbers freed by users leaving are
+        simply missed and probed again; if the giveaway is too sparse for that
+        to converge, fall back to one scan. Giveaways with bonus entries load
+        the weights in entry order and draw with a Fenwick tree. Given the same
+        entries, the same rng seed always picks the same winners.
+        """
+        c.execute("SELECT user_id FROM giveaway_winners WHERE giveaway_id = ?", (giveaway_id,))
+        excluded = {r[0] for r in c.fetchall()}
+
+        c.execute("SELECT bonus_role_entries, entries_per_invite FROM giveaways WHERE id = ?", (giveaway_id,))
+        bonus = c.fetchone()
+        if bonus and (bonus[0] or bonus[1]):
+            c.execute("SELECT user_id, weight FROM giveaway_entries WHERE giveaway_id = ? ORDER BY entry_no", (giveaway_id,))
+            rows = [r for r in c.fetchall() if r[0] not in excluded]
+            return weighted_sample([r[0] for r in rows], [r[1] for r in rows], count, rng)
+        c.execute("SELECT MAX(entry_no) FROM giveaway_entries WHERE giveaway_id = ?", (giveaway_id,))
+        max_no = c.fetchone()[0] or 0
+
+        picked = []
+        attempts = 0
+        while len(picked) < count and max_no and attempts < 20 * count + 50:
+            attempts += 1
+            c.execute("SELECT user_id FROM giveaway_entries WHERE giveaway_id = ? AND entry_no = ?", (giveaway_id, rng.randint(1, max_no)))
+            row = c.fetchone()
+            if row and row[0] not in excluded:
+                excluded.add(row[0])
+                picked.append(row[0])
+
+        if len(picked) < count and max_no:
+            c.execute("""
+                SELECT user_id FROM giveaway_entries
+                WHERE giveaway_id = ? AND user_id NOT IN (SELECT user_id FROM giveaway_winners WHERE giveaway_id = ?)
+                ORDER BY entry_no
+            """, (giveaway_id, giveaway_id))
+            remaining = [r[0] for r in c.fetchall() if r[0] not in excluded]
+            picked += rng.sample(remaining, min(count - len(picked), len(remaining)))
+        return picked
+
+    async def set_giveaway_announcement(self, giveaway_id, message_id):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("UPDATE giveaways SET announce_message_id = ? WHERE id = ?", (message_id, giveaway_id))
+            conn.commit()
+            conn.close()
+
+    async def complete_giveaway(self, giveaway_id):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("UPDATE giveaways SET status = 'ended' WHERE id = ? AND status = 'ending'", (giveaway_id,))
+            conn.commit()
+            conn.close()
+
+    async def get_ending_giveaways(self, shard_count=None, shard_ids=None):
+        """Get giveaways that were claimed for ending but not completed"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query = f"SELECT {columns(Giveaway)} FROM giveaways WHERE status = 'ending'"
+            params = []
+            if shard_count and shard_ids is not None:
+                placeholders = ','.join(['?' for _ in shard_ids])
+                query += f" AND (guild_id >> 22) % ? IN ({placeholders})"
+                params += [shard_count] + list(shard_ids)
+            c.execute(query, params)
+            giveaways = fetch_all(c, Giveaway)
+            conn.close()
+            return giveaways
+
+    async def get_unfinished_giveaways(self, shard_count=None, shard_ids=None):
+        """Get every active or ending giveaway in one query, for startup recovery"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query = f"SELECT {columns(Giveaway)} FROM giveaways WHERE status IN ('active', 'ending')"
+            params = []
+            if shard_count and shard_ids is not None:
+                placeholders = ','.join(['?' for _ in shard_ids])
+                query += f" AND (guild_id >> 22) % ? IN ({placeholders})"
+                params += [shard_count] + list(shard_ids)
+            c.execute(query + " ORDER BY ends_at", params)
+            giveaways = fetch_all(c, Giveaway)
+            conn.close()
+            return giveaways
+
+    # Giveaway schedule methods
+    async def create_giveaway_schedule(self, guild_id, channel_id, host_id, prize, winners, duration_seconds,
+                                       description, cron, next_run):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO giveaway_schedules (guild_id, channel_id, host_id, prize, winners, duration_seconds,
+                                                description, cron, next_run)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (guild_id, channel_id, host_id, prize, winners, duration_seconds, description, cron, next_run))
+            schedule_id = c.lastrowid
+            conn.commit()
+            conn.close()
+            return schedule_id
+
+    async def get_guild_schedules(self, guild_id):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute(f"SELECT {columns(GiveawaySchedule)} FROM giveaway_schedules WHERE guild_id = ? ORDER BY next_run IS NULL, next_run", (guild_id,))
+            schedules = fetch_all(c, GiveawaySchedule)
+            conn.close()
+            return schedules
+
+    async def delete_giveaway_schedule(self, schedule_id, guild_id):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("DELETE FROM giveaway_schedules WHERE id = ? AND guild_id = ?", (schedule_id, guild_id))
+            deleted = c.rowcount > 0
+            conn.commit()
+            conn.close()
+            return deleted
+
+    def _schedule_shard_filter(self, query, params, shard_count, shard_ids):
+        if shard_count and shard_ids is not None:
+            placeholders = ','.join(['?' for _ in shard_ids])
+            query += f" AND (guild_id >> 22) % ? IN ({placeholders})"
+            params = params + [shard_count] + list(shard_ids)
+        return query, params
+
+    async def get_next_schedule_run(self, shard_count=None, shard_ids=None):
+        """Earliest pending launch time (UTC epoch), or None if nothing is scheduled"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query, params = self._schedule_shard_filter(
+                "SELECT MIN(next_run) FROM giveaway_schedules WHERE next_run IS NOT NULL", [], shard_count, shard_ids)
+            c.execute(query, params)
+            result = c.fetchone()[0]
+            conn.close()
+            return result
+
+    async def get_due_schedules(self, now, shard_count=None, shard_ids=None):
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            query, params = self._schedule_shard_filter(
+                f"SELECT {columns(GiveawaySchedule)} FROM giveaway_schedules WHERE next_run <= ?", [now], shard_count, shard_ids)
+            c.execute(query + " ORDER BY next_run", params)
+            schedules = fetch_all(c, GiveawaySchedule)
+            conn.close()
+            return schedules
+
+    async def advance_schedule(self, schedule_id, expected_run, next_run):
+        """Move a schedule past a launch; only one caller wins for a given expected_run"""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("UPDATE giveaway_schedules SET next_run = ?, last_run = ? WHERE id = ? AND next_run = ?",
+                      (next_run, expected_run, schedule_id, expected_run))
+            advanced = c.rowcount > 0
+            conn.commit()
+            conn.close()
+            return advanced
+
     # Guild settings methods
     async def get_guild_settings(self, guild_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            c.execute("SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,))
-            row = c.fetchone()
+            c.execute(f"SELECT {columns(GuildSettings)} FROM guild_settings WHERE guild_id = ?", (guild_id,))
+            settings = fetch_one(c, GuildSettings)
             conn.close()
-            if row:
-                return {
-                    'guild_id': row[0],
-                    'welcome_channel_id': row[1],
-                    'staff_log_channel_id': row[2],
-                    'mod_log_channel_id': row[3]
-                }
-            return None
+            return settings
 
     async def set_welcome_channel(self, guild_id, channel_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("INSERT OR REPLACE INTO guild_settings (guild_id, welcome_channel_id) VALUES (?, ?)", (guild_id, channel_id))
             conn.commit()
@@ -426,7 +1635,7 @@ class Database:
     async def set_mod_log_channel(self, guild_id, channel_id):
         """Set mod log channel for a guild"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             # First ensure the guild exists in settings
             c.execute("INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)", (guild_id,))
@@ -438,7 +1647,7 @@ class Database:
     async def set_staff_log_channel(self, guild_id, channel_id):
         """Set staff log channel for a guild"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             # First ensure the guild exists in settings
             c.execute("INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)", (guild_id,))
@@ -450,22 +1659,17 @@ class Database:
     async def get_expired_giveaways(self):
         """Get giveaways that have expired"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
-            current_time = datetime.now(timezone.utc).isoformat()
-            c.execute("SELECT * FROM giveaways WHERE status = 'active' AND end_time <= ?", (current_time,))
-            rows = c.fetchall()
+            c.execute(f"SELECT {columns(Giveaway)} FROM giveaways WHERE status = 'active' AND ends_at <= ?", (int(time.time()),))
+            giveaways = fetch_all(c, Giveaway)
             conn.close()
-            return [{
-                'id': row[0], 'guild_id': row[1], 'host_id': row[2], 'prize': row[3],
-                'message_id': row[4], 'channel_id': row[5], 'winners': row[6],
-                'end_time': row[7], 'status': row[8], 'created_at': row[9]
-            } for row in rows]
+            return giveaways
 
     # Role permission methods
     async def add_role_permission(self, guild_id, role_id, command_name):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             try:
                 c.execute("INSERT INTO role_permissions (guild_id, role_id, command_name) VALUES (?, ?, ?)", (guild_id, role_id, command_name))
@@ -478,7 +1682,7 @@ class Database:
 
     async def remove_role_permission(self, guild_id, role_id, command_name):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("DELETE FROM role_permissions WHERE guild_id = ? AND role_id = ? AND command_name = ?", (guild_id, role_id, command_name))
             deleted = c.rowcount > 0
@@ -488,7 +1692,7 @@ class Database:
 
     async def check_role_permission(self, guild_id, role_ids, command_name):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             placeholders = ','.join(['?' for _ in role_ids])
             c.execute(f"SELECT COUNT(*) FROM role_permissions WHERE guild_id = ? AND role_id IN ({placeholders}) AND command_name = ?", [guild_id] + role_ids + [command_name])
@@ -498,7 +1702,7 @@ class Database:
 
     async def get_command_permissions(self, guild_id, command_name):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("SELECT role_id FROM role_permissions WHERE guild_id = ? AND command_name = ?", (guild_id, command_name))
             rows = c.fetchall()
@@ -507,7 +1711,7 @@ class Database:
 
     async def get_role_permissions(self, guild_id, role_id):
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             c = conn.cursor()
             c.execute("SELECT command_name FROM role_permissions WHERE guild_id = ? AND role_id = ?", (guild_id, role_id))
             rows = c.fetchall()
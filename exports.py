@@ -0,0 +1,64 @@
+"""Gzipped per-guild data exports as CSV or NDJSON.
+
+Rows are read in keyset-paginated chunks (Database.get_export_chunk) and
+written straight into the gzip stream, so memory use is one chunk however
+large the guild is.
+"""
+import asyncio
+import csv
+import gzip
+import json
+import os
+import time
+
+from database import EXPORT_TABLES, export_header
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+class ExportResult:
+    def __init__(self, table, path, rows, seconds):
+        self.table = table
+        self.path = path
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+def export_filename(table, guild_id, fmt):
+    return f"{table}-{guild_id}.{fmt}.gz"
+
+async def export_table(db, table, guild_id, fmt, path):
+    """Stream one table's rows for a guild into a gzip file at path"""
+    header = export_header(table)
+    start = time.perf_counter()
+    rows_written = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as output:
+        if fmt == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(header)
+        cursor = None
+        while True:
+            rows, cursor = await db.get_export_chunk(table, guild_id, cursor)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                output.writelines(json.dumps(dict(zip(header, row)), separators=(',', ':')) + '\n' for row in rows)
+            rows_written += len(rows)
+            # Let the bot handle events between chunks of a long export
+            await asyncio.sleep(0)
+    return ExportResult(table, path, rows_written, time.perf_counter() - start)
+
+async def export_guild(db, guild_id, fmt, directory, tables=None):
+    """Export each table (default: all of EXPORT_TABLES) to its own file in directory"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    for table in tables or EXPORT_TABLES:
+        path = os.path.join(directory, export_filename(table, guild_id, fmt))
+        results.append(await export_table(db, table, guild_id, fmt, path))
+    return results
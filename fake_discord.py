@@ -0,0 +1,233 @@
+"""In-process stand-ins for the parts of discord.py the bot's handlers touch.
+
+Used by loadtest.py and tracing.py to drive main.py's event handlers and views without a
+connection to Discord. Every call that would hit the Discord HTTP API goes
+through FakeGateway.api_call, which counts it and can add simulated latency.
+"""
+import asyncio
+import itertools
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+_ids = itertools.count(10**17)
+
+def next_id():
+    """Snowflake-sized ids that are unique within the process"""
+    return next(_ids)
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+class FakeRole:
+    def __init__(self, guild, name, position=1, role_id=None):
+        self.id = role_id or next_id()
+        self.guild = guild
+        self.name = name
+        self.position = position
+        self.mention = f"<@&{self.id}>"
+
+    def is_default(self):
+        return self.position == 0
+
+class FakeUser:
+    def __init__(self, name, user_id=None, bot=False, created_at=None):
+        self.id = user_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.discriminator = "0"
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.created_at = created_at or datetime.now(timezone.utc) - timedelta(days=365)
+        self.display_avatar = FakeAsset(f"https://cdn.example/avatars/{self.id}.png")
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, name, user_id=None, bot=False, created_at=None, roles=None, administrator=False):
+        super().__init__(name, user_id, bot, created_at)
+        self.guild = guild
+        self.joined_at = datetime.now(timezone.utc)
+        self.roles = roles or []
+        self.guild_permissions = FakePermissions(administrator)
+
+class FakeMessage:
+    def __init__(self, gateway, channel, author=None, content="", embeds=None):
+        self.gateway = gateway
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = embeds or []
+
+    async def edit(self, embed=None, view=None, **kwargs):
+        await self.gateway.api_call("message.edit")
+        if embed is not None:
+            self.embeds = [embed]
+
+class FakeChannel:
+    def __init__(self, gateway, guild, name):
+        self.gateway = gateway
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.type = "text"
+        self.messages = {}
+
+    async def send(self, content=None, embed=None, view=None, **kwargs):
+        await self.gateway.api_call("channel.send")
+        message = FakeMessage(self.gateway, self, content=content or "", embeds=[embed] if embed else [])
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.gateway.api_call("channel.fetch_message")
+        return self.messages[message_id]
+
+class FakeInvite:
+    def __init__(self, guild, inviter, uses=0, max_uses=0, code=None):
+        self.code = code or f"inv{next_id()}"
+        self.guild = guild
+        self.inviter = inviter
+        self.uses = uses
+        self.max_uses = max_uses
+
+class FakeGuild:
+    def __init__(self, gateway, name="Load Test Guild"):
+        self.gateway = gateway
+        self.id = next_id()
+        self.name = name
+        self.members = {}
+        self.channels = {}
+        self.roles = {}
+        self.invite_list = []
+        self.owner = self.add_member("owner", administrator=True)
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    def add_member(self, name, **kwargs):
+        member = FakeMember(self, name, **kwargs)
+        self.members[member.id] = member
+        self.gateway.users[member.id] = member
+        return member
+
+    def add_channel(self, name):
+        channel = FakeChannel(self.gateway, self, name)
+        self.channels[channel.id] = channel
+        self.gateway.channels[channel.id] = channel
+        return channel
+
+    def add_role(self, name, position=1):
+        role = FakeRole(self, name, position)
+        self.roles[role.id] = role
+        return role
+
+    def add_invite(self, inviter, uses=0, code=None):
+        invite = FakeInvite(self, inviter, uses, code=code)
+        self.invite_list.append(invite)
+        return invite
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    async def invites(self):
+        await self.gateway.api_call("guild.invites")
+        return list(self.invite_list)
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, route):
+        if self._done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self._done = True
+        await self.interaction.gateway.api_call(route)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond("interaction.send_message")
+
+    async def defer(self, **kwargs):
+        await self._respond("interaction.defer")
+
+    async def send_modal(self, modal):
+        await self._respond("interaction.send_modal")
+
+class FakeFollowup:
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    async def send(self, content=None, **kwargs):
+        await self.gateway.api_call("interaction.followup")
+
+class FakeInteraction:
+    def __init__(self, gateway, user, channel, message=None):
+        self.gateway = gateway
+        self.id = next_id()
+        self.user = user
+        self.guild = channel.guild
+        self.channel = channel
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(gateway)
+
+    async def original_response(self):
+        await self.gateway.api_call("interaction.original_response")
+        return self.message
+
+    async def edit_original_response(self, **kwargs):
+        await self.gateway.api_call("interaction.edit_original_response")
+
+class FakeGateway:
+    """Holds the fake guild state and counts outbound API calls"""
+
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency
+        self.api_calls = Counter()
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+
+    async def api_call(self, route):
+        self.api_calls[route] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        else:
+            # Still yield like a real HTTP call would
+            await asyncio.sleep(0)
+
+    def add_guild(self, name="Load Test Guild"):
+        guild = FakeGuild(self, name)
+        self.guilds[guild.id] = guild
+        return guild
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def install(self, bot):
+        """Route the bot's cache lookups to this gateway's state"""
+        bot.get_guild = self.get_guild
+        bot.get_channel = self.get_channel
+        bot.get_user = self.get_user
@@ -0,0 +1,114 @@
+import discord
+
+# An ending giveaway whose finaliser hasn't finished after this long is assumed
+# to belong to a crashed worker and is taken over
+STALE_CLAIM_SECONDS = 300
+
+# Takeovers after which a giveaway whose announcement keeps failing is ended
+# without one, rather than retried every STALE_CLAIM_SECONDS forever
+MAX_FINISH_ATTEMPTS = 5
+
+class GiveawayFinalizer:
+    """Ends giveaways exactly once.
+
+    Ending is split into steps that are each safe to repeat:
+      1. claim   - active -> ending with a conditional UPDATE; only one caller wins
+      2. draw    - winners are picked once and stored in giveaway_winners
+      3. announce/edit - Discord side effects, skipped where already recorded done
+      4. complete - ending -> ended
+    A worker that dies between steps leaves the giveaway in 'ending'; resume()
+    picks it up again after STALE_CLAIM_SECONDS and continues from step 2.
+    So does one whose guild is unavailable, since its winners can't be
+    announced yet. Announcing is given up after MAX_FINISH_ATTEMPTS takeovers,
+    and skipped when the giveaway's channel has been deleted.
+    """
+
+    def __init__(self, bot, db, ticket_channel_id):
+        self.bot = bot
+        self.db = db
+        self.ticket_channel_id = ticket_channel_id
+
+    async def finalize(self, giveaway):
+        """End an active giveaway; returns False if another caller already claimed it"""
+        if not await self.db.claim_giveaway(giveaway.id):
+            return False
+        await self._finish(giveaway)
+        return True
+
+    async def resume(self, giveaway):
+        """Finish a giveaway left in 'ending' by a finaliser that never completed"""
+        attempts = await self.db.reclaim_stale_giveaway(giveaway.id, STALE_CLAIM_SECONDS)
+        if not attempts:
+            return False
+        await self._finish(giveaway, give_up=attempts > MAX_FINISH_ATTEMPTS)
+        return True
+
+    async def _finish(self, giveaway, give_up=False):
+        winner_ids = await self.db.draw_giveaway_winners(giveaway.id, giveaway.winners)
+
+        guild = self.bot.get_guild(giveaway.guild_id)
+        if guild is None:
+            # Unavailable (e.g. an outage); stay 'ending' so resume() retries later
+            return
+
+        if give_up:
+            print(f"Giving up announcing giveaway {giveaway.id} after {MAX_FINISH_ATTEMPTS} retries")
+        else:
+            channel = guild.get_channel(giveaway.channel_id)
+            if channel is None:
+                try:
+                    channel = await guild.fetch_channel(giveaway.channel_id)
+                except discord.NotFound:
+                    print(f"Channel of giveaway {giveaway.id} was deleted; ending it without an announcement")
+            if channel:
+                if not giveaway.announce_message_id:
+                    announcement = await self._announce(guild, channel, giveaway, winner_ids)
+                    await self.db.set_giveaway_announcement(giveaway.id, announcement.id)
+                await self._mark_message_ended(channel, giveaway)
+
+        await self.db.complete_giveaway(giveaway.id)
+
+    def results_embed(self, guild, giveaway, winner_ids):
+        embed = discord.Embed(
+            title="🎉 Congratulations!",
+            color=0xFF0000
+        )
+        if not winner_ids:
+            embed.description = f"**Prize:** {giveaway.prize}\n\nNo one entered this giveaway."
+            return embed
+
+        winner_mentions = [member.mention for member in (guild.get_member(user_id) for user_id in winner_ids) if member]
+
+        description = f"**Prize:** {giveaway.prize}\n"
+        if winner_mentions:
+            description += f"**Winner(s):** {', '.join(winner_mentions)}\n"
+        description += f"**Hosted by:** <@{giveaway.host_id}>\n\n"
+        description += "────────────────────────\n\n"
+        description += f"- Open a ticket in <#{self.ticket_channel_id}>\n"
+        description += "- Please take a screenshot of this message and send it in your claim ticket!"
+        embed.description = description
+        return embed
+
+    async def _announce(self, guild, channel, giveaway, winner_ids):
+        # Send winner pings first
+        winner_mentions = [member.mention for member in (guild.get_member(user_id) for user_id in winner_ids) if member]
+        if winner_mentions:
+            await channel.send(f"🎉 {' '.join(winner_mentions)}")
+        return await channel.send(embed=self.results_embed(guild, giveaway, winner_ids))
+
+    async def _mark_message_ended(self, channel, giveaway):
+        try:
+            original_message = await channel.fetch_message(giveaway.message_id)
+            original_embed = original_message.embeds[0]
+            original_embed.title = f"🎉 {giveaway.prize} (ENDED)"
+            original_embed.color = 0x808080  # Gray for ended
+
+            # Update time field
+            for i, field in enumerate(original_embed.fields):
+                if field.name == "Time:":
+                    original_embed.set_field_at(i, name="Time:", value="Ended", inline=True)
+                    break
+
+            await original_message.edit(embed=original_embed, view=None)
+        except Exception as e:
+            print(f"Error updating giveaway message {giveaway.message_id}: {e}")
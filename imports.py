@@ -0,0 +1,175 @@
+"""Bulk import of per-user invite counts, e.g. from another bot's export.
+
+Accepts CSV with a header row, a JSON array of objects, or NDJSON (one
+object per line), optionally gzipped, so this bot's own /export output can
+be read back too. Each record needs a user_id plus any of the counter
+columns; the columns of the first object decide what is imported. Invalid
+records are skipped and reported with their line (or array index), and
+valid ones are written IMPORT_BATCH_SIZE at a time, one transaction each.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import time
+
+from database import INVITE_COUNTERS
+
+IMPORT_FORMATS = ('csv', 'json', 'ndjson')
+IMPORT_MODES = ('merge', 'overwrite')
+
+# Rows upserted per transaction
+IMPORT_BATCH_SIZE = 10000
+
+# Skipped rows kept with their reason; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# Largest value an SQLite INTEGER column holds; bigger IDs or counts are skipped
+# rather than overflowing the batch they are in
+MAX_SQLITE_INTEGER = 2**63 - 1
+
+# Short names accepted for the counter columns, as used by InviteStats and other bots' exports
+COLUMN_ALIASES = {
+    'total': 'total_invites', 'joins': 'total_invites', 'invites': 'total_invites',
+    'left': 'left_invites', 'leaves': 'left_invites',
+    'fake': 'fake_invites', 'fakes': 'fake_invites',
+    'bonus': 'bonus_invites',
+    'claimed': 'claimed_invites',
+}
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []  # [(line, reason), ...] up to MAX_REPORTED_ERRORS
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+def detect_format(filename):
+    """(format, gzipped) from a file name like invites.csv or user_invites-1.ndjson.gz"""
+    name = filename.lower()
+    gzipped = name.endswith('.gz')
+    if gzipped:
+        name = name[:-3]
+    for fmt in IMPORT_FORMATS:
+        if name.endswith('.' + fmt):
+            return fmt, gzipped
+    raise ValueError("Import files must end in .csv, .json or .ndjson (optionally .gz)")
+
+def read_records(stream, fmt, gzipped=False):
+    """Yield (line, record) for each record in a binary stream; record is None for unparseable NDJSON lines"""
+    if gzipped:
+        stream = gzip.GzipFile(fileobj=stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        # Line 1 is the header
+        yield from enumerate(csv.DictReader(text), 2)
+    elif fmt == 'ndjson':
+        for line, raw in enumerate(text, 1):
+            if raw.strip():
+                try:
+                    yield line, json.loads(raw)
+                except json.JSONDecodeError:
+                    # Reported as a skipped record rather than failing the whole import
+                    yield line, None
+    else:
+        data = json.load(text)
+        if not isinstance(data, list):
+            raise ValueError("A JSON import must be an array of objects")
+        yield from enumerate(data, 1)
+
+def counter_columns(record):
+    """INVITE_COUNTERS columns present in a record, in INVITE_COUNTERS order"""
+    present = {COLUMN_ALIASES.get(key.strip().lower(), key.strip().lower()) for key in record if key}
+    return [counter for counter in INVITE_COUNTERS if counter in present]
+
+def parse_count(value):
+    if value is None or value == '':
+        return 0
+    try:
+        if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        number = int(value) if isinstance(value, (int, float)) else int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"`{value}` is not a whole number")
+    if number < 0:
+        raise ValueError(f"`{value}` is negative")
+    if number > MAX_SQLITE_INTEGER:
+        raise ValueError(f"`{value}` is too large")
+    return number
+
+def parse_record(record, counters):
+    """(user_id, *counts) for a record, or ValueError describing what is wrong with it"""
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    values = {COLUMN_ALIASES.get(key.strip().lower(), key.strip().lower()): value for key, value in record.items() if key}
+    raw_id = values.get('user_id')
+    if raw_id is None or raw_id == '':
+        raise ValueError("missing user_id")
+    # Only exact integers: a float ID has already lost digits and would credit the wrong user
+    if isinstance(raw_id, int) and not isinstance(raw_id, bool):
+        user_id = raw_id
+    elif isinstance(raw_id, str) and raw_id.strip().isdecimal():
+        user_id = int(raw_id.strip())
+    else:
+        raise ValueError(f"invalid user_id `{raw_id}`")
+    if user_id <= 0:
+        raise ValueError("missing user_id")
+    if user_id > MAX_SQLITE_INTEGER:
+        raise ValueError(f"user_id `{values.get('user_id')}` is out of range")
+    counts = []
+    for counter in counters:
+        try:
+            counts.append(parse_count(values.get(counter)))
+        except ValueError as e:
+            raise ValueError(f"invalid {counter}: {e}")
+    return (user_id, *counts)
+
+async def import_invites(db, guild_id, stream, fmt, gzipped=False, mode='merge', progress=None):
+    """Validate and upsert every record in stream into a guild's user_invites.
+
+    progress, if given, is awaited with the running ImportReport after each batch."""
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode {mode!r}")
+    report = ImportReport()
+    start = time.perf_counter()
+    counters = None
+    batch = []
+
+    async def flush():
+        report.imported += await db.import_user_invites(guild_id, counters, batch, overwrite=mode == 'overwrite')
+        batch.clear()
+        report.seconds = time.perf_counter() - start
+        if progress:
+            await progress(report)
+        await asyncio.sleep(0)
+
+    for line, record in read_records(stream, fmt, gzipped):
+        if counters is None:
+            # Records before the first object can't name any columns; skip them like any other bad record
+            if not isinstance(record, dict):
+                report.skip(line, "not a JSON object")
+                continue
+            counters = counter_columns(record)
+            if not counters:
+                raise ValueError(f"No invite counter columns found; expected some of {', '.join(INVITE_COUNTERS)}")
+        try:
+            batch.append(parse_record(record, counters))
+        except ValueError as e:
+            report.skip(line, str(e))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    report.seconds = time.perf_counter() - start
+    return report
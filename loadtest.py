@@ -0,0 +1,200 @@
+"""Offline load generator for the bot's hot paths.
+
+Runs main.py's real event handlers and views against fake_discord's stand-in
+gateway and a scratch SQLite database, then reports throughput, handler
+latency, time spent in the database and outbound Discord API calls.
+
+Usage:
+    python loadtest.py                          # all scenarios at full size
+    python loadtest.py join_raid --scale 0.1    # one scenario, 10% size
+    python loadtest.py --json after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone, timedelta
+
+import discord
+
+import main
+from database import Database
+from fake_discord import FakeGateway, FakeInteraction
+
+async def setup_join_raid(gateway, size):
+    """size members join through a handful of invites"""
+    guild = gateway.add_guild()
+    welcome = guild.add_channel("welcome")
+    mod_log = guild.add_channel("mod-log")
+    await main.db.set_welcome_channel(guild.id, welcome.id)
+    await main.db.set_mod_log_channel(guild.id, mod_log.id)
+
+    invites = [guild.add_invite(guild.add_member(f"inviter{i}")) for i in range(50)]
+    await main.cache_invites(guild)
+    now = datetime.now(timezone.utc)
+
+    def join(i):
+        async def run():
+            invite = random.choice(invites)
+            invite.uses += 1
+            # Roughly one in five raiders is a fresh account
+            age = timedelta(days=1) if i % 5 == 0 else timedelta(days=400)
+            member = guild.add_member(f"raider{i}", created_at=now - age)
+            await main.on_member_join(member)
+        return run
+    return [join(i) for i in range(size)]
+
+async def setup_giveaway_clicks(gateway, size):
+    """size button clicks on one giveaway; some users click twice to leave"""
+    guild = gateway.add_guild()
+    channel = guild.add_channel("giveaways")
+    ends_at = int(time.time()) + 86400
+
+    embed = discord.Embed(title="Load Test Prize", color=0xFF0000)
+    embed.add_field(name="Hosted by:", value=guild.owner.mention, inline=False)
+    embed.add_field(name="Entries:", value="0", inline=True)
+    embed.add_field(name="Winners:", value="1", inline=True)
+    embed.add_field(name="Time:", value=f"<t:{ends_at}:R>", inline=True)
+    message = await channel.send(embed=embed)
+    await main.db.create_giveaway(guild.id, guild.owner.id, "Load Test Prize", message.id, channel.id, 1, ends_at)
+
+    view = main.EnterGiveawayView()
+    users = [guild.add_member(f"entrant{i}") for i in range(max(1, int(size * 0.8)))]
+
+    def click(i):
+        async def run():
+            interaction = FakeInteraction(gateway, users[i % len(users)], channel, message)
+            await view.enter_giveaway.callback(interaction)
+        return run
+    return [click(i) for i in range(size)]
+
+async def setup_mass_delete(gateway, size):
+    """size user messages deleted while a mod log channel is configured"""
+    guild = gateway.add_guild()
+    channel = guild.add_channel("general")
+    mod_log = guild.add_channel("mod-log")
+    await main.db.set_mod_log_channel(guild.id, mod_log.id)
+    authors = [guild.add_member(f"chatter{i}") for i in range(100)]
+    messages = []
+    for i in range(size):
+        message = await channel.send(content=f"message {i}")
+        message.author = authors[i % len(authors)]
+        messages.append(message)
+    gateway.api_calls.clear()
+
+    def delete(message):
+        async def run():
+            await main.on_message_delete(message)
+        return run
+    return [delete(m) for m in messages]
+
+SCENARIOS = {
+    'join_raid': (setup_join_raid, 10000),
+    'giveaway_clicks': (setup_giveaway_clicks, 50000),
+    'mass_delete': (setup_mass_delete, 10000),
+}
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def run_scenario(name, scale, concurrency, api_latency):
+    setup, full_size = SCENARIOS[name]
+    size = max(1, int(full_size * scale))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        main.db = Database(os.path.join(tmp, "loadtest.db"))
+        await main.db.create_tables()
+        main.invite_cache.clear()
+        main.processed_joins.clear()
+        gateway = FakeGateway(api_latency)
+        gateway.install(main.bot)
+
+        calls = await setup(gateway, size)
+        gateway.api_calls.clear()
+
+        db_time = 0.0
+        def on_query(sql, seconds):
+            nonlocal db_time
+            db_time += seconds
+        main.db.add_query_observer(on_query)
+
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(call):
+            async with semaphore:
+                start = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        # Handlers log with print(); keep the report readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            await asyncio.gather(*(timed(call) for call in calls))
+        wall = time.perf_counter() - started
+        main.db.remove_query_observer(on_query)
+
+    latencies.sort()
+    return {
+        'scenario': name,
+        'ops': size,
+        'wall_s': wall,
+        'ops_per_s': size / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'db_ms_per_op': db_time * 1000 / size,
+        'api_calls': dict(gateway.api_calls),
+    }
+
+def print_report(results, baseline=None):
+    print(f"{'scenario':<16} {'ops':>7} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'db ms/op':>9} {'api/op':>7}")
+    for r in results:
+        api_per_op = sum(r['api_calls'].values()) / r['ops']
+        print(f"{r['scenario']:<16} {r['ops']:>7} {r['ops_per_s']:>9.1f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['db_ms_per_op']:>9.3f} {api_per_op:>7.2f}")
+        before = (baseline or {}).get(r['scenario'])
+        if before:
+            print(f"{'  vs baseline':<16} {'':>7} {r['ops_per_s'] / before['ops_per_s']:>8.2f}x "
+                  f"{r['p50_ms'] - before['p50_ms']:>+8.3f} {r['p99_ms'] - before['p99_ms']:>+8.3f} "
+                  f"{r['db_ms_per_op'] - before['db_ms_per_op']:>+9.3f}")
+        for route, count in sorted(r['api_calls'].items()):
+            print(f"    {route:<32} {count}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test the bot's handlers offline")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every scenario's size")
+    parser.add_argument("--concurrency", type=int, default=50, help="Handlers in flight at once")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Simulated seconds per Discord API call")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for scenario generation")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Show deltas against results from a previous --json run")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    random.seed(args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r['scenario']: r for r in json.load(f)}
+
+    async def run_all():
+        return [await run_scenario(name, args.scale, args.concurrency, args.api_latency)
+                for name in (args.scenarios or SCENARIOS)]
+
+    results = asyncio.run(run_all())
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,24 +3,51 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
-import random
-from datetime import datetime, timezone, timedelta
-from database import Database
+import hashlib
+import io
+import json
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+from analytics import RETENTION_DAYS, RetentionAnalyzer
+from database import EXPORT_TABLES, ROLLUP_BUCKET_SECONDS, Database
+from exports import export_guild
+from imports import MAX_SQLITE_INTEGER, detect_format, import_invites
 from keep_alive import keep_alive
-
-# Start keep-alive server for Replit
-keep_alive()
+from giveaways import GiveawayFinalizer
+from profiler import SamplingProfiler
+from schedules import CronSchedule, GiveawayScheduler
+from requirements import InviteSnapshot, RequirementChecker, describe_requirements, parse_requirements
+from tracing import TraceRecorder, run_trace_path
+
+# Sharding: SHARD_COUNT switches to AutoShardedBot, SHARD_IDS restricts this
+# process to a subset of the shards (set per worker by cluster.py)
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = [int(s) for s in os.getenv('SHARD_IDS', '').split(',') if s.strip()] or None
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', '0'))
+if SHARD_IDS and not SHARD_COUNT:
+    # discord.py needs the total to know which guilds the listed shards own
+    raise SystemExit("ERROR: SHARD_IDS is set but SHARD_COUNT is not; set both to run a subset of shards")
 
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+if SHARD_COUNT or SHARD_IDS:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, help_command=None, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
 db = Database()
 
-# Check for Discord token
+# Opt-in recording of handled gateway events for offline replay (see tracing.py)
+trace_recorder = TraceRecorder(run_trace_path(os.getenv('TRACE_FILE'), CLUSTER_ID)) if os.getenv('TRACE_FILE') else None
+
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
-if not DISCORD_TOKEN:
-    print("ERROR: DISCORD_TOKEN environment variable not set!")
-    print("Please set your Discord bot token in the Secrets tab.")
-    exit(1)
+
+@bot.event
+async def setup_hook():
+    """Runs once before connecting, so it is not repeated on reconnects"""
+    await db.create_tables()
+    # Re-attach the persistent Enter button to giveaway messages sent before a restart
+    bot.add_view(EnterGiveawayView())
 
 # Global error handler to prevent crashes
 @bot.event
@@ -55,20 +82,39 @@ EMOJIS = {
 
 TICKET_CHANNEL_ID = 1401443088446128137  # Your ticket channel ID
 
+# Upper limit on bonus entries from roles and invites in weighted giveaways
+MAX_BONUS_ENTRIES = 100
+
+giveaway_finalizer = GiveawayFinalizer(bot, db, TICKET_CHANNEL_ID)
+
+# Giveaways finalised at once during startup recovery
+RECOVERY_CONCURRENCY = 5
+
+# Net invite counts cached per guild so entry checks don't query on every click
+invite_snapshot = InviteSnapshot(db)
+requirement_checker = RequirementChecker(invite_snapshot)
+retention_analyzer = RetentionAnalyzer(db)
+
 # Available commands for permission management
 AVAILABLE_COMMANDS = [
-    'invites', 'claimcheck', 'addclaims', 'removeclaims', 'leaderboard', 'syncinvites',
+    'invites', 'claimcheck', 'claimhistory', 'addclaims', 'bulkclaims', 'removeclaims', 'leaderboard', 'invitestats', 'invitetree', 'retention', 'export', 'importinvites', 'syncinvites',
     'promote', 'demote', 'setstafflog', 'testwelcome',
-    'gcreate', 'glist', 'gend', 'greroll', 'ping',
+    'gcreate', 'glist', 'gend', 'greroll', 'gschedule', 'gschedules', 'gunschedule', 'ping',
     'setwelcome', 'setmodlogs', 'addcmdperm', 'removecmdperm', 'listcmdperm'
 ]
 
-# Invite cache for tracking
+# Invite cache for tracking, keyed by guild id (a cluster worker only sees its own shards' guilds)
 invite_cache = {}
 
 # Track processed member joins to prevent duplicates
 processed_joins = set()
 
+# Only one /profile run may be active at a time
+profile_running = False
+
+# Set once the first on_ready has finished; reconnects fire on_ready again
+startup_complete = False
+
 async def check_command_permission(interaction: discord.Interaction, command_name: str) -> bool:
     """Check if user has permission to use a command based on role permissions"""
     # Server owner always has permission
@@ -89,6 +135,26 @@ async def check_command_permission(interaction: discord.Interaction, command_nam
 
     return has_permission
 
+def command_tree_hash():
+    """Hash the payload that bot.tree.sync() would upload"""
+    payload = sorted((cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()), key=lambda c: c['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree():
+    """Sync slash commands only when their definitions changed since the last sync"""
+    state_key = f"command_tree_hash:{bot.application_id}"
+    tree_hash = command_tree_hash()
+    if await db.get_state(state_key) == tree_hash:
+        print("Slash commands unchanged, skipping sync")
+        return
+
+    try:
+        synced = await bot.tree.sync()
+        print(f"Synced {len(synced)} command(s)")
+        await db.set_state(state_key, tree_hash)
+    except Exception as e:
+        print(f"Failed to sync commands: {e}")
+
 async def cache_invites(guild):
     """Cache current invites for a guild"""
     try:
@@ -102,10 +168,86 @@ async def cache_invites(guild):
         print(f"Error caching invites for {guild.name}: {e}")
         invite_cache[guild.id] = {}
 
+def progress_updater(interaction, title):
+    """Coroutine function update(description, final=False) that edits the
+    interaction's response with a progress embed"""
+    last_update = 0.0
+
+    async def update(description, final=False):
+        nonlocal last_update
+        # Discord rate limits edits, so only refresh about once a second
+        if not final and time.monotonic() - last_update < 1:
+            return
+        last_update = time.monotonic()
+        embed = discord.Embed(title=title, description=description, color=COLORS['blue'])
+        await interaction.edit_original_response(embed=embed)
+
+    return update
+
+def parse_member_ids(text, guild):
+    """(member ids, ignored count) for user mentions and bare IDs in pasted text.
+
+    Role and channel mentions and numbers that aren't members of the guild,
+    e.g. message IDs, are ignored rather than treated as users."""
+    member_ids = {}
+    ignored = 0
+    for mention, bare in re.findall(r'<@!?(\d+)>|<[^>]*>|(\d+)', text):
+        user_id = int(mention or bare or 0)
+        if 0 < user_id <= MAX_SQLITE_INTEGER and guild.get_member(user_id):
+            member_ids[user_id] = None
+        else:
+            ignored += 1
+    return member_ids, ignored
+
+def parse_duration(text):
+    """Seconds in a duration like "10 minutes", "2h" or "1d" (bare numbers are minutes), or None"""
+    duration_str = text.lower().strip()
+    match = re.search(r'(\d+)', duration_str)
+    if 'hour' in duration_str or duration_str.endswith('h'):
+        unit = 3600
+    elif 'minute' in duration_str or duration_str.endswith('m'):
+        unit = 60
+    elif 'day' in duration_str or duration_str.endswith('d'):
+        unit = 86400
+    elif 'second' in duration_str or duration_str.endswith('s'):
+        unit = 1
+    elif duration_str.isdigit():
+        unit = 60
+    else:
+        return None
+    return int(match.group(1)) * unit if match else None
+
+def build_giveaway_embed(prize, host_mention, winners, ends_at, description=None, bonus_text="", requirements_text=""):
+    """Giveaway message embed, shared by /gcreate and scheduled launches"""
+    # Create embed - RED COLOR for giveaway embeds
+    embed = discord.Embed(
+        title=f"{prize}",
+        color=0xFF0000  # RED color matching your screenshots
+    )
+
+    # Format fields to exactly match the image with live countdown
+    embed.add_field(name="Hosted by:", value=host_mention, inline=False)
+    embed.add_field(name="Entries:", value="0", inline=True)
+    embed.add_field(name="Winners:", value=str(winners), inline=True)
+    embed.add_field(name="Time:", value=f"<t:{ends_at}:R>", inline=True)
+
+    # Add description if provided
+    if description and description.strip():
+        embed.description = description.strip()
+
+    if bonus_text:
+        embed.add_field(name="Bonus Entries:", value=bonus_text, inline=False)
+    if requirements_text:
+        embed.add_field(name="Requirements:", value=requirements_text, inline=False)
+    return embed
+
 # --- GIVEAWAY MODAL ---
 class GiveawayModal(discord.ui.Modal, title='Create Giveaway'):
-    def __init__(self):
+    def __init__(self, bonus_role=None, bonus_role_entries=0, entries_per_invite=0):
         super().__init__()
+        self.bonus_role = bonus_role
+        self.bonus_role_entries = bonus_role_entries
+        self.entries_per_invite = entries_per_invite
 
     duration = discord.ui.TextInput(
         label='Duration',
@@ -136,59 +278,20 @@ class GiveawayModal(discord.ui.Modal, title='Create Giveaway'):
         style=discord.TextStyle.paragraph
     )
 
+    requirements = discord.ui.TextInput(
+        label='Requirements',
+        placeholder='Optional, e.g. invites:5, age:30d, role:Members',
+        max_length=200,
+        required=False
+    )
+
     async def on_submit(self, interaction: discord.Interaction):
         try:
-            # Parse duration - support various formats
-            duration_str = self.duration.value.lower().strip()
-            end_time = None
-
-            # Try to parse different duration formats
-            total_seconds = 0
-            
-            if 'hour' in duration_str or duration_str.endswith('h'):
-                # Extract number from string like "2 hours" or "2h"
-                import re
-                match = re.search(r'(\d+)', duration_str)
-                if match:
-                    hours = int(match.group(1))
-                    total_seconds = hours * 3600
-                    end_time = datetime.now(timezone.utc) + timedelta(hours=hours)
-            elif 'minute' in duration_str or duration_str.endswith('m'):
-                # Extract number from string like "30 minutes" or "30m"
-                import re
-                match = re.search(r'(\d+)', duration_str)
-                if match:
-                    minutes = int(match.group(1))
-                    total_seconds = minutes * 60
-                    end_time = datetime.now(timezone.utc) + timedelta(minutes=minutes)
-            elif 'day' in duration_str or duration_str.endswith('d'):
-                # Extract number from string like "2 days" or "2d"
-                import re
-                match = re.search(r'(\d+)', duration_str)
-                if match:
-                    days = int(match.group(1))
-                    total_seconds = days * 86400
-                    end_time = datetime.now(timezone.utc) + timedelta(days=days)
-            elif 'second' in duration_str or duration_str.endswith('s'):
-                # Extract number from string like "30 seconds" or "30s"
-                import re
-                match = re.search(r'(\d+)', duration_str)
-                if match:
-                    seconds = int(match.group(1))
-                    total_seconds = seconds
-                    end_time = datetime.now(timezone.utc) + timedelta(seconds=seconds)
-            else:
-                # Try direct numeric parsing with default to minutes
-                try:
-                    minutes = int(duration_str)
-                    total_seconds = minutes * 60
-                    end_time = datetime.now(timezone.utc) + timedelta(minutes=minutes)
-                except:
-                    pass
-
-            if not end_time:
+            total_seconds = parse_duration(self.duration.value)
+            if total_seconds is None:
                 await interaction.response.send_message("Invalid duration format! Use formats like: 10 minutes, 2 hours, 1 day, 30s, 30m, 2h, 1d", ephemeral=True)
                 return
+            ends_at = int(time.time()) + total_seconds
 
             # Check minimum time limit (5 seconds)
             if total_seconds < 5:
@@ -205,21 +308,22 @@ class GiveawayModal(discord.ui.Modal, title='Create Giveaway'):
                 await interaction.response.send_message("Invalid number of winners!", ephemeral=True)
                 return
 
-            # Create embed - RED COLOR for giveaway embeds
-            embed = discord.Embed(
-                title=f"{self.prize.value}",
-                color=0xFF0000  # RED color matching your screenshots
-            )
-
-            # Format fields to exactly match the image with live countdown
-            embed.add_field(name="Hosted by:", value=interaction.user.mention, inline=False)
-            embed.add_field(name="Entries:", value="0", inline=True)
-            embed.add_field(name="Winners:", value=str(num_winners), inline=True)
-            embed.add_field(name="Time:", value=f"<t:{int(end_time.timestamp())}:R>", inline=True)
+            # Parse entry requirements
+            try:
+                requirements = parse_requirements(self.requirements.value, interaction.guild)
+            except ValueError as e:
+                await interaction.response.send_message(str(e), ephemeral=True)
+                return
 
-            # Add description if provided
-            if self.description.value and self.description.value.strip():
-                embed.description = self.description.value.strip()
+            embed = build_giveaway_embed(
+                prize=self.prize.value,
+                host_mention=interaction.user.mention,
+                winners=num_winners,
+                ends_at=ends_at,
+                description=self.description.value,
+                bonus_text=describe_bonus_entries(self.bonus_role, self.bonus_role_entries, self.entries_per_invite),
+                requirements_text=describe_requirements(requirements)
+            )
 
             # Create Enter Giveaway button view
             view = EnterGiveawayView()
@@ -238,7 +342,11 @@ class GiveawayModal(discord.ui.Modal, title='Create Giveaway'):
                 message_id=message.id,
                 channel_id=interaction.channel.id,
                 winners=num_winners,
-                end_time=end_time.isoformat()
+                ends_at=ends_at,
+                bonus_role_id=self.bonus_role.id if self.bonus_role and self.bonus_role_entries else None,
+                bonus_role_entries=self.bonus_role_entries if self.bonus_role else 0,
+                entries_per_invite=self.entries_per_invite,
+                **requirements
             )
 
             # Ping the host with notification
@@ -251,6 +359,24 @@ class GiveawayModal(discord.ui.Modal, title='Create Giveaway'):
             except:
                 await interaction.followup.send("An error occurred while creating the giveaway!", ephemeral=True)
 
+def describe_bonus_entries(bonus_role, bonus_role_entries, entries_per_invite):
+    parts = []
+    if bonus_role and bonus_role_entries:
+        parts.append(f"{bonus_role.mention}: +{bonus_role_entries}")
+    if entries_per_invite:
+        parts.append(f"+{entries_per_invite:g} per net invite")
+    return " • ".join(parts)
+
+async def giveaway_entry_weight(giveaway, member):
+    """Entries a member gets in a giveaway: 1 plus any bonus entries, capped"""
+    bonus = 0
+    if giveaway.bonus_role_id and any(role.id == giveaway.bonus_role_id for role in member.roles):
+        bonus += giveaway.bonus_role_entries
+    if giveaway.entries_per_invite:
+        net = await invite_snapshot.net_invites(member.guild.id, member.id)
+        bonus += max(net, 0) * giveaway.entries_per_invite
+    return 1 + min(bonus, MAX_BONUS_ENTRIES)
+
 # --- Enter Giveaway Button View ---
 class EnterGiveawayView(discord.ui.View):
     def __init__(self):
@@ -258,6 +384,8 @@ class EnterGiveawayView(discord.ui.View):
 
     @discord.ui.button(label='🎉 Enter Giveaway', style=discord.ButtonStyle.primary, custom_id='enter_giveaway')
     async def enter_giveaway(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if trace_recorder:
+            trace_recorder.giveaway_click(interaction)
         try:
             # Get giveaway from database
             giveaway = await db.get_giveaway_by_message(interaction.message.id)
@@ -265,8 +393,8 @@ class EnterGiveawayView(discord.ui.View):
                 await interaction.response.send_message("This giveaway is no longer valid.", ephemeral=True)
                 return
 
-            # Check if giveaway is still active
-            if giveaway['status'] == 'ended':
+            # Check if giveaway is still active (an overdue one may not be finalised yet)
+            if giveaway.status != 'active' or giveaway.ends_at <= time.time():
                 embed = discord.Embed(
                     description=f"{EMOJIS['warning']} This giveaway has already ended.",
                     color=0x2F3136
@@ -275,11 +403,11 @@ class EnterGiveawayView(discord.ui.View):
                 return
 
             # Check if user is already entered
-            is_entered = await db.check_giveaway_entry(giveaway['id'], interaction.user.id)
+            is_entered = await db.check_giveaway_entry(giveaway.id, interaction.user.id)
             
             if is_entered:
                 # User wants to leave the giveaway
-                await db.leave_giveaway(giveaway['id'], interaction.user.id)
+                await db.leave_giveaway(giveaway.id, interaction.user.id)
                 
                 embed = discord.Embed(
                     description=f"{EMOJIS['cross']} You have left the giveaway.",
@@ -288,7 +416,7 @@ class EnterGiveawayView(discord.ui.View):
                 await interaction.response.send_message(embed=embed, ephemeral=True)
                 
                 # Update entry count in embed
-                entries_count = await db.get_giveaway_entries_count(giveaway['id'])
+                entries_count = await db.get_giveaway_entries_count(giveaway.id)
                 
                 # Update the original message embed
                 original_embed = interaction.message.embeds[0]
@@ -300,7 +428,17 @@ class EnterGiveawayView(discord.ui.View):
                 await interaction.message.edit(embed=original_embed, view=self)
             else:
                 # User wants to enter the giveaway
-                success = await db.enter_giveaway(giveaway['id'], interaction.user.id)
+                rejection = await requirement_checker.check(giveaway, interaction.user)
+                if rejection:
+                    embed = discord.Embed(
+                        description=f"{EMOJIS['cross']} {rejection}",
+                        color=COLORS['red']
+                    )
+                    await interaction.response.send_message(embed=embed, ephemeral=True)
+                    return
+
+                weight = await giveaway_entry_weight(giveaway, interaction.user)
+                success = await db.enter_giveaway(giveaway.id, interaction.user.id, weight)
                 
                 if success:
                     embed = discord.Embed(
@@ -310,7 +448,7 @@ class EnterGiveawayView(discord.ui.View):
                     await interaction.response.send_message(embed=embed, ephemeral=True)
                     
                     # Update entry count in embed
-                    entries_count = await db.get_giveaway_entries_count(giveaway['id'])
+                    entries_count = await db.get_giveaway_entries_count(giveaway.id)
                     
                     # Update the original message embed
                     original_embed = interaction.message.embeds[0]
@@ -327,22 +465,158 @@ class EnterGiveawayView(discord.ui.View):
             print(f"Enter giveaway error: {e}")
             await interaction.response.send_message("An error occurred while processing your request.", ephemeral=True)
 
+# --- Giveaway List Pagination View ---
+GLIST_PAGE_SIZE = 10  # Keeps the embed within Discord's field limits
+
+class GiveawayListView(discord.ui.View):
+    """Prev/Next pages for /glist; each page is fetched when it is shown"""
+
+    def __init__(self, guild_id, author_id):
+        super().__init__(timeout=180)
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.page = 0
+        # Keyset cursor each visited page starts after; page 0 starts at the top
+        self.cursors = [None]
+        self.has_next = False
+
+    async def load_page(self, page):
+        # Fetch one extra row to know whether a next page exists
+        giveaways = await db.get_active_giveaways_page(self.guild_id, GLIST_PAGE_SIZE + 1, self.cursors[page])
+        self.has_next = len(giveaways) > GLIST_PAGE_SIZE
+        giveaways = giveaways[:GLIST_PAGE_SIZE]
+        self.page = page
+        if self.has_next and len(self.cursors) == page + 1:
+            last = giveaways[-1]
+            self.cursors.append((last.created_at, last.id))
+
+        self.previous_page.disabled = page == 0
+        self.next_page.disabled = not self.has_next
+
+        embed = discord.Embed(
+            title="🎉 Active Giveaways",
+            color=COLORS['blue']
+        )
+        if not giveaways:
+            embed.description = "No active giveaways found."
+            return embed
+
+        for giveaway in giveaways:
+            try:
+                host = bot.get_user(giveaway.host_id)
+                host_name = host.name if host else f"User {giveaway.host_id}"
+
+                value = f"**Host:** {host_name}\n**Entries:** {giveaway.entry_count}\n**Winners:** {giveaway.winners}\n**Ends:** <t:{giveaway.ends_at}:R>"
+                rejections = requirement_checker.rejections.get(giveaway.id)
+                if rejections:
+                    value += "\n**Rejected:** " + ", ".join(f"{rule} {count}" for rule, count in rejections.most_common())
+
+                embed.add_field(
+                    name=f"🎁 {giveaway.prize}",
+                    value=value,
+                    inline=True
+                )
+            except Exception as e:
+                print(f"Error processing giveaway {giveaway.id}: {e}")
+
+        if page or self.has_next:
+            embed.set_footer(text=f"Page {page + 1}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran /glist can change pages.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label='◀ Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load_page(self.page - 1)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label='Next ▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load_page(self.page + 1)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+CLAIMHISTORY_PAGE_SIZE = 10
+
+class ClaimHistoryView(discord.ui.View):
+    """Prev/Next pages for /claimhistory, keyset-paginated like GiveawayListView"""
+
+    def __init__(self, guild_id, target, author_id):
+        super().__init__(timeout=180)
+        self.guild_id = guild_id
+        self.target = target
+        self.author_id = author_id
+        self.page = 0
+        self.cursors = [None]
+        self.has_next = False
+
+    async def load_page(self, page):
+        entries = await db.get_claim_history_page(self.guild_id, self.target.id, CLAIMHISTORY_PAGE_SIZE + 1, self.cursors[page])
+        self.has_next = len(entries) > CLAIMHISTORY_PAGE_SIZE
+        entries = entries[:CLAIMHISTORY_PAGE_SIZE]
+        self.page = page
+        if self.has_next and len(self.cursors) == page + 1:
+            last = entries[-1]
+            self.cursors.append((last.created_at, last.id))
+
+        self.previous_page.disabled = page == 0
+        self.next_page.disabled = not self.has_next
+
+        embed = discord.Embed(
+            title=f"📊 Claim History for {self.target.display_name}",
+            color=0x5865F2
+        )
+        if not entries:
+            embed.description = "No claims recorded."
+            return embed
+
+        lines = []
+        for entry in entries:
+            actor = f" by <@{entry.actor_id}>" if entry.actor_id else ""
+            reason = f" — {entry.reason}" if entry.reason else ""
+            lines.append(f"<t:{entry.created_at}:d> **{entry.amount:+d}**{actor}{reason} (balance {entry.balance_after})")
+        embed.description = "\n".join(lines)
+        if page or self.has_next:
+            embed.set_footer(text=f"Page {page + 1}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran /claimhistory can change pages.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label='◀ Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load_page(self.page - 1)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label='Next ▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load_page(self.page + 1)
+        await interaction.response.edit_message(embed=embed, view=self)
+
 # --- BOT EVENTS ---
 @bot.event
 async def on_ready():
     """Bot startup event"""
+    global startup_complete
     print(f"{bot.user.name}#{bot.user.discriminator} has connected to Discord!")
     print(f"Bot is in {len(bot.guilds)} guilds")
-    
-    # Initialize database
-    await db.create_tables()
-    
-    # Sync slash commands
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
+
+    if startup_complete:
+        # Reconnect: only pick up guilds we have no invite cache for yet
+        for guild in bot.guilds:
+            if guild.id not in invite_cache:
+                await cache_invites(guild)
+        return
+
+    # Sync slash commands (commands are global, so one cluster worker is enough)
+    if CLUSTER_ID == 0:
+        await sync_command_tree()
     
     # Cache invites for all guilds and verify settings
     for guild in bot.guilds:
@@ -352,22 +626,35 @@ async def on_ready():
         # Verify guild settings are loaded
         settings = await db.get_guild_settings(guild.id)
         if settings:
-            if settings.get('welcome_channel_id'):
-                channel = guild.get_channel(settings['welcome_channel_id'])
+            if settings.welcome_channel_id:
+                channel = guild.get_channel(settings.welcome_channel_id)
                 print(f"✅ Welcome channel loaded: #{channel.name if channel else 'DELETED'}")
-            if settings.get('mod_log_channel_id'):
-                channel = guild.get_channel(settings['mod_log_channel_id'])
+            if settings.mod_log_channel_id:
+                channel = guild.get_channel(settings.mod_log_channel_id)
                 print(f"✅ Mod log channel loaded: #{channel.name if channel else 'DELETED'}")
-            if settings.get('staff_log_channel_id'):
-                channel = guild.get_channel(settings['staff_log_channel_id'])
+            if settings.staff_log_channel_id:
+                channel = guild.get_channel(settings.staff_log_channel_id)
                 print(f"✅ Staff log channel loaded: #{channel.name if channel else 'DELETED'}")
         else:
             print(f"⚠️ No settings found for {guild.name}")
     
+    # End giveaways that expired while the bot was offline before polling takes over
+    await recover_giveaways()
+
+    # The shard count is only known once connected
+    giveaway_scheduler.shard_count, giveaway_scheduler.shard_ids = bot.shard_count, SHARD_IDS
+    giveaway_scheduler.start()
+
     # Start the giveaway check loop
     if not check_giveaways.is_running():
         check_giveaways.start()
 
+    # The database is shared, so one cluster worker reconciles for everyone
+    if CLUSTER_ID == 0 and not reconcile_invites.is_running():
+        reconcile_invites.start()
+
+    startup_complete = True
+
 @bot.event
 async def on_guild_join(guild):
     """Cache invites when bot joins a new guild"""
@@ -376,6 +663,8 @@ async def on_guild_join(guild):
 @bot.event
 async def on_invite_create(invite):
     """Update cache when new invite is created"""
+    if trace_recorder:
+        trace_recorder.invite_create(invite)
     if invite.guild.id in invite_cache:
         invite_cache[invite.guild.id][invite.code] = 0
     await db.upsert_invite_code(invite.code, invite.guild.id, invite.inviter.id if invite.inviter else None, 0, invite.max_uses)
@@ -383,6 +672,8 @@ async def on_invite_create(invite):
 @bot.event
 async def on_invite_delete(invite):
     """Update cache when invite is deleted"""
+    if trace_recorder:
+        trace_recorder.invite_delete(invite)
     if invite.guild.id in invite_cache and invite.code in invite_cache[invite.guild.id]:
         del invite_cache[invite.guild.id][invite.code]
 
@@ -437,8 +728,8 @@ async def on_member_join(member):
         
         # Send welcome message if channel is set
         settings = await db.get_guild_settings(guild.id)
-        if settings and settings.get('welcome_channel_id'):
-            welcome_channel = guild.get_channel(settings['welcome_channel_id'])
+        if settings and settings.welcome_channel_id:
+            welcome_channel = guild.get_channel(settings.welcome_channel_id)
             if welcome_channel:
                 # Create welcome embed - EXACT format from your screenshots
                 inviter_text = "Unknown"
@@ -475,6 +766,8 @@ async def on_member_join(member):
 @bot.event
 async def on_member_remove(member):
     """Track when members leave"""
+    if trace_recorder:
+        trace_recorder.member_remove(member)
     try:
         guild = member.guild
         await db.handle_member_leave(guild.id, member.id)
@@ -482,8 +775,8 @@ async def on_member_remove(member):
         
         # Send mod log for member leave
         settings = await db.get_guild_settings(guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Member Left",
@@ -528,6 +821,7 @@ async def on_member_join(member):
         invite_cache[guild.id] = current_uses
         
         # Track the invite in database
+        inviter_id = None
         if used_invite:
             invite_info = await db.get_invite_info(used_invite, guild.id)
             if invite_info and invite_info['inviter_id']:
@@ -544,11 +838,14 @@ async def on_member_join(member):
                     await db.add_fake_invite(inviter_id, guild.id, member.id)
                 else:
                     await db.add_invite(inviter_id, guild.id, member.id)
+
+        if trace_recorder:
+            trace_recorder.member_join(member, used_invite, inviter_id)
         
         # Send mod log for member join - EXACT format from screenshot
         settings = await db.get_guild_settings(guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 print(f"✅ Mod log channel found: {mod_log_channel.name}")
                 account_age = datetime.now(timezone.utc) - member.created_at
@@ -562,8 +859,8 @@ async def on_member_join(member):
                 await mod_log_channel.send(embed=embed)
         
         # Send welcome message if channel is set
-        if settings and settings.get('welcome_channel_id'):
-            welcome_channel = guild.get_channel(settings['welcome_channel_id'])
+        if settings and settings.welcome_channel_id:
+            welcome_channel = guild.get_channel(settings.welcome_channel_id)
             if welcome_channel:
                 print(f"✅ Welcome channel found: {welcome_channel.name}")
                 # Create welcome embed - EXACT format from your screenshots
@@ -601,13 +898,16 @@ async def on_member_join(member):
 @bot.event
 async def on_message_delete(message):
     """Track message deletions - EXACT format from screenshots"""
+    # DMs have no guild to record against
+    if trace_recorder and message.guild:
+        trace_recorder.message_delete(message)
     try:
         if message.author.bot:
             return
         
         settings = await db.get_guild_settings(message.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = bot.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = bot.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 # EXACT format from screenshot
                 embed = discord.Embed(
@@ -623,13 +923,15 @@ async def on_message_delete(message):
 @bot.event
 async def on_message_edit(before, after):
     """Track message edits - EXACT format from screenshots"""
+    if trace_recorder and before.guild:
+        trace_recorder.message_edit(before, after)
     try:
         if before.author.bot or before.content == after.content:
             return
             
         settings = await db.get_guild_settings(before.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = bot.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = bot.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 # EXACT format from screenshot
                 embed = discord.Embed(
@@ -648,8 +950,8 @@ async def on_member_update(before, after):
     try:
         if before.roles != after.roles:
             settings = await db.get_guild_settings(after.guild.id)
-            if settings and settings.get('mod_log_channel_id'):
-                mod_log_channel = after.guild.get_channel(settings['mod_log_channel_id'])
+            if settings and settings.mod_log_channel_id:
+                mod_log_channel = after.guild.get_channel(settings.mod_log_channel_id)
                 if mod_log_channel:
                     # Find role changes
                     added_roles = [role for role in after.roles if role not in before.roles]
@@ -682,8 +984,8 @@ async def on_guild_channel_delete(channel):
     """Track channel deletions - EXACT format from screenshots"""
     try:
         settings = await db.get_guild_settings(channel.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = channel.guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = channel.guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Channel Deleted",
@@ -699,8 +1001,8 @@ async def on_guild_channel_create(channel):
     """Track channel creation"""
     try:
         settings = await db.get_guild_settings(channel.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = channel.guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = channel.guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Channel Created",
@@ -716,8 +1018,8 @@ async def on_guild_channel_update(before, after):
     """Track channel updates"""
     try:
         settings = await db.get_guild_settings(after.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = after.guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = after.guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 changes = []
                 if before.name != after.name:
@@ -738,8 +1040,8 @@ async def on_guild_role_create(role):
     """Track role creation"""
     try:
         settings = await db.get_guild_settings(role.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = role.guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = role.guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Role Created",
@@ -755,8 +1057,8 @@ async def on_guild_role_delete(role):
     """Track role deletion"""
     try:
         settings = await db.get_guild_settings(role.guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = role.guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = role.guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Role Deleted",
@@ -772,8 +1074,8 @@ async def on_member_ban(guild, user):
     """Track member bans"""
     try:
         settings = await db.get_guild_settings(guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Member Banned",
@@ -790,8 +1092,8 @@ async def on_member_unban(guild, user):
     """Track member unbans"""
     try:
         settings = await db.get_guild_settings(guild.id)
-        if settings and settings.get('mod_log_channel_id'):
-            mod_log_channel = guild.get_channel(settings['mod_log_channel_id'])
+        if settings and settings.mod_log_channel_id:
+            mod_log_channel = guild.get_channel(settings.mod_log_channel_id)
             if mod_log_channel:
                 embed = discord.Embed(
                     title="Member Unbanned",
@@ -803,104 +1105,92 @@ async def on_member_unban(guild, user):
     except Exception as e:
         print(f"Error in on_member_unban: {e}")
 
+async def recover_giveaways():
+    """Finalise everything that became due during downtime in one batch"""
+    unfinished = await db.get_unfinished_giveaways(bot.shard_count, SHARD_IDS)
+    now = time.time()
+    overdue = [g for g in unfinished if g.status == 'active' and g.ends_at <= now]
+    ending = [g for g in unfinished if g.status == 'ending']
+    print(f"Loaded {len(unfinished)} unfinished giveaways: {len(overdue)} overdue, {len(ending)} interrupted")
+
+    # Bounded so a long outage doesn't burst past Discord's rate limits
+    semaphore = asyncio.Semaphore(RECOVERY_CONCURRENCY)
+
+    async def run(step, giveaway):
+        async with semaphore:
+            try:
+                await step(giveaway)
+            except Exception as e:
+                print(f"Error recovering giveaway {giveaway.id}: {e}")
+
+    await asyncio.gather(*[run(giveaway_finalizer.finalize, g) for g in overdue],
+                         *[run(giveaway_finalizer.resume, g) for g in ending])
+
+async def launch_scheduled_giveaway(schedule):
+    """Post a giveaway from a stored schedule, like /gcreate would"""
+    channel = bot.get_channel(schedule.channel_id)
+    if not channel:
+        print(f"Scheduled giveaway {schedule.id}: channel {schedule.channel_id} not found")
+        return
+
+    ends_at = int(time.time()) + schedule.duration_seconds
+    embed = build_giveaway_embed(
+        prize=schedule.prize,
+        host_mention=f"<@{schedule.host_id}>",
+        winners=schedule.winners,
+        ends_at=ends_at,
+        description=schedule.description
+    )
+    message = await channel.send(embed=embed, view=EnterGiveawayView())
+    await db.create_giveaway(
+        guild_id=schedule.guild_id,
+        host_id=schedule.host_id,
+        prize=schedule.prize,
+        message_id=message.id,
+        channel_id=channel.id,
+        winners=schedule.winners,
+        ends_at=ends_at
+    )
+    print(f"Launched scheduled giveaway {schedule.id}: {schedule.prize}")
+
+giveaway_scheduler = GiveawayScheduler(db, launch_scheduled_giveaway)
+
 # Task to check for ended giveaways
 @tasks.loop(seconds=5)
 async def check_giveaways():
     """Check for ended giveaways and process them"""
     try:
-        ended_giveaways = await db.get_ended_giveaways()
+        # Each cluster worker only ends giveaways in the guilds its shards own
+        ended_giveaways = await db.get_ended_giveaways(bot.shard_count, SHARD_IDS)
         for giveaway in ended_giveaways:
             try:
-                # Get guild and channel
-                guild = bot.get_guild(giveaway['guild_id'])
-                if not guild:
-                    continue
-                    
-                channel = guild.get_channel(giveaway['channel_id'])
-                if not channel:
-                    continue
-
-                # Get entries
-                entries = await db.get_giveaway_entries(giveaway['id'])
-                
-                # Get original message
-                try:
-                    original_message = await channel.fetch_message(giveaway['message_id'])
-                except:
-                    original_message = None
-
-                if not entries:
-                    # No entries
-                    embed = discord.Embed(
-                        title="🎉 Congratulations!",
-                        description=f"**Prize:** {giveaway['prize']}\n\nNo one entered this giveaway.",
-                        color=0xFF0000
-                    )
-                else:
-                    # Select winners
-                    num_winners = min(giveaway['winners'], len(entries))
-                    winners = random.sample(entries, num_winners)
-                    
-                    winner_mentions = []
-                    for winner_data in winners:
-                        user = guild.get_member(winner_data['user_id'])
-                        if user:
-                            winner_mentions.append(user.mention)
-                    
-                    # Send winner pings first
-                    if winner_mentions:
-                        winner_pings = " ".join(winner_mentions)
-                        await channel.send(f"🎉 {winner_pings}")
-                    
-                    # Create winner embed
-                    embed = discord.Embed(
-                        title="🎉 Congratulations!",
-                        color=0xFF0000
-                    )
-                    
-                    description = f"**Prize:** {giveaway['prize']}\n"
-                    if winner_mentions:
-                        description += f"**Winner(s):** {', '.join(winner_mentions)}\n"
-                    
-                    host = guild.get_member(giveaway['host_id'])
-                    if host:
-                        description += f"**Hosted by:** {host.mention}\n\n"
-                    
-                    description += "────────────────────────\n\n"
-                    description += f"- Open a ticket in <#{TICKET_CHANNEL_ID}>\n"
-                    description += "- Please take a screenshot of this message and send it in your claim ticket!"
-                    
-                    embed.description = description
-
-                # Send results
-                await channel.send(embed=embed)
-
-                # Update original message
-                if original_message:
-                    try:
-                        original_embed = original_message.embeds[0]
-                        original_embed.title = f"🎉 {giveaway['prize']} (ENDED)"
-                        original_embed.color = 0x808080  # Gray for ended
-                        
-                        # Update time field
-                        for i, field in enumerate(original_embed.fields):
-                            if field.name == "Time:":
-                                original_embed.set_field_at(i, name="Time:", value="Ended", inline=True)
-                                break
-                        
-                        await original_message.edit(embed=original_embed, view=None)
-                    except:
-                        pass
-
-                # Mark as ended
-                await db.end_giveaway(giveaway['id'])
+                await giveaway_finalizer.finalize(giveaway)
+            except Exception as e:
+                print(f"Error processing giveaway {giveaway.id}: {e}")
 
+        # Pick up giveaways whose finaliser crashed part way through
+        for giveaway in await db.get_ending_giveaways(bot.shard_count, SHARD_IDS):
+            try:
+                await giveaway_finalizer.resume(giveaway)
             except Exception as e:
-                print(f"Error processing giveaway {giveaway['id']}: {e}")
-                
+                print(f"Error resuming giveaway {giveaway.id}: {e}")
+
     except Exception as e:
         print(f"Error in check_giveaways: {e}")
 
+# Task to rebuild invite counters from the recorded relationships
+@tasks.loop(minutes=15)
+async def reconcile_invites():
+    """Correct drift in user_invites counters, only looking at inviters changed since the last run"""
+    try:
+        checked, corrections = await db.reconcile_invite_counters()
+        for guild_id, user_id, old, new in corrections[:20]:
+            print(f"Reconciled invites for {user_id} in {guild_id}: (total, left, fake) {old} -> {new}")
+        if corrections:
+            print(f"Invite reconciliation: {len(corrections)} of {checked} inviters corrected")
+    except Exception as e:
+        print(f"Error in reconcile_invites: {e}")
+
 # --- SLASH COMMANDS ---
 
 @bot.tree.command(name="ping", description="Select a role to ping for giveaways")
@@ -930,10 +1220,10 @@ async def invites(interaction: discord.Interaction, user: discord.Member = None)
     )
 
     # Format EXACTLY like your screenshot using description instead of fields
-    description = f"**Joined:** {invites_data['total']}\n"
-    description += f"**Left:** {invites_data['left']}\n"
-    description += f"**Fake Invites (accounts < 7 days):** {invites_data['fake']}\n"
-    description += f"**Net Invites:** {invites_data['net']}"
+    description = f"**Joined:** {invites_data.total}\n"
+    description += f"**Left:** {invites_data.left}\n"
+    description += f"**Fake Invites (accounts < 7 days):** {invites_data.fake}\n"
+    description += f"**Net Invites:** {invites_data.net}"
 
     embed.description = description
     
@@ -970,17 +1260,181 @@ async def leaderboard(interaction: discord.Interaction, limit: int = 10):
     
     description = ""
     for i, entry in enumerate(leaderboard_data, 1):
-        user = interaction.guild.get_member(entry['user_id'])
-        username = user.mention if user else f"<@{entry['user_id']}>"
+        user = interaction.guild.get_member(entry.user_id)
+        username = user.mention if user else f"<@{entry.user_id}>"
         
-        description += f"**{i}.** {username} → **{entry['net']}** (joined: {entry['total']}, left: {entry['left']})\n"
+        description += f"**{i}.** {username} → **{entry.net}** (joined: {entry.total}, left: {entry.left})\n"
     
     embed.description = description
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="invitestats", description="Show invite activity over a recent period")
+@app_commands.describe(
+    period="How far back to look, e.g. 24h or 7d (default: 7d)",
+    user="Only show activity for people this user invited (optional)"
+)
+async def invitestats(interaction: discord.Interaction, period: str = "7d", user: discord.Member = None):
+    if not await check_command_permission(interaction, 'invitestats'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    seconds = parse_duration(period)
+    if not seconds or seconds > 365 * 86400:
+        await interaction.response.send_message("Invalid period. Use something like 24h or 7d (up to 365d).", ephemeral=True)
+        return
+
+    # Answered from the rollups, so ranges are rounded to whole buckets
+    until = int(time.time())
+    since = until - seconds
+    activity = await db.get_invite_activity(interaction.guild.id, since, until, user.id if user else None)
+
+    joins = sum(bucket.joins for bucket in activity)
+    fakes = sum(bucket.fakes for bucket in activity)
+    leaves = sum(bucket.leaves for bucket in activity)
+
+    embed = discord.Embed(
+        title=f"{EMOJIS['chart']} Invite Stats" + (f" for {user.display_name}" if user else ""),
+        description=f"Since <t:{since - since % ROLLUP_BUCKET_SECONDS}:f>\n\n"
+                    f"**Joined:** {joins}\n**Fake:** {fakes}\n**Left:** {leaves}\n**Net:** {joins - fakes - leaves}",
+        color=COLORS['blue']
+    )
+
+    if not user:
+        top = await db.get_top_inviters_between(interaction.guild.id, since, until, 10)
+        lines = [f"**{i}.** <@{entry.user_id}> → **{entry.net}** (joined: {entry.joins}, left: {entry.leaves})"
+                 for i, entry in enumerate(top, 1)]
+        embed.add_field(name="Top Inviters", value="\n".join(lines) or "No invites in this period.", inline=False)
+
+    busiest = sorted((bucket for bucket in activity if bucket.joins), key=lambda bucket: bucket.joins, reverse=True)[:3]
+    if busiest:
+        embed.add_field(
+            name="Busiest Hours",
+            value="\n".join(f"<t:{bucket.bucket}:f> → {bucket.joins} joins" for bucket in busiest),
+            inline=False
+        )
+
+    await interaction.response.send_message(embed=embed)
+
+# Most tree nodes fetched for /invitetree; only the first lines fit in the embed anyway
+INVITE_TREE_LIMIT = 200
+
+@bot.tree.command(name="invitetree", description="Show everyone a user's invites led to")
+@app_commands.describe(
+    user="Whose referral tree to show (optional)",
+    depth="How many invite levels to list (1-5, default: 3)"
+)
+async def invitetree(interaction: discord.Interaction, user: discord.Member = None, depth: int = 3):
+    if not await check_command_permission(interaction, 'invitetree'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    if depth < 1 or depth > 5:
+        await interaction.response.send_message("Depth must be between 1 and 5.", ephemeral=True)
+        return
+
+    target = user or interaction.user
+    stats = await db.get_downstream_stats(interaction.guild.id, target.id)
+    nodes = await db.get_invite_tree(interaction.guild.id, target.id, depth, INVITE_TREE_LIMIT)
+
+    embed = discord.Embed(
+        title=f"{EMOJIS['chart']} Invite Tree for {target.display_name}",
+        description=f"**Downstream Members:** {stats.members}\n"
+                    f"**Invited Directly:** {stats.direct}\n"
+                    f"**Deepest Level:** {stats.depth}\n"
+                    f"**All Time (incl. left):** {stats.all_time}",
+        color=COLORS['blue']
+    )
+
+    # Nodes come shallowest first; lay them out depth-first under their parents
+    children = {}
+    for node in nodes:
+        children.setdefault(node.parent_id, []).append(node)
+    lines = []
+    def walk(parent_id):
+        for node in children.get(parent_id, []):
+            name = f"<@{node.user_id}>" if node.active else f"~~<@{node.user_id}>~~"
+            suffix = f" ({node.downstream} below)" if node.downstream else ""
+            # Em spaces, since Discord collapses runs of ordinary spaces
+            indent = "\u2003" * (node.depth - 1)
+            lines.append(f"{indent}└ {name}{suffix}")
+            walk(node.user_id)
+    walk(target.id)
+
+    shown = []
+    length = 0
+    for line in lines:
+        if len(shown) == 25 or length + len(line) > 1000:
+            break
+        shown.append(line)
+        length += len(line) + 1
+    if len(shown) < len(lines) or len(nodes) == INVITE_TREE_LIMIT:
+        shown.append("...")
+    embed.add_field(name="Tree", value="\n".join(shown) or "No invites recorded yet.", inline=False)
+    embed.set_thumbnail(url=target.display_avatar.url)
+
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="retention", description="Show which inviters bring members who stay (Admin only)")
+@app_commands.describe(export="Attach every inviter's figures as a CSV file")
+async def retention(interaction: discord.Interaction, export: bool = False):
+    if not await check_command_permission(interaction, 'retention'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    if not retention_analyzer.available:
+        await interaction.response.send_message("Retention analytics need NumPy installed on the bot host.", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+
+    try:
+        report = await retention_analyzer.report(interaction.guild.id)
+    except Exception as e:
+        print(f"Error computing retention: {e}")
+        embed = discord.Embed(
+            title=f"{EMOJIS['cross']} Retention Failed",
+            description="An error occurred while analysing invite history.",
+            color=COLORS['red']
+        )
+        await interaction.followup.send(embed=embed)
+        return
+
+    embed = discord.Embed(
+        title=f"{EMOJIS['chart']} Invite Retention",
+        description=f"Based on {report.members} tracked joins from {len(report.inviters)} inviters.",
+        color=COLORS['blue']
+    )
+
+    checkpoints = " / ".join(f"{days}d" for days in RETENTION_DAYS)
+    def format_line(i, inviter):
+        curve = " / ".join("-" if value is None else f"{value:.0%}" for value in inviter.retention)
+        return f"**{i}.** <@{inviter.user_id}> → {curve} (joined: {inviter.joins}, fake: {inviter.fake_ratio:.0%})"
+
+    ranked = report.ranked(days=30)
+    embed.add_field(
+        name=f"Best 30-day Retention ({checkpoints})",
+        value="\n".join(format_line(i, inviter) for i, inviter in enumerate(ranked[:10], 1)) or "Not enough history yet.",
+        inline=False
+    )
+    suspicious = sorted((inviter for inviter in report.inviters if inviter.joins >= 5 and inviter.fakes),
+                        key=lambda inviter: inviter.fake_ratio, reverse=True)[:5]
+    if suspicious:
+        embed.add_field(
+            name="Highest Fake Ratios",
+            value="\n".join(f"<@{inviter.user_id}> → {inviter.fake_ratio:.0%} of {inviter.joins}" for inviter in suspicious),
+            inline=False
+        )
+    embed.set_footer(text=f"Computed {datetime.fromtimestamp(report.generated_at, timezone.utc):%Y-%m-%d %H:%M} UTC")
+
+    if export:
+        csv_file = discord.File(io.BytesIO(report.to_csv().encode()), filename=f"retention-{interaction.guild.id}.csv")
+        await interaction.followup.send(embed=embed, file=csv_file)
+    else:
+        await interaction.followup.send(embed=embed)
+
 @bot.tree.command(name="addclaims", description="Add claims to a user (Staff only)")
-@app_commands.describe(user="The user to add claims to", amount="Number of claims to add")
-async def addclaims(interaction: discord.Interaction, user: discord.Member, amount: int):
+@app_commands.describe(user="The user to add claims to", amount="Number of claims to add", reason="Why the claims were granted (optional)")
+async def addclaims(interaction: discord.Interaction, user: discord.Member, amount: int, reason: str = None):
     if not await check_command_permission(interaction, 'addclaims'):
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
         return
@@ -989,19 +1443,96 @@ async def addclaims(interaction: discord.Interaction, user: discord.Member, amou
         await interaction.response.send_message("Amount must be positive.", ephemeral=True)
         return
     
-    await db.add_claims(user.id, interaction.guild.id, amount)
+    balance = await db.add_claims(user.id, interaction.guild.id, amount, interaction.user.id, reason)
     
     embed = discord.Embed(
         title=f"{EMOJIS['check']} Claims Added",
-        description=f"Added {amount} claims to {user.mention}",
+        description=f"Added {amount} claims to {user.mention} (now {balance})",
         color=COLORS['green']
     )
     
     await interaction.response.send_message(embed=embed)
 
+# Most users /bulkclaims will credit in one go
+BULK_CLAIMS_LIMIT = 10000
+
+@bot.tree.command(name="bulkclaims", description="Add claims to many users at once (Staff only)")
+@app_commands.describe(
+    amount="Number of claims each user gets",
+    role="Everyone with this role",
+    message_id="The message ID of a giveaway whose latest winners get claims",
+    all_draws="Also include winners of that giveaway who were rerolled (default: no)",
+    users="Pasted mentions or user IDs",
+    reason="Why the claims were granted (optional)"
+)
+async def bulkclaims(interaction: discord.Interaction, amount: int, role: discord.Role = None, message_id: str = None,
+                     all_draws: bool = False, users: str = None, reason: str = None):
+    if not await check_command_permission(interaction, 'bulkclaims'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    if amount <= 0:
+        await interaction.response.send_message("Amount must be positive.", ephemeral=True)
+        return
+
+    if role is None and message_id is None and not users:
+        await interaction.response.send_message("Choose a role, a giveaway or paste some users.", ephemeral=True)
+        return
+
+    # Users from every chosen source, once each, in the order they were found
+    user_ids = {}
+    sources = []
+    ignored = 0
+    if role is not None:
+        user_ids.update(dict.fromkeys(member.id for member in role.members if not member.bot))
+        sources.append(role.mention)
+    if message_id is not None:
+        try:
+            message_id = int(message_id)
+        except ValueError:
+            await interaction.response.send_message("Invalid message ID!", ephemeral=True)
+            return
+        giveaway = await db.get_giveaway_by_message(message_id)
+        if not giveaway or giveaway.guild_id != interaction.guild.id:
+            await interaction.response.send_message("Giveaway not found.", ephemeral=True)
+            return
+        user_ids.update(dict.fromkeys(await db.get_giveaway_winner_ids(giveaway.id, all_draws)))
+        sources.append(f"{'all winners' if all_draws else 'winners'} of **{giveaway.prize}**")
+    if users:
+        pasted_ids, ignored = parse_member_ids(users, interaction.guild)
+        user_ids.update(pasted_ids)
+        sources.append("pasted list")
+
+    if not user_ids:
+        await interaction.response.send_message("No users found to add claims to.", ephemeral=True)
+        return
+
+    if len(user_ids) > BULK_CLAIMS_LIMIT:
+        await interaction.response.send_message(f"That is {len(user_ids)} users; the limit is {BULK_CLAIMS_LIMIT} at once.", ephemeral=True)
+        return
+
+    credited = await db.add_claims_many(interaction.guild.id, user_ids, amount, interaction.user.id, reason)
+
+    mentions = [f"<@{user_id}>" for user_id in list(user_ids)[:20]]
+    if credited > len(mentions):
+        mentions.append(f"and {credited - len(mentions)} more")
+    embed = discord.Embed(
+        title=f"{EMOJIS['check']} Claims Added",
+        description=f"Added {amount} claims each to {credited} users ({amount * credited} total)\n"
+                    f"**From:** {', '.join(sources)}",
+        color=COLORS['green']
+    )
+    if ignored:
+        embed.add_field(name="Ignored", value=f"{ignored} pasted entries that aren't members of this server", inline=False)
+    if reason:
+        embed.add_field(name="Reason", value=reason[:1024], inline=False)
+    embed.add_field(name="Users", value=", ".join(mentions)[:1024], inline=False)
+
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="removeclaims", description="Remove claims from a user (Staff only)")
-@app_commands.describe(user="The user to remove claims from", amount="Number of claims to remove")
-async def removeclaims(interaction: discord.Interaction, user: discord.Member, amount: int):
+@app_commands.describe(user="The user to remove claims from", amount="Number of claims to remove", reason="Why the claims were redeemed (optional)")
+async def removeclaims(interaction: discord.Interaction, user: discord.Member, amount: int, reason: str = None):
     if not await check_command_permission(interaction, 'removeclaims'):
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
         return
@@ -1010,11 +1541,17 @@ async def removeclaims(interaction: discord.Interaction, user: discord.Member, a
         await interaction.response.send_message("Amount must be positive.", ephemeral=True)
         return
     
-    await db.remove_claims(user.id, interaction.guild.id, amount)
+    balance = await db.remove_claims(user.id, interaction.guild.id, amount, interaction.user.id, reason)
+    if balance is None:
+        invites_data = await db.get_user_invites(user.id, interaction.guild.id)
+        await interaction.response.send_message(
+            f"{user.mention} only has {invites_data.claimed} claims, so {amount} can't be removed.", ephemeral=True
+        )
+        return
     
     embed = discord.Embed(
         title=f"{EMOJIS['check']} Claims Removed",
-        description=f"Removed {amount} claims from {user.mention}",
+        description=f"Removed {amount} claims from {user.mention} (now {balance})",
         color=COLORS['red']
     )
     
@@ -1032,12 +1569,24 @@ async def claimcheck(interaction: discord.Interaction, user: discord.Member = No
     
     embed = discord.Embed(
         title=f"📊 Claim Check",
-        description=f"{target.mention} has claimed {invites_data['claimed']} invites.",
+        description=f"{target.mention} has claimed {invites_data.claimed} invites.",
         color=0x5865F2  # Blue color matching your screenshot
     )
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="claimhistory", description="Show who granted and redeemed a user's claims")
+@app_commands.describe(user="The user to show claim history for (optional)")
+async def claimhistory(interaction: discord.Interaction, user: discord.Member = None):
+    if not await check_command_permission(interaction, 'claimhistory'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    target = user or interaction.user
+    view = ClaimHistoryView(interaction.guild.id, target, interaction.user.id)
+    embed = await view.load_page(0)
+    await interaction.response.send_message(embed=embed, view=view)
+
 @bot.tree.command(name="syncinvites", description="Sync historical invite data (Admin only)")
 async def syncinvites(interaction: discord.Interaction):
     if not await check_command_permission(interaction, 'syncinvites'):
@@ -1047,19 +1596,20 @@ async def syncinvites(interaction: discord.Interaction):
     await interaction.response.defer()
     
     try:
-        # Get all current invites
+        # Get all current invites and total their uses per inviter
         invites = await interaction.guild.invites()
-        invite_data = {}
-        
+        inviter_uses = {}
         for invite in invites:
             if invite.inviter:
-                invite_data[invite.code] = {
-                    'inviter_id': invite.inviter.id,
-                    'uses': invite.uses
-                }
-        
+                inviter_uses[invite.inviter.id] = inviter_uses.get(invite.inviter.id, 0) + invite.uses
+
+        update_progress = progress_updater(interaction, f"{EMOJIS['chart']} Syncing Invites")
+
+        async def report_progress(done, total):
+            await update_progress(f"Processed {done}/{total} inviters...", final=done >= total)
+
         # Sync with database
-        synced_count = await db.sync_historical_invites(interaction.guild.id, invite_data)
+        synced_count = await db.sync_historical_invites(interaction.guild.id, inviter_uses, report_progress)
         
         embed = discord.Embed(
             title=f"{EMOJIS['check']} Invites Synced",
@@ -1067,7 +1617,7 @@ async def syncinvites(interaction: discord.Interaction):
             color=COLORS['green']
         )
         
-        await interaction.followup.send(embed=embed)
+        await interaction.edit_original_response(embed=embed)
         
         # Update invite cache
         await cache_invites(interaction.guild)
@@ -1081,16 +1631,124 @@ async def syncinvites(interaction: discord.Interaction):
         )
         await interaction.followup.send(embed=embed)
 
+@bot.tree.command(name="export", description="Export this server's invite and giveaway data (Admin only)")
+@app_commands.describe(
+    format="File format (default: CSV)",
+    table="Only export one table (default: all of them)"
+)
+@app_commands.choices(
+    format=[app_commands.Choice(name="CSV", value="csv"), app_commands.Choice(name="NDJSON", value="ndjson")],
+    table=[app_commands.Choice(name=table, value=table) for table in EXPORT_TABLES]
+)
+async def export(interaction: discord.Interaction, format: str = "csv", table: str = None):
+    if not await check_command_permission(interaction, 'export'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results = await export_guild(db, interaction.guild.id, format, directory, [table] if table else None)
+
+            limit = interaction.guild.filesize_limit
+            attachable = [result for result in results if result.size <= limit]
+            too_large = [result for result in results if result.size > limit]
+
+            description = "\n".join(f"**{result.table}:** {result.rows} rows" for result in results)
+            if too_large:
+                description += ("\n\nToo large to upload here: " + ", ".join(result.table for result in too_large)
+                                + ". Run `python manage.py export` on the bot host instead.")
+            embed = discord.Embed(
+                title=f"{EMOJIS['check']} Export Ready",
+                description=description,
+                color=COLORS['green']
+            )
+            files = [discord.File(result.path, filename=os.path.basename(result.path)) for result in attachable]
+            await interaction.followup.send(embed=embed, files=files, ephemeral=True)
+    except Exception as e:
+        print(f"Error exporting data: {e}")
+        embed = discord.Embed(
+            title=f"{EMOJIS['cross']} Export Failed",
+            description="An error occurred while exporting data.",
+            color=COLORS['red']
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="importinvites", description="Import invite counts from another bot's export (Admin only)")
+@app_commands.describe(
+    file="A .csv, .json or .ndjson file (optionally .gz) with user_id and invite count columns",
+    mode="Add to existing counts or replace them (default: add)"
+)
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Merge (add to existing counts)", value="merge"),
+    app_commands.Choice(name="Overwrite (replace existing counts)", value="overwrite")
+])
+async def importinvites(interaction: discord.Interaction, file: discord.Attachment, mode: str = "merge"):
+    if not await check_command_permission(interaction, 'importinvites'):
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    try:
+        fmt, gzipped = detect_format(file.filename)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+
+    await interaction.response.defer()
+
+    try:
+        data = await file.read()
+        update_progress = progress_updater(interaction, f"{EMOJIS['chart']} Importing Invites")
+
+        async def report_progress(report):
+            await update_progress(f"Imported {report.imported} rows...")
+
+        report = await import_invites(db, interaction.guild.id, io.BytesIO(data), fmt, gzipped, mode, report_progress)
+
+        description = (f"**Imported:** {report.imported} rows ({mode})\n"
+                       f"**Skipped:** {report.skipped} rows\n"
+                       f"**Speed:** {report.rate:.0f} rows/s")
+        embed = discord.Embed(
+            title=f"{EMOJIS['check']} Invites Imported",
+            description=description,
+            color=COLORS['green'] if not report.skipped else COLORS['yellow']
+        )
+        if report.errors:
+            embed.add_field(
+                name="Skipped Rows",
+                value="\n".join(f"Line {line}: {reason}" for line, reason in report.errors[:10])[:1024],
+                inline=False
+            )
+        await interaction.edit_original_response(embed=embed)
+    except Exception as e:
+        print(f"Error importing invites: {e}")
+        embed = discord.Embed(
+            title=f"{EMOJIS['cross']} Import Failed",
+            description=f"The file could not be imported: {e}",
+            color=COLORS['red']
+        )
+        await interaction.edit_original_response(embed=embed)
+
 # --- GIVEAWAY COMMANDS ---
 
 @bot.tree.command(name="gcreate", description="Create a giveaway")
-async def gcreate(interaction: discord.Interaction):
+@app_commands.describe(
+    bonus_role="Members with this role get bonus entries (optional)",
+    bonus_role_entries="Extra entries for members with the bonus role",
+    entries_per_invite="Extra entries per net invite, e.g. 0.5 (optional)"
+)
+async def gcreate(interaction: discord.Interaction, bonus_role: discord.Role = None, bonus_role_entries: int = 0, entries_per_invite: float = 0.0):
     if not await check_command_permission(interaction, 'gcreate'):
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
         return
+
+    if bonus_role_entries < 0 or entries_per_invite < 0:
+        await interaction.response.send_message("Bonus entries can't be negative.", ephemeral=True)
+        return
     
     # Show the giveaway creation modal
-    modal = GiveawayModal()
+    modal = GiveawayModal(bonus_role, bonus_role_entries, entries_per_invite)
     await interaction.response.send_modal(modal)
 
 @bot.tree.command(name="glist", description="List active giveaways")
@@ -1104,41 +1762,12 @@ async def glist(interaction: discord.Interaction):
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
 
-        giveaways = await db.get_active_giveaways(interaction.guild.id)
-        
-        if not giveaways:
-            embed = discord.Embed(
-                title="🎉 Active Giveaways",
-                description="No active giveaways found.",
-                color=COLORS['blue']
-            )
+        view = GiveawayListView(interaction.guild.id, interaction.user.id)
+        embed = await view.load_page(0)
+        if view.has_next:
+            await interaction.response.send_message(embed=embed, view=view)
+        else:
             await interaction.response.send_message(embed=embed)
-            return
-        
-        embed = discord.Embed(
-            title="🎉 Active Giveaways",
-            color=COLORS['blue']
-        )
-        
-        for giveaway in giveaways[:10]:  # Limit to 10 to avoid embed limits
-            try:
-                host = bot.get_user(giveaway['host_id'])
-                host_name = host.name if host else f"User {giveaway['host_id']}"
-                
-                end_time = datetime.fromisoformat(giveaway['end_time'])
-                timestamp = int(end_time.timestamp())
-                
-                entries_count = await db.get_giveaway_entries_count(giveaway['id'])
-                
-                embed.add_field(
-                    name=f"🎁 {giveaway['prize']}",
-                    value=f"**Host:** {host_name}\n**Entries:** {entries_count}\n**Winners:** {giveaway['winners']}\n**Ends:** <t:{timestamp}:R>",
-                    inline=True
-                )
-            except Exception as e:
-                print(f"Error processing giveaway {giveaway['id']}: {e}")
-        
-        await interaction.response.send_message(embed=embed)
     except Exception as e:
         print(f"Error in glist command: {e}")
         await interaction.response.send_message("An error occurred while fetching giveaways.", ephemeral=True)
@@ -1167,88 +1796,38 @@ async def gend_command(interaction: discord.Interaction, message_id: str):
             await interaction.response.send_message("Giveaway not found!", ephemeral=True)
             return
         
-        if giveaway['status'] == 'ended':
+        if giveaway.status != 'active':
             await interaction.response.send_message("This giveaway has already ended!", ephemeral=True)
             return
         
         # Check if user is the host or has admin permissions
-        if giveaway['host_id'] != interaction.user.id and not interaction.user.guild_permissions.administrator:
+        if giveaway.host_id != interaction.user.id and not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("You can only end giveaways you created!", ephemeral=True)
             return
         
-        # End the giveaway immediately
-        await db.end_giveaway(giveaway['id'])
-        
-        # Process the giveaway ending
+        # Ending posts results and edits the original message, which can outlast the 3s response window
+        await interaction.response.defer(ephemeral=True)
+
+        # End the giveaway immediately; the loop may be ending it at the same moment
         try:
-            # Get entries
-            entries = await db.get_giveaway_entries(giveaway['id'])
-            
-            if not entries:
-                # No entries
-                embed = discord.Embed(
-                    title="🎉 Congratulations!",
-                    description=f"**Prize:** {giveaway['prize']}\n\nNo one entered this giveaway.",
-                    color=0xFF0000
-                )
-            else:
-                # Select winners
-                num_winners = min(giveaway['winners'], len(entries))
-                winners = random.sample(entries, num_winners)
-                
-                winner_mentions = []
-                for winner_data in winners:
-                    user = interaction.guild.get_member(winner_data['user_id'])
-                    if user:
-                        winner_mentions.append(user.mention)
-                
-                # Send winner announcement with ticket channel reference
-                ticket_channel_mention = f"<#{TICKET_CHANNEL_ID}>"
-                announcement_embed = discord.Embed(
-                    title="🎉 Congratulations!",
-                    description=f"**Prize:** {giveaway['prize']}\n**Winner(s):** {', '.join(winner_mentions)}\n**Hosted by:** <@{giveaway['host_id']}>\n\n" +
-                              f"────────────────────────\n\n" +
-                              f"- Open a ticket in {ticket_channel_mention}\n" +
-                              f"- Please take a screenshot of this message and send it in your claim ticket!",
-                    color=0xFF0000
-                )
-                embed = announcement_embed
-                
-            # Try to update original message
-            try:
-                channel = interaction.guild.get_channel(giveaway['channel_id'])
-                if channel:
-                    original_message = await channel.fetch_message(giveaway['message_id'])
-                    if original_message:
-                        original_embed = original_message.embeds[0]
-                        original_embed.title = f"🎉 {giveaway['prize']} (ENDED)"
-                        original_embed.color = 0x808080
-                        
-                        for i, field in enumerate(original_embed.fields):
-                            if field.name == "Time:":
-                                original_embed.set_field_at(i, name="Time:", value="Ended", inline=True)
-                                break
-                        
-                        await original_message.edit(embed=original_embed, view=None)
-                        
-                        # Send results to same channel
-                        await channel.send(embed=embed)
-            except Exception as e:
-                print(f"Error updating message: {e}")
-            
-            await interaction.response.send_message("✅ Giveaway ended successfully!", ephemeral=True)
-            
+            ended = await giveaway_finalizer.finalize(giveaway)
         except Exception as e:
             print(f"Error processing giveaway: {e}")
-            await interaction.response.send_message("Giveaway ended but there was an error processing results.", ephemeral=True)
+            await interaction.followup.send("Giveaway ended but there was an error processing results.", ephemeral=True)
+            return
+
+        if ended:
+            await interaction.followup.send("✅ Giveaway ended successfully!", ephemeral=True)
+        else:
+            await interaction.followup.send("This giveaway has already ended!", ephemeral=True)
             
     except Exception as e:
         print(f"Error in gend command: {e}")
         await interaction.response.send_message("An error occurred while ending the giveaway.", ephemeral=True)
 
 @bot.tree.command(name="greroll", description="Reroll a giveaway")
-@app_commands.describe(message_id="The message ID of the giveaway to reroll")
-async def greroll(interaction: discord.Interaction, message_id: str):
+@app_commands.describe(message_id="The message ID of the giveaway to reroll", count="How many winners to redraw (default: all)")
+async def greroll(interaction: discord.Interaction, message_id: str, count: int = None):
     if not await check_command_permission(interaction, 'greroll'):
         embed = discord.Embed(
             description="❌ You don't have permission to use this command!",
@@ -1269,48 +1848,129 @@ async def greroll(interaction: discord.Interaction, message_id: str):
         return
     
     # Check if user is the host or has admin permissions
-    if giveaway['host_id'] != interaction.user.id and not interaction.user.guild_permissions.administrator:
+    if giveaway.host_id != interaction.user.id and not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("You can only reroll giveaways you created!", ephemeral=True)
         return
-    
-    # Get entries
-    entries = await db.get_giveaway_entries(giveaway['id'])
-    
-    if not entries:
-        await interaction.response.send_message("No entries found for this giveaway.", ephemeral=True)
+
+    if giveaway.status != 'ended':
+        await interaction.response.send_message("You can only reroll a giveaway that has ended!", ephemeral=True)
+        return
+
+    count = count or giveaway.winners
+    if count < 1 or count > giveaway.winners:
+        await interaction.response.send_message(f"Count must be between 1 and {giveaway.winners}.", ephemeral=True)
         return
     
-    # Select new winners
-    num_winners = min(giveaway['winners'], len(entries))
-    winners = random.sample(entries, num_winners)
+    # Select new winners; previous winners of this giveaway can't win again
+    winner_ids = await db.reroll_giveaway_winners(giveaway.id, count)
     
-    winner_mentions = []
-    for winner_data in winners:
-        user = interaction.guild.get_member(winner_data['user_id'])
-        if user:
-            winner_mentions.append(user.mention)
+    if not winner_ids:
+        await interaction.response.send_message("No eligible entries left to reroll.", ephemeral=True)
+        return
     
-    # EXACT format from your screenshot
+    embed = giveaway_finalizer.results_embed(interaction.guild, giveaway, winner_ids)
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="gschedule", description="Schedule a one-off or recurring giveaway")
+@app_commands.describe(
+    channel="Channel to post the giveaway in",
+    prize="What are you giving away?",
+    duration="How long each giveaway runs, e.g. 1d",
+    schedule="Cron expression in UTC (e.g. '0 18 * * 5', @daily) or a delay for a one-off (e.g. 2h)",
+    winners="Number of winners",
+    description="Optional description for the giveaway"
+)
+async def gschedule(interaction: discord.Interaction, channel: discord.TextChannel, prize: str, duration: str,
+                    schedule: str, winners: int = 1, description: str = None):
+    if not await check_command_permission(interaction, 'gschedule'):
+        embed = discord.Embed(
+            description="❌ You don't have permission to use this command!",
+            color=COLORS['red']
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    duration_seconds = parse_duration(duration)
+    if duration_seconds is None or duration_seconds < 5:
+        await interaction.response.send_message("Invalid duration! Use formats like: 10 minutes, 2 hours, 1 day, 30s, 30m, 2h, 1d", ephemeral=True)
+        return
+    if winners < 1:
+        await interaction.response.send_message("Number of winners must be at least 1!", ephemeral=True)
+        return
+
+    now = datetime.now(timezone.utc)
+    delay = parse_duration(schedule)
+    if delay is not None:
+        cron = None
+        next_run = int(now.timestamp()) + delay
+    else:
+        try:
+            cron_schedule = CronSchedule(schedule)
+            cron = cron_schedule.expression
+            next_run = int(cron_schedule.next_after(now).timestamp())
+        except ValueError as e:
+            await interaction.response.send_message(f"Invalid schedule: {e}", ephemeral=True)
+            return
+
+    schedule_id = await db.create_giveaway_schedule(
+        interaction.guild.id, channel.id, interaction.user.id, prize, winners, duration_seconds,
+        description, cron, next_run
+    )
+    giveaway_scheduler.wake()
+
+    repeats = f"`{cron}` (UTC)" if cron else "No"
     embed = discord.Embed(
-        title="🎉 Congratulations!",
-        color=0xFF0000  # RED color matching your screenshot
+        title=f"{EMOJIS['check']} Giveaway Scheduled",
+        description=f"**Prize:** {prize}\n**Channel:** {channel.mention}\n**Repeats:** {repeats}\n**Next launch:** <t:{next_run}:F> (<t:{next_run}:R>)",
+        color=COLORS['green']
+    )
+    embed.set_footer(text=f"Schedule ID: {schedule_id}")
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="gschedules", description="List scheduled giveaways")
+async def gschedules(interaction: discord.Interaction):
+    if not await check_command_permission(interaction, 'gschedules'):
+        embed = discord.Embed(
+            description="❌ You don't have permission to use this command!",
+            color=COLORS['red']
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    schedules = await db.get_guild_schedules(interaction.guild.id)
+    embed = discord.Embed(title="🗓️ Scheduled Giveaways", color=COLORS['blue'])
+    if not schedules:
+        embed.description = "No scheduled giveaways."
+    for schedule in schedules[:25]:  # Embed field limit
+        next_run = f"<t:{schedule.next_run}:R>" if schedule.next_run else "Finished"
+        repeats = f"`{schedule.cron}`" if schedule.cron else "No"
+        embed.add_field(
+            name=f"#{schedule.id} • {schedule.prize}",
+            value=f"**Channel:** <#{schedule.channel_id}>\n**Winners:** {schedule.winners}\n**Repeats:** {repeats}\n**Next:** {next_run}",
+            inline=True
+        )
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="gunschedule", description="Delete a scheduled giveaway")
+@app_commands.describe(schedule_id="ID shown in /gschedules")
+async def gunschedule(interaction: discord.Interaction, schedule_id: int):
+    if not await check_command_permission(interaction, 'gunschedule'):
+        embed = discord.Embed(
+            description="❌ You don't have permission to use this command!",
+            color=COLORS['red']
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if not await db.delete_giveaway_schedule(schedule_id, interaction.guild.id):
+        await interaction.response.send_message("Schedule not found!", ephemeral=True)
+        return
+    giveaway_scheduler.wake()
+
+    embed = discord.Embed(
+        description=f"{EMOJIS['check']} Scheduled giveaway #{schedule_id} deleted.",
+        color=COLORS['green']
     )
-    
-    # Build description exactly like your screenshot
-    description = f"**Prize:** {giveaway['prize']}\n"
-    if winner_mentions:
-        description += f"**Winner(s):** {', '.join(winner_mentions)}\n"
-    
-    host = interaction.guild.get_member(giveaway['host_id'])
-    if host:
-        description += f"**Hosted by:** {host.mention}\n\n"
-    
-    description += "────────────────────────\n\n"
-    description += f"- Open a ticket in <#{TICKET_CHANNEL_ID}>\n"
-    description += "- Please take a screenshot of this message and send it in your claim ticket!"
-    
-    embed.description = description
-    
     await interaction.response.send_message(embed=embed)
 
 # --- STAFF MANAGEMENT COMMANDS ---
@@ -1337,8 +1997,8 @@ async def promote(interaction: discord.Interaction, user: discord.Member, role:
 
         # Log to staff channel if set
         settings = await db.get_guild_settings(interaction.guild.id)
-        if settings and settings.get('staff_log_channel_id'):
-            staff_channel = interaction.guild.get_channel(settings['staff_log_channel_id'])
+        if settings and settings.staff_log_channel_id:
+            staff_channel = interaction.guild.get_channel(settings.staff_log_channel_id)
             if staff_channel:
                 # EXACT format from your staff promotion screenshot
                 log_embed = discord.Embed(
@@ -1394,8 +2054,8 @@ async def demote(interaction: discord.Interaction, user: discord.Member, role: d
 
         # Log to staff channel if set
         settings = await db.get_guild_settings(interaction.guild.id)
-        if settings and settings.get('staff_log_channel_id'):
-            staff_channel = interaction.guild.get_channel(settings['staff_log_channel_id'])
+        if settings and settings.staff_log_channel_id:
+            staff_channel = interaction.guild.get_channel(settings.staff_log_channel_id)
             if staff_channel:
                 # EXACT format from your staff demotion screenshot
                 log_embed = discord.Embed(
@@ -1473,11 +2133,11 @@ async def testwelcome(interaction: discord.Interaction):
         return
     
     settings = await db.get_guild_settings(interaction.guild.id)
-    if not settings or not settings.get('welcome_channel_id'):
+    if not settings or not settings.welcome_channel_id:
         await interaction.response.send_message("No welcome channel set. Use `/setwelcome` first.", ephemeral=True)
         return
     
-    welcome_channel = interaction.guild.get_channel(settings['welcome_channel_id'])
+    welcome_channel = interaction.guild.get_channel(settings.welcome_channel_id)
     if not welcome_channel:
         await interaction.response.send_message("Welcome channel not found. Please set a new one.", ephemeral=True)
         return
@@ -1504,9 +2164,6 @@ async def testwelcome(interaction: discord.Interaction):
 
 @bot.tree.command(name="addcmdperm", description="Add permission for a role to use a command (Admin only)")
 @app_commands.describe(role="The role to give permission to", command="The command name to allow access to")
-@app_commands.choices(command=[
-    app_commands.Choice(name=cmd, value=cmd) for cmd in AVAILABLE_COMMANDS
-])
 async def addcmdperm(interaction: discord.Interaction, role: discord.Role, command: str):
     # Only server owner or administrators can manage permissions
     if not (interaction.user == interaction.guild.owner or interaction.user.guild_permissions.administrator):
@@ -1536,9 +2193,6 @@ async def addcmdperm(interaction: discord.Interaction, role: discord.Role, comma
 
 @bot.tree.command(name="removecmdperm", description="Remove permission for a role to use a command (Admin only)")
 @app_commands.describe(role="The role to remove permission from", command="The command name to revoke access to")
-@app_commands.choices(command=[
-    app_commands.Choice(name=cmd, value=cmd) for cmd in AVAILABLE_COMMANDS
-])
 async def removecmdperm(interaction: discord.Interaction, role: discord.Role, command: str):
     # Only server owner or administrators can manage permissions
     if not (interaction.user == interaction.guild.owner or interaction.user.guild_permissions.administrator):
@@ -1566,6 +2220,16 @@ async def removecmdperm(interaction: discord.Interaction, role: discord.Role, co
     
     await interaction.response.send_message(embed=embed)
 
+# AVAILABLE_COMMANDS has outgrown Discord's 25 static choices per option, so
+# /addcmdperm and /removecmdperm suggest matching names as the user types
+@addcmdperm.autocomplete("command")
+@removecmdperm.autocomplete("command")
+async def command_name_autocomplete(interaction: discord.Interaction, current: str):
+    current = current.strip().lower()
+    return [
+        app_commands.Choice(name=cmd, value=cmd) for cmd in AVAILABLE_COMMANDS if current in cmd
+    ][:25]
+
 @bot.tree.command(name="listcmdperm", description="List all command permissions for this server (Admin only)")
 async def listcmdperm(interaction: discord.Interaction):
     # Only server owner or administrators can view permissions
@@ -1620,6 +2284,64 @@ async def listcmdperm(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
+# --- OWNER TOOLS ---
+
+@bot.tree.command(name="profile", description="Profile the bot for a number of seconds (Bot owner only)")
+@app_commands.describe(seconds="How long to profile for (1-120 seconds)")
+async def profile(interaction: discord.Interaction, seconds: int = 30):
+    global profile_running
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can use this command.", ephemeral=True)
+        return
+
+    if seconds < 1 or seconds > 120:
+        await interaction.response.send_message("Seconds must be between 1 and 120.", ephemeral=True)
+        return
+
+    if profile_running:
+        await interaction.response.send_message("A profile is already running.", ephemeral=True)
+        return
+
+    profile_running = True
+    await interaction.response.defer(ephemeral=True)
+    try:
+        profiler = SamplingProfiler(bot, db, extra_labels={
+            EnterGiveawayView.enter_giveaway: "button:enter_giveaway",
+            GiveawayModal.on_submit: "modal:gcreate",
+            check_giveaways.coro: "task:check_giveaways",
+        })
+        report = await profiler.run(seconds)
+    finally:
+        profile_running = False
+
+    embed = discord.Embed(
+        title=f"{EMOJIS['chart']} Profile Results",
+        description=f"{report.samples} samples over {report.duration:.1f}s",
+        color=COLORS['blue']
+    )
+
+    handlers = ""
+    for label, count in report.by_label[:10]:
+        handlers += f"`{label}` — {count * 100 / max(report.samples, 1):.1f}%\n"
+    embed.add_field(name="Time by handler", value=handlers or "No samples", inline=False)
+
+    queries = ""
+    for elapsed, sql in report.slow_queries[:5]:
+        queries += f"`{elapsed * 1000:.1f}ms` {sql[:150]}\n"
+    embed.add_field(name="Slowest queries", value=queries[:1024] or "No queries ran", inline=False)
+
+    await interaction.followup.send(embed=embed, file=discord.File(report.path), ephemeral=True)
+
 # Run the bot
 if __name__ == "__main__":
+    # Check for Discord token
+    if not DISCORD_TOKEN:
+        print("ERROR: DISCORD_TOKEN environment variable not set!")
+        print("Please set your Discord bot token in the Secrets tab.")
+        exit(1)
+
+    # Start keep-alive server for Replit (only one cluster worker can own the port)
+    if CLUSTER_ID == 0:
+        keep_alive()
+
     bot.run(DISCORD_TOKEN)
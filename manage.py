@@ -0,0 +1,94 @@
+"""Maintenance commands for the bot's database, run while the bot is up or down.
+
+    python manage.py repair-counts [--db bot_database.db] [--dry-run]
+    python manage.py reconcile-invites [--db bot_database.db] [--full]
+    python manage.py rebuild-invite-tree [--db bot_database.db] [--guild GUILD_ID]
+    python manage.py export --guild GUILD_ID [--db bot_database.db] [--format csv|ndjson] [--table TABLE ...] [--out DIR]
+    python manage.py import-invites --guild GUILD_ID FILE [--db bot_database.db] [--mode merge|overwrite]
+"""
+import argparse
+import asyncio
+
+from database import EXPORT_TABLES, Database
+from exports import EXPORT_FORMATS, export_guild
+from imports import IMPORT_MODES, detect_format, import_invites
+
+async def repair_counts(db, args):
+    drifted = await db.repair_entry_counts(dry_run=args.dry_run)
+    for giveaway_id, stored, actual in drifted:
+        print(f"Giveaway {giveaway_id}: stored {stored}, actual {actual}")
+    action = "would be repaired" if args.dry_run else "repaired"
+    print(f"{len(drifted)} giveaway entry count(s) {action}")
+
+async def reconcile_invites(db, args):
+    checked, corrections = await db.reconcile_invite_counters(full=args.full)
+    for guild_id, user_id, old, new in corrections:
+        print(f"Guild {guild_id} user {user_id}: (total, left, fake) {old} -> {new}")
+    print(f"{len(corrections)} of {checked} inviter counter(s) corrected")
+
+async def rebuild_invite_tree(db, args):
+    placed = await db.rebuild_invite_closure(args.guild)
+    print(f"Rebuilt invite tree for {placed} member(s)")
+
+async def export(db, args):
+    for result in await export_guild(db, args.guild, args.format, args.out, args.table):
+        print(f"{result.path}: {result.rows} rows, {result.size} bytes in {result.seconds:.1f}s "
+              f"({result.rows / max(result.seconds, 1e-9):.0f} rows/s)")
+
+async def import_file(db, args):
+    fmt, gzipped = detect_format(args.file)
+
+    async def report_progress(report):
+        print(f"{report.imported} rows imported ({report.rate:.0f} rows/s)")
+
+    with open(args.file, 'rb') as stream:
+        report = await import_invites(db, args.guild, stream, fmt, gzipped, args.mode, report_progress)
+    for line, reason in report.errors:
+        print(f"Skipped line {line}: {reason}")
+    print(f"Imported {report.imported} rows, skipped {report.skipped}, in {report.seconds:.1f}s ({report.rate:.0f} rows/s)")
+
+def main_cli():
+    # Options every command takes, so they can follow the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default="bot_database.db", help="Database file (default: bot_database.db)")
+
+    parser = argparse.ArgumentParser(description="Database maintenance for the bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    repair = commands.add_parser("repair-counts", parents=[common], help="Recount giveaway entries and fix drifted entry_count values")
+    repair.add_argument("--dry-run", action="store_true", help="Report drift without changing anything")
+    repair.set_defaults(handler=repair_counts)
+
+    reconcile = commands.add_parser("reconcile-invites", parents=[common], help="Rebuild invite counters from recorded invite relationships")
+    reconcile.add_argument("--full", action="store_true", help="Check every inviter instead of only those changed since the last run")
+    reconcile.set_defaults(handler=reconcile_invites)
+
+    tree = commands.add_parser("rebuild-invite-tree", parents=[common], help="Rebuild the invite closure table from recorded invite relationships")
+    tree.add_argument("--guild", type=int, help="Only rebuild this guild (default: every guild)")
+    tree.set_defaults(handler=rebuild_invite_tree)
+
+    dump = commands.add_parser("export", parents=[common], help="Export a guild's invite and giveaway data as gzipped CSV or NDJSON")
+    dump.add_argument("--guild", type=int, required=True, help="Guild to export")
+    dump.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    dump.add_argument("--table", action="append", choices=list(EXPORT_TABLES), help="Table to export; repeat for several (default: all)")
+    dump.add_argument("--out", default="exports", help="Directory to write the files to (default: exports)")
+    dump.set_defaults(handler=export)
+
+    load = commands.add_parser("import-invites", parents=[common], help="Import per-user invite counts from a CSV, JSON or NDJSON file")
+    load.add_argument("file", help="File to import (.csv, .json or .ndjson, optionally .gz)")
+    load.add_argument("--guild", type=int, required=True, help="Guild the counts belong to")
+    load.add_argument("--mode", choices=IMPORT_MODES, default="merge", help="Add to existing counts (merge) or replace them (overwrite)")
+    load.set_defaults(handler=import_file)
+
+    args = parser.parse_args()
+
+    async def run():
+        db = Database(args.db)
+        # Applies pending migrations, e.g. adding and backfilling entry_count
+        await db.create_tables()
+        await args.handler(db, args)
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from discord import app_commands
+
+PROFILE_DIR = "profiles"
+
+class ProfileReport:
+    def __init__(self, path, duration, samples, by_label, slow_queries):
+        self.path = path
+        self.duration = duration
+        self.samples = samples
+        self.by_label = by_label  # [(label, sample_count), ...] busiest first
+        self.slow_queries = slow_queries  # [(seconds, sql), ...] slowest first
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack and attributes each sample to the
+    event handler, slash command or task that was running at the time.
+
+    Output is written in collapsed-stack format (one "label;frame;...;frame count"
+    line per unique stack) so it can be fed straight into flamegraph tools."""
+
+    def __init__(self, bot, db, interval=0.005, slow_query_limit=10, extra_labels=None):
+        self.bot = bot
+        self.db = db
+        self.interval = interval
+        self.slow_query_limit = slow_query_limit
+        self.extra_labels = extra_labels or {}
+        self._stacks = Counter()
+        self._slow_queries = []
+        self._query_seq = 0
+        self._stop = threading.Event()
+        self._target_thread_id = None
+        self._labels = {}
+
+    def _build_labels(self):
+        """Map handler code objects to the names samples are attributed to"""
+        labels = {}
+        for name, func in vars(self.bot).items():
+            if name.startswith('on_') and inspect.iscoroutinefunction(func):
+                labels[func.__code__] = f"event:{name}"
+        for name, listeners in self.bot.extra_events.items():
+            for func in listeners:
+                labels[func.__code__] = f"event:{name}"
+        for command in self.bot.tree.walk_commands():
+            if isinstance(command, app_commands.Command):
+                labels[command.callback.__code__] = f"command:/{command.qualified_name}"
+        for func, label in self.extra_labels.items():
+            labels[func.__code__] = label
+        return labels
+
+    def _on_query(self, sql, seconds):
+        # Keep only the N slowest statements; the sequence number breaks ties
+        self._query_seq += 1
+        item = (seconds, self._query_seq, " ".join(sql.split()))
+        if len(self._slow_queries) < self.slow_query_limit:
+            heapq.heappush(self._slow_queries, item)
+        elif seconds > self._slow_queries[0][0]:
+            heapq.heapreplace(self._slow_queries, item)
+
+    def _sample_loop(self):
+        labels = self._labels
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            stack = []
+            label = None
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                if code in labels:
+                    # Keep walking: the outermost handler on the stack wins
+                    label = labels[code]
+                frame = frame.f_back
+            if label is None:
+                label = "idle" if stack and stack[0].startswith("select ") else "other"
+            stack.append(label)
+            stack.reverse()
+            self._stacks[";".join(stack)] += 1
+
+    def _write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(PROFILE_DIR, f"profile-{stamp}.collapsed")
+        with open(path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    async def run(self, seconds):
+        """Profile the running bot for the given number of seconds"""
+        self._labels = self._build_labels()
+        self._target_thread_id = threading.get_ident()
+        self.db.add_query_observer(self._on_query)
+        sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stop.set()
+            self.db.remove_query_observer(self._on_query)
+            await asyncio.to_thread(sampler.join)
+        duration = time.perf_counter() - started
+
+        by_label = Counter()
+        for stack, count in self._stacks.items():
+            by_label[stack.split(";", 1)[0]] += count
+        path = await asyncio.to_thread(self._write)
+        slow_queries = [(seconds, sql) for seconds, _, sql in sorted(self._slow_queries, reverse=True)]
+        return ProfileReport(path, duration, sum(by_label.values()), by_label.most_common(), slow_queries)
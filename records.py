@@ -0,0 +1,148 @@
+"""Typed rows returned by Database.
+
+Each record is a NamedTuple whose fields are the exact columns selected for
+it (see columns()), so rows are built straight from the tuple SQLite
+returns without a per-row dict, and adding a column to a table can't
+shift what a query reads.
+"""
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+class Giveaway(NamedTuple):
+    id: int
+    guild_id: int
+    host_id: int
+    prize: str
+    message_id: int
+    channel_id: int
+    winners: int
+    ends_at: int
+    status: str
+    created_at: int
+    announce_message_id: Optional[int]
+    bonus_role_id: Optional[int]
+    bonus_role_entries: int
+    entries_per_invite: float
+    min_invites: Optional[int]
+    min_account_age_days: Optional[int]
+    required_role_id: Optional[int]
+    entry_count: int
+
+class GiveawaySchedule(NamedTuple):
+    id: int
+    guild_id: int
+    channel_id: int
+    host_id: int
+    prize: str
+    winners: int
+    duration_seconds: int
+    description: Optional[str]
+    cron: Optional[str]
+    next_run: Optional[int]
+    last_run: Optional[int]
+    created_at: int
+
+class InviteStats(NamedTuple):
+    user_id: int
+    total: int
+    left: int
+    fake: int
+    bonus: int
+    claimed: int
+    net: int
+
+class InviterPeriodStats(NamedTuple):
+    user_id: int
+    joins: int
+    fakes: int
+    leaves: int
+    net: int
+
+class InviteActivity(NamedTuple):
+    bucket: int
+    joins: int
+    fakes: int
+    leaves: int
+
+class DownstreamStats(NamedTuple):
+    members: int
+    direct: int
+    all_time: int
+    depth: int
+
+class InviteTreeNode(NamedTuple):
+    user_id: int
+    parent_id: int
+    depth: int
+    active: int
+    downstream: int
+
+class ClaimEntry(NamedTuple):
+    id: int
+    user_id: int
+    actor_id: Optional[int]
+    amount: int
+    reason: Optional[str]
+    balance_after: int
+    created_at: int
+
+class GuildSettings(NamedTuple):
+    guild_id: int
+    welcome_channel_id: Optional[int]
+    staff_log_channel_id: Optional[int]
+    mod_log_channel_id: Optional[int]
+
+# Column expressions for records whose fields aren't plain column names
+COLUMN_EXPRESSIONS = {
+    InviteStats: {
+        'total': 'total_invites',
+        'left': 'left_invites',
+        'fake': 'fake_invites',
+        'bonus': 'bonus_invites',
+        'claimed': 'claimed_invites',
+        'net': 'total_invites - left_invites - fake_invites + bonus_invites',
+    },
+    # Aggregates over invite_rollups buckets
+    InviterPeriodStats: {
+        'user_id': 'inviter_id',
+        'joins': 'SUM(joins)',
+        'fakes': 'SUM(fakes)',
+        'leaves': 'SUM(leaves)',
+        'net': 'SUM(joins) - SUM(fakes) - SUM(leaves)',
+    },
+    # Aggregate over one ancestor's invite_closure rows; active members only unless all_time
+    DownstreamStats: {
+        'members': 'COALESCE(SUM(active), 0)',
+        'direct': 'COALESCE(SUM(active AND depth = 1), 0)',
+        'all_time': 'COUNT(*)',
+        'depth': 'COALESCE(MAX(CASE WHEN active THEN depth END), 0)',
+    },
+    # invite_closure t (the node under the root) joined to p (its depth-1 parent row)
+    InviteTreeNode: {
+        'user_id': 't.descendant_id',
+        'parent_id': 'p.ancestor_id',
+        'depth': 't.depth',
+        'active': 't.active',
+        'downstream': '(SELECT COALESCE(SUM(s.active), 0) FROM invite_closure s '
+                      'WHERE s.guild_id = t.guild_id AND s.ancestor_id = t.descendant_id)',
+    },
+    InviteActivity: {
+        'joins': 'SUM(joins)',
+        'fakes': 'SUM(fakes)',
+        'leaves': 'SUM(leaves)',
+    },
+}
+
+@lru_cache(maxsize=None)
+def columns(record_type):
+    """SELECT list producing record_type's fields in order"""
+    expressions = COLUMN_EXPRESSIONS.get(record_type, {})
+    return ', '.join(f'{expressions[field]} AS "{field}"' if field in expressions else field
+                     for field in record_type._fields)
+
+def fetch_one(cursor, record_type):
+    row = cursor.fetchone()
+    return record_type._make(row) if row else None
+
+def fetch_all(cursor, record_type):
+    return list(map(record_type._make, cursor.fetchall()))
@@ -0,0 +1,92 @@
+import asyncio
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import discord
+
+# How long a guild's invite snapshot is trusted before it is reloaded
+SNAPSHOT_TTL = 60
+
+class InviteSnapshot:
+    """In-memory net invite counts per guild, loaded with one query and reused
+    by every button click until it expires, instead of a query per click.
+    Joins and leaves show up once the snapshot is reloaded, at most ttl
+    seconds later."""
+
+    def __init__(self, db, ttl=SNAPSHOT_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._counts = {}
+        self._loaded_at = {}
+        self._locks = defaultdict(asyncio.Lock)
+
+    async def net_invites(self, guild_id, user_id):
+        if time.monotonic() - self._loaded_at.get(guild_id, float('-inf')) > self.ttl:
+            async with self._locks[guild_id]:
+                # Another click may have reloaded while we waited
+                if time.monotonic() - self._loaded_at.get(guild_id, float('-inf')) > self.ttl:
+                    self._counts[guild_id] = await self.db.get_guild_net_invites(guild_id)
+                    self._loaded_at[guild_id] = time.monotonic()
+        return self._counts[guild_id].get(user_id, 0)
+
+def parse_requirements(text, guild):
+    """Parse "invites:5, age:30d, role:Members" into giveaway columns.
+
+    Raises ValueError with a message fit to show the host."""
+    requirements = {'min_invites': None, 'min_account_age_days': None, 'required_role_id': None}
+    for part in filter(None, (p.strip() for p in (text or "").split(','))):
+        key, _, value = part.partition(':')
+        key, value = key.strip().lower(), value.strip()
+        if key == 'invites' and value.isdigit():
+            requirements['min_invites'] = int(value)
+        elif key == 'age' and re.fullmatch(r'\d+d?', value):
+            requirements['min_account_age_days'] = int(value.rstrip('d'))
+        elif key == 'role' and value:
+            match = re.fullmatch(r'<@&(\d+)>|(\d+)', value)
+            role_id = int(match.group(1) or match.group(2)) if match else None
+            role = guild.get_role(role_id) if role_id else discord.utils.find(lambda r: r.name.lower() == value.lower(), guild.roles)
+            if not role:
+                raise ValueError(f"Role `{value}` was not found.")
+            requirements['required_role_id'] = role.id
+        else:
+            raise ValueError(f"Invalid requirement `{part}`. Use formats like: invites:5, age:30d, role:Members")
+    return requirements
+
+def describe_requirements(requirements):
+    parts = []
+    if requirements['min_invites']:
+        parts.append(f"{requirements['min_invites']}+ net invites")
+    if requirements['min_account_age_days']:
+        parts.append(f"account {requirements['min_account_age_days']}+ days old")
+    if requirements['required_role_id']:
+        parts.append(f"<@&{requirements['required_role_id']}>")
+    return " • ".join(parts)
+
+class RequirementChecker:
+    """Evaluates a giveaway's entry rules and counts rejections per rule"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.rejections = defaultdict(Counter)  # giveaway id -> rule -> count
+
+    async def check(self, giveaway, member):
+        """Return a rejection message, or None if the member may enter"""
+        if giveaway.required_role_id and not any(role.id == giveaway.required_role_id for role in member.roles):
+            return self._reject(giveaway, 'role', f"You need the <@&{giveaway.required_role_id}> role to enter this giveaway.")
+
+        if giveaway.min_account_age_days:
+            age_days = (datetime.now(timezone.utc) - member.created_at).days
+            if age_days < giveaway.min_account_age_days:
+                return self._reject(giveaway, 'age', f"Your account must be at least {giveaway.min_account_age_days} days old to enter (it is {age_days} days old).")
+
+        if giveaway.min_invites:
+            net = await self.snapshot.net_invites(member.guild.id, member.id)
+            if net < giveaway.min_invites:
+                return self._reject(giveaway, 'invites', f"You need at least {giveaway.min_invites} net invites to enter (you have {net}).")
+        return None
+
+    def _reject(self, giveaway, rule, message):
+        self.rejections[giveaway.id][rule] += 1
+        return message
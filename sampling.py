@@ -0,0 +1,62 @@
+class FenwickSampler:
+    """Weighted sampling without replacement.
+
+    Weights live in a Fenwick (binary indexed) tree, so building costs O(n)
+    and each draw, including removing the drawn item, costs O(log n).
+    """
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = list(weights)
+        self.total = float(sum(self.weights))
+        tree = [0.0] + [float(w) for w in self.weights]
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.top_bit = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def _find(self, target):
+        """Index of the item whose cumulative weight range contains target"""
+        pos = 0
+        step = self.top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+    def _remove(self, index):
+        weight = self.weights[index]
+        self.weights[index] = 0.0
+        self.total -= weight
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] -= weight
+            i += i & -i
+
+    def _nearest_live(self, index):
+        """Closest index to index with weight left, searching outward on both sides"""
+        for distance in range(1, self.size):
+            for i in (index - distance, index + distance):
+                if 0 <= i < self.size and self.weights[i] > 0:
+                    return i
+        raise ValueError("No items with weight left to draw")
+
+    def draw(self, rng):
+        """Draw one index with probability proportional to its weight and remove it"""
+        index = self._find(rng.random() * self.total)
+        # Float drift can land on an already removed item; fall back to its nearest live neighbour
+        if self.weights[index] <= 0:
+            index = self._nearest_live(index)
+        self._remove(index)
+        return index
+
+def weighted_sample(items, weights, k, rng):
+    """Pick up to k distinct items, each draw proportional to the remaining weights"""
+    live = sum(1 for w in weights if w > 0)
+    sampler = FenwickSampler(weights)
+    return [items[sampler.draw(rng)] for _ in range(min(k, live))]
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+
+# Gap between launches that fall due together, so a busy minute doesn't burst the API
+LAUNCH_STAGGER_SECONDS = 2
+
+# Upper bound on one sleep, so clock jumps and missed wake-ups correct themselves
+MAX_SLEEP_SECONDS = 3600
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (name, lowest, highest) for each of the five cron fields
+FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day of month', 1, 31), ('month', 1, 12), ('day of week', 0, 6))
+
+class CronSchedule:
+    """Standard five-field cron expression evaluated in UTC.
+
+    Supports *, lists (1,15), ranges (1-5), steps (*/15, 0-30/10) and the
+    @hourly/@daily/@weekly/@monthly aliases. Day of week is 0-6 from Sunday;
+    7 is accepted for Sunday too.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        parts = ALIASES.get(self.expression.lower(), self.expression).split()
+        if len(parts) != 5:
+            raise ValueError("A schedule needs five fields: minute hour day-of-month month day-of-week")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(part, *field) for part, field in zip(parts, FIELDS)
+        )
+        # Like cron, a restricted day of month and day of week match if either does
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(text, name, low, high):
+        values = set()
+        for item in text.split(','):
+            spec, _, step = item.partition('/')
+            try:
+                step = int(step) if step else 1
+                if spec == '*':
+                    start, end = low, high
+                elif '-' in spec:
+                    start, end = (int(x) for x in spec.split('-', 1))
+                else:
+                    start = end = int(spec)
+            except ValueError:
+                raise ValueError(f"Invalid {name} `{item}`")
+            # Day of week also accepts 7 for Sunday
+            top = 7 if name == 'day of week' else high
+            if step < 1 or start < low or end > top or start > end:
+                raise ValueError(f"Invalid {name} `{item}`")
+            values.update(v % 7 if top == 7 else v for v in range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day):
+        weekday = (day.weekday() + 1) % 7  # cron counts from Sunday
+        if self.any_day or self.any_weekday:
+            return day.day in self.days and weekday in self.weekdays
+        return day.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment (an aware datetime)"""
+        moment = moment.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = moment.replace(hour=0, minute=0)
+        # Walk day by day; four years covers every leap-day schedule
+        for _ in range(366 * 4 + 1):
+            if day.month in self.months and self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= moment:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Schedule `{self.expression}` never runs")
+
+def next_run_after(schedule, moment):
+    """Next launch epoch for a stored schedule, or None for a finished one-off"""
+    if not schedule.cron:
+        return None
+    return int(CronSchedule(schedule.cron).next_after(moment).timestamp())
+
+class GiveawayScheduler:
+    """Launches scheduled giveaways at their due time.
+
+    Sleeps until the earliest next_run instead of polling; wake() cuts the
+    sleep short when schedules are added or removed. Each launch first
+    advances next_run with a conditional UPDATE, so with several cluster
+    workers (or a restart mid-launch) a run is started at most once.
+    """
+
+    def __init__(self, db, launch, shard_count=None, shard_ids=None, stagger=LAUNCH_STAGGER_SECONDS):
+        self.db = db
+        self.launch = launch
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.stagger = stagger
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                # Cleared first so a wake() during the launches below isn't lost
+                self._wake.clear()
+                await self._launch_due()
+                next_run = await self.db.get_next_schedule_run(self.shard_count, self.shard_ids)
+                delay = MAX_SLEEP_SECONDS if next_run is None else min(max(next_run - time.time(), 0), MAX_SLEEP_SECONDS)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in giveaway scheduler: {e}")
+                await asyncio.sleep(60)
+
+    async def _launch_due(self):
+        now = datetime.now(timezone.utc)
+        due = await self.db.get_due_schedules(int(now.timestamp()), self.shard_count, self.shard_ids)
+        launched = 0
+        for schedule in due:
+            # A run missed during downtime is launched once, then the schedule skips ahead
+            if not await self.db.advance_schedule(schedule.id, schedule.next_run, next_run_after(schedule, now)):
+                continue
+            if launched:
+                await asyncio.sleep(self.stagger)
+            try:
+                await self.launch(schedule)
+                launched += 1
+            except Exception as e:
+                print(f"Error launching scheduled giveaway {schedule.id}: {e}")
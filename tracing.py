@@ -0,0 +1,283 @@
+"""Record the gateway events the bot handles and replay them offline.
+
+Recording is opt-in: set TRACE_FILE (ending in .gz for gzip) and main.py
+writes one compact NDJSON line per handled event. Discord ids are replaced
+with small per-trace integers and message text is reduced to its length, so
+traces carry the shape of production traffic but no user data. Those
+integers and the event times start again in each process, so every run
+gets its own file: TRACE_FILE with the cluster, start time and pid added,
+e.g. trace-c0-20260101T120000-4242.ndjson.gz. Restarts and cluster workers
+therefore never overwrite an earlier trace.
+
+Replay feeds a trace through main.py's real handlers using fake_discord's
+stand-in gateway and a scratch database:
+
+    python tracing.py trace.ndjson.gz --speed 10
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone, timedelta
+
+import discord
+
+from database import Database
+from fake_discord import FakeGateway, FakeInteraction, FakeMessage
+
+FLUSH_INTERVAL = 1.0
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+def run_trace_path(path, cluster_id=0):
+    """TRACE_FILE path for this process: the cluster, start time and pid before the extensions"""
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition(".")
+    label = f"c{cluster_id}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    return os.path.join(directory, f"{stem}-{label}{dot}{extensions}")
+
+class TraceRecorder:
+    """Writes anonymised events to a new trace file"""
+
+    def __init__(self, path):
+        self.path = path
+        # Exclusive create: never truncate an existing trace
+        self._file = _open(path, "x")
+        self._ids = {}
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        atexit.register(self.close)
+        print(f"Recording events to {path}")
+
+    def _anon(self, real_id):
+        if real_id is None:
+            return None
+        if real_id not in self._ids:
+            self._ids[real_id] = len(self._ids) + 1
+        return self._ids[real_id]
+
+    def _write(self, event, **fields):
+        now = time.monotonic()
+        fields = {k: v for k, v in fields.items() if v is not None}
+        record = {'t': round(now - self._started, 3), 'e': event, **fields}
+        self._file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def member_join(self, member, invite_code, inviter_id):
+        age_days = (datetime.now(timezone.utc) - member.created_at).days
+        self._write('join', g=self._anon(member.guild.id), u=self._anon(member.id), age=age_days,
+                    inv=self._anon(invite_code), by=self._anon(inviter_id))
+
+    def member_remove(self, member):
+        self._write('leave', g=self._anon(member.guild.id), u=self._anon(member.id))
+
+    def invite_create(self, invite):
+        self._write('inv+', g=self._anon(invite.guild.id), inv=self._anon(invite.code),
+                    by=self._anon(invite.inviter.id if invite.inviter else None))
+
+    def invite_delete(self, invite):
+        self._write('inv-', g=self._anon(invite.guild.id), inv=self._anon(invite.code))
+
+    def giveaway_click(self, interaction):
+        self._write('click', g=self._anon(interaction.guild.id), u=self._anon(interaction.user.id),
+                    m=self._anon(interaction.message.id))
+
+    def message_edit(self, before, after):
+        self._write('edit', g=self._anon(before.guild.id), u=self._anon(before.author.id),
+                    b=int(before.author.bot), n=len(before.content or ""), n2=len(after.content or ""))
+
+    def message_delete(self, message):
+        self._write('delete', g=self._anon(message.guild.id), u=self._anon(message.author.id),
+                    b=int(message.author.bot), n=len(message.content or ""))
+
+    def close(self):
+        self._file.close()
+
+def read_trace(path):
+    with _open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class TraceReplayer:
+    """Rebuilds guild state from a trace on a FakeGateway and drives main.py's handlers"""
+
+    def __init__(self, main, gateway):
+        self.main = main
+        self.gateway = gateway
+        self.guilds = {}
+        self.invites = {}
+        self.giveaways = {}
+        self.view = None
+
+    async def guild(self, anon_id):
+        guild = self.guilds.get(anon_id)
+        if guild is None:
+            guild = self.gateway.add_guild(f"guild{anon_id}")
+            welcome = guild.add_channel("welcome")
+            mod_log = guild.add_channel("mod-log")
+            guild.add_channel("general")
+            await self.main.db.set_welcome_channel(guild.id, welcome.id)
+            await self.main.db.set_mod_log_channel(guild.id, mod_log.id)
+            self.main.invite_cache[guild.id] = {}
+            self.guilds[anon_id] = guild
+        return guild
+
+    def member(self, guild, anon_id, age_days=365, bot=False):
+        member = guild.get_member(anon_id)
+        if member is None:
+            created_at = datetime.now(timezone.utc) - timedelta(days=age_days)
+            member = guild.add_member(f"user{anon_id}", user_id=anon_id, created_at=created_at, bot=bot)
+        return member
+
+    async def invite(self, guild, anon_code, inviter_anon):
+        key = (guild.id, anon_code)
+        invite = self.invites.get(key)
+        if invite is None:
+            inviter = self.member(guild, inviter_anon) if inviter_anon else None
+            invite = guild.add_invite(inviter, code=f"code{anon_code}")
+            # Invites that existed before recording started are seeded like cache_invites would
+            self.main.invite_cache[guild.id][invite.code] = invite.uses
+            await self.main.db.upsert_invite_code(invite.code, guild.id, inviter.id if inviter else None, invite.uses, invite.max_uses)
+            self.invites[key] = invite
+        return invite
+
+    async def giveaway_message(self, guild, anon_message):
+        key = (guild.id, anon_message)
+        message = self.giveaways.get(key)
+        if message is None:
+            channel = guild.get_channel(next(iter(guild.channels)))
+            ends_at = int(time.time()) + 7 * 86400
+            embed = discord.Embed(title=f"Replay Prize {anon_message}", color=0xFF0000)
+            embed.add_field(name="Hosted by:", value=guild.owner.mention, inline=False)
+            embed.add_field(name="Entries:", value="0", inline=True)
+            embed.add_field(name="Winners:", value="1", inline=True)
+            embed.add_field(name="Time:", value=f"<t:{ends_at}:R>", inline=True)
+            message = await channel.send(embed=embed)
+            await self.main.db.create_giveaway(guild.id, guild.owner.id, embed.title, message.id, channel.id, 1, ends_at)
+            self.giveaways[key] = message
+        return message
+
+    async def prepare(self, event):
+        """Set up state for one event and return the handler call to time"""
+        main = self.main
+        guild = await self.guild(event['g'])
+        kind = event['e']
+
+        if kind == 'join':
+            member = self.member(guild, event['u'], event.get('age', 365))
+            member.joined_at = datetime.now(timezone.utc)
+            if event.get('inv'):
+                invite = await self.invite(guild, event['inv'], event.get('by'))
+                invite.uses += 1
+            return main.on_member_join(member)
+        if kind == 'leave':
+            member = guild.members.pop(event['u'], None) or self.member(guild, event['u'])
+            return main.on_member_remove(member)
+        if kind == 'inv+':
+            inviter = self.member(guild, event['by']) if event.get('by') else None
+            invite = guild.add_invite(inviter, code=f"code{event['inv']}")
+            self.invites[(guild.id, event['inv'])] = invite
+            return main.on_invite_create(invite)
+        if kind == 'inv-':
+            invite = self.invites.pop((guild.id, event['inv']), None)
+            if invite is None:
+                return None
+            guild.invite_list.remove(invite)
+            return main.on_invite_delete(invite)
+        if kind == 'click':
+            message = await self.giveaway_message(guild, event['m'])
+            if self.view is None:
+                self.view = main.EnterGiveawayView()
+            interaction = FakeInteraction(self.gateway, self.member(guild, event['u']), message.channel, message)
+            return self.view.enter_giveaway.callback(interaction)
+
+        channel = guild.get_channel(list(guild.channels)[-1])
+        author = self.member(guild, event['u'], bot=bool(event.get('b')))
+        before = FakeMessage(self.gateway, channel, author, content="x" * event.get('n', 0))
+        if kind == 'edit':
+            after = FakeMessage(self.gateway, channel, author, content="y" * event.get('n2', 0))
+            after.id = before.id
+            return main.on_message_edit(before, after)
+        if kind == 'delete':
+            return main.on_message_delete(before)
+        return None
+
+async def replay(path, speed, db_path=None, api_latency=0.0):
+    # Imported here because main.py imports this module for the recorder
+    import main
+    from loadtest import percentile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        main.db = Database(db_path or os.path.join(tmp, "replay.db"))
+        await main.db.create_tables()
+        main.invite_cache.clear()
+        main.processed_joins.clear()
+        gateway = FakeGateway(api_latency)
+        gateway.install(main.bot)
+        replayer = TraceReplayer(main, gateway)
+
+        db_time = 0.0
+        def on_query(sql, seconds):
+            nonlocal db_time
+            db_time += seconds
+        main.db.add_query_observer(on_query)
+
+        latencies = {}
+        tasks = []
+
+        async def timed(kind, call):
+            start = time.perf_counter()
+            await call
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for event in read_trace(path):
+                if speed:
+                    delay = event['t'] / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                call = await replayer.prepare(event)
+                if call is not None:
+                    # Like discord.py, handlers for different events run concurrently
+                    tasks.append(asyncio.create_task(timed(event['e'], call)))
+            await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+        main.db.remove_query_observer(on_query)
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"Replayed {total} events in {wall:.2f}s ({total / wall if wall else 0:.1f} events/s), "
+          f"DB time {db_time * 1000:.1f}ms")
+    print(f"{'event':<8} {'count':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{kind:<8} {len(values):>7} {percentile(values, 50) * 1000:>8.3f} {percentile(values, 99) * 1000:>8.3f}")
+    for route, count in sorted(gateway.api_calls.items()):
+        print(f"    {route:<32} {count}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Replay a recorded event trace against the bot's handlers")
+    parser.add_argument("trace", help="Trace file written via TRACE_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier (0 = as fast as possible)")
+    parser.add_argument("--db", help="Scratch database path (default: a temporary file)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Simulated seconds per Discord API call")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed so winner draws replay identically")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    asyncio.run(replay(args.trace, args.speed, args.db, args.api_latency))
+
+if __name__ == "__main__":
+    main_cli()